@@ -0,0 +1,63 @@
+"""
+Compara requisições avulsas (requests.post) com o cliente HTTP compartilhado do pipeline.
+
+Uso:
+    python -m benchmarks.bench_http_pool --keys 200 --handshake-ms 30
+
+Cada chave faz as duas chamadas do pipeline (XML + DANFE) contra um servidor local.
+O servidor aplica um atraso a cada conexão nova, simulando o handshake TCP+TLS.
+"""
+import argparse
+import time
+import requests
+
+from benchmarks.mock_meudanfe import MockMeuDanfeServer, XML_PATH_PREFIX, DANFE_PATH
+from src.pipeline.http_client import MeuDanfeHttpClient, DEFAULT_HEADERS
+
+SAMPLE_KEY = "31250600506974000141550020002423721173242158"
+
+
+def run_bare_requests(base_url, keys):
+    for _ in range(keys):
+        xml = requests.post(f"{base_url}{XML_PATH_PREFIX}{SAMPLE_KEY}", headers=DEFAULT_HEADERS,
+                            data=SAMPLE_KEY.encode("utf-8"), timeout=10).content
+        requests.post(f"{base_url}{DANFE_PATH}", headers={"Content-Type": "text/plain"},
+                      data=xml, timeout=10)
+
+
+def run_pooled_client(base_url, keys):
+    client = MeuDanfeHttpClient(pool_connections=1, pool_maxsize=1)
+    try:
+        for _ in range(keys):
+            xml = client.post(f"{base_url}{XML_PATH_PREFIX}{SAMPLE_KEY}", data=SAMPLE_KEY.encode("utf-8")).content
+            client.post(f"{base_url}{DANFE_PATH}", data=xml, headers={"Content-Type": "text/plain"})
+    finally:
+        client.close()
+
+
+def measure(name, func, keys, handshake_seconds):
+    server = MockMeuDanfeServer(handshake_delay_seconds=handshake_seconds).start()
+    try:
+        start = time.perf_counter()
+        func(server.base_url, keys)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.stop()
+    print(f"{name:<22} {elapsed:8.3f}s  {keys / elapsed:8.1f} chaves/s  {server.connection_count:6d} conexões")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=200, help="Quantidade de chaves simuladas.")
+    parser.add_argument("--handshake-ms", type=float, default=30.0, help="Custo simulado de cada conexão nova (ms).")
+    args = parser.parse_args()
+
+    handshake_seconds = args.handshake_ms / 1000
+    bare = measure("requests.post avulso", run_bare_requests, args.keys, handshake_seconds)
+    pooled = measure("cliente compartilhado", run_pooled_client, args.keys, handshake_seconds)
+    print(f"Ganho: {bare / pooled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Mede o custo de inicialização do pipeline (import de src.main em um processo novo),
+relevante para execuções curtas disparadas por agendador (cron).
+
+Uso:
+    python -m benchmarks.bench_import_time --repeat 10
+
+Compara o import atual, em que os backends de XML são carregados sob demanda, com
+o equivalente ao comportamento anterior, em que o backend "navegador" (Selenium e
+webdriver_manager) era importado junto com src.pipeline.transform.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = (
+    ("sob demanda", "import src.main"),
+    ("navegador no import", "import src.main; import src.pipeline.fetchers.browser"),
+)
+
+# Executado em cada processo novo: mede só o import e informa o que foi carregado
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_seconds": elapsed,
+    "modules": len(sys.modules),
+    "selenium_loaded": "selenium" in sys.modules,
+}}))
+"""
+
+
+def measure_once(statement):
+    """
+    Roda o import em um interpretador novo. Retorna (medição do processo, segundos do processo inteiro).
+    """
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(statement=statement)],
+        cwd=PROJECT_DIR, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "falha no import")
+    return json.loads(completed.stdout.strip().splitlines()[-1]), wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="Processos medidos por cenário (vale a mediana).")
+    args = parser.parse_args()
+
+    print(f"{'cenário':<22} {'import ms':>10} {'processo ms':>12} {'módulos':>8}  selenium")
+    medians = {}
+    for name, statement in SCENARIOS:
+        try:
+            runs = [measure_once(statement) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{name:<22} não foi possível importar: {e}")
+            continue
+        import_ms = statistics.median(probe["import_seconds"] for probe, _ in runs) * 1000
+        wall_ms = statistics.median(wall for _, wall in runs) * 1000
+        probe = runs[-1][0]
+        medians[name] = wall_ms
+        print(f"{name:<22} {import_ms:>10.1f} {wall_ms:>12.1f} {probe['modules']:>8}  {'sim' if probe['selenium_loaded'] else 'não'}")
+
+    if len(medians) == len(SCENARIOS):
+        lazy, eager = (medians[name] for name, _ in SCENARIOS)
+        print(f"Ganho na partida a frio: {eager - lazy:.1f} ms por execução ({eager / lazy:.2f}x).")
+
+
+if __name__ == "__main__":
+    main()
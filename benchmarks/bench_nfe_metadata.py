@@ -0,0 +1,81 @@
+"""
+Microbenchmark da extração de metadados do XML da NF-e.
+
+Compara a implementação anterior de extract_note_number_from_xml (árvore
+completa + varredura de todos os elementos) com o extrator incremental
+de src/pipeline/nfe_metadata.py, sobre um conjunto de XMLs sintéticos com
+tamanhos de notas reais (de poucos itens a centenas de itens).
+
+Uso:
+    python -m benchmarks.bench_nfe_metadata --notes 200 --repeat 3
+"""
+import argparse
+import logging
+import time
+import xml.etree.ElementTree as ET
+
+from benchmarks.nfe_samples import build_nfe_xml, make_access_key
+from src.pipeline.nfe_metadata import extract_nfe_metadata
+
+# Distribuição de quantidade de itens por nota usada no corpus
+ITEM_COUNTS = (1, 3, 5, 10, 20, 50, 100, 300, 600)
+
+
+def legacy_extract_note_number(xml_content, logger):
+    """
+    Cópia da versão anterior de extract_note_number_from_xml, mantida apenas para comparação.
+    """
+    logger.info(f"xml{xml_content}")
+    root = ET.fromstring(xml_content)
+    logger.info(f"nfe number{root}")
+    for elem in root.iter():
+        if elem.tag.endswith("nNF"):
+            if elem.text:
+                return elem.text.strip()
+            break
+    return None
+
+
+def build_corpus(note_count):
+    corpus = []
+    for index in range(note_count):
+        key = make_access_key(number=index + 1)
+        corpus.append(build_nfe_xml(key, item_count=ITEM_COUNTS[index % len(ITEM_COUNTS)]))
+    return corpus
+
+
+def measure(name, func, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for xml_content in corpus:
+            func(xml_content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<40} {best * 1000:9.1f} ms  {best / len(corpus) * 1e6:9.1f} µs/nota")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=200, help="Quantidade de XMLs no corpus.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetições (vale o melhor tempo).")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.notes)
+    total_bytes = sum(len(xml_content) for xml_content in corpus)
+    print(f"Corpus: {len(corpus)} notas, {total_bytes / 1024 / 1024:.1f} MB "
+          f"(maior: {max(len(x) for x in corpus) / 1024:.0f} KB)")
+
+    # Logger desligado: mede o custo de montar as mensagens, não o de gravá-las
+    quiet_logger = logging.getLogger("bench_nfe_metadata")
+    quiet_logger.disabled = True
+
+    legacy = measure("anterior (árvore completa)", lambda x: legacy_extract_note_number(x, quiet_logger), corpus, args.repeat)
+    fast = measure("incremental, apenas nNF", lambda x: extract_nfe_metadata(x, fields=("note_number",)), corpus, args.repeat)
+    full = measure("registro completo (todos os campos)", extract_nfe_metadata, corpus, args.repeat)
+    print(f"Ganho (nNF): {legacy / fast:.1f}x | Ganho (registro completo): {legacy / full:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Executa o pipeline completo (python -m src.main) contra o servidor local que imita o
+ws.meudanfe.com e compara os modos de execução.
+
+Uso:
+    python -m benchmarks.bench_pipeline --keys 100 1000 --modes sequencial concorrente estagios
+    python -m benchmarks.bench_pipeline --keys 10000 --xml-latency lognormal:80,0.6 --burst-every 500 --burst-length 20
+    python -m benchmarks.bench_pipeline --keys 1000 --json atual.json --compare base.json --tolerance 0.15
+
+Para cada combinação (quantidade de chaves, modo) são gerados arquivos "CHAVES FILIAL NN.txt"
+sintéticos em uma pasta temporária, e o pipeline roda em um processo próprio, configurado
+pelas variáveis de ambiente NOTAS_* (ver final de src/config.py): pastas temporárias,
+URLs do servidor local e apenas o backend "api" (sem navegador). O resultado vem do relatório JSON da
+execução (chaves/s, percentis de latência por chave) e do uso de recursos do processo
+(pico de memória RSS e tempo de CPU).
+
+Com --compare, o resultado é comparado a uma execução anterior gravada com --json e o
+script termina com código 1 se algum cenário ficou mais lento que a tolerância permite.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.mock_meudanfe import (
+    DANFE_PATH,
+    XML_PATH_PREFIX,
+    EndpointBehavior,
+    LatencyDistribution,
+    MockMeuDanfeServer,
+)
+from benchmarks.nfe_samples import make_access_key
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXECUTION_MODES = ("sequencial", "concorrente", "estagios")
+
+# Métricas comparadas com --compare: (campo, True se maior é melhor)
+REGRESSION_FIELDS = (
+    ("keys_per_second", True),
+    ("p99_seconds", False),
+    ("peak_rss_mb", False),
+)
+
+
+def write_key_files(folder, key_count, filial_count):
+    """
+    Gera `key_count` chaves de acesso válidas distribuídas entre `filial_count` arquivos.
+    Cada filial usa um CNPJ emitente próprio, para as chaves não se repetirem.
+    """
+    os.makedirs(folder, exist_ok=True)
+    per_filial = -(-key_count // filial_count)
+    written = 0
+    for filial in range(1, filial_count + 1):
+        count = min(per_filial, key_count - written)
+        if count <= 0:
+            break
+        cnpj = f"{10000000 + filial:08d}0001{filial % 100:02d}"
+        path = os.path.join(folder, f"CHAVES FILIAL {filial:02d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for number in range(1, count + 1):
+                f.write(make_access_key(cnpj=cnpj, number=number) + "\n")
+        written += count
+
+
+def build_environment(base_url, work_dir, mode, args):
+    """
+    Variáveis NOTAS_* que apontam o pipeline para o servidor local e para `work_dir`.
+    """
+    overrides = {
+        "INPUT_FOLDER": os.path.join(work_dir, "CHAVES NOTAS"),
+        "OUTPUT_BASE_FOLDER": os.path.join(work_dir, "NOTAS E XML"),
+        "LOG_FOLDER": os.path.join(work_dir, "LOGS"),
+        "STATE_FOLDER": os.path.join(work_dir, "ESTADO"),
+        "RUN_STATE_DB_PATH": os.path.join(work_dir, "ESTADO", "execucao.sqlite3"),
+        "NEGATIVE_CACHE_PATH": os.path.join(work_dir, "ESTADO", "chaves_nao_encontradas.json"),
+        "MEUDANFE_API_XML_DOWNLOAD_BASE_URL": f"{base_url}{XML_PATH_PREFIX}",
+        "MEUDANFE_API_DANFE_GENERATION_URL": f"{base_url}{DANFE_PATH}",
+        "EXECUTION_MODE": mode,
+        "MAX_WORKERS": args.workers,
+        "STAGE_XML_WORKERS": args.workers,
+        "HTTP_POOL_MAXSIZE": args.workers,
+        "RATE_LIMIT_REQUESTS_PER_SECOND": args.rate_limit,
+        "RATE_LIMIT_MAX_IN_FLIGHT": args.workers * 2,
+        "DANFE_GENERATION_MODE": args.danfe_mode,
+        "OUTPUT_MODE": args.output_mode,
+        "STREAMING_TRANSFER_ENABLED": int(args.streaming),
+        "STREAMING_SPOOL_FOLDER": os.path.join(work_dir, "NOTAS E XML", ".transferencias"),
+        "XML_FETCHER_ORDER": '["api"]',
+        "RESUME_ENABLED": 1,
+        "METRICS_REPORT_ENABLED": 1,
+        "METRICS_HTTP_PORT": "none",
+        "LOG_LEVEL": args.log_level,
+        # Sem isso, uma rajada de 502 faria o pipeline esperar os tempos reais de backoff
+        "RETRY_BASE_DELAY_SECONDS": 0.05,
+        "RETRY_MAX_DELAY_SECONDS": 0.5,
+        "CIRCUIT_BREAKER_RECOVERY_SECONDS": 1,
+    }
+    env = dict(os.environ)
+    env.update({f"NOTAS_{name}": str(value) for name, value in overrides.items()})
+    return env
+
+
+def run_pipeline_process(env, log_path):
+    """
+    Roda `python -m src.main` e retorna (código de saída, segundos, rusage do processo filho).
+    """
+    with open(log_path, "wb") as console:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "src.main"], cwd=PROJECT_DIR, env=env,
+            stdout=console, stderr=subprocess.STDOUT,
+        )
+        # wait4 devolve o uso de recursos apenas deste processo (não acumula entre cenários)
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, elapsed, rusage
+
+
+def read_run_report(log_folder):
+    reports = sorted(glob.glob(os.path.join(log_folder, "relatorio_*.json")))
+    if not reports:
+        return None
+    with open(reports[-1], encoding="utf-8") as f:
+        return json.load(f)
+
+
+def histogram_summary(report, name):
+    """
+    Resumo (count/percentis) da série mais observada de um histograma do relatório;
+    para key_seconds, é a das chaves salvas.
+    """
+    series = report.get("histograms", {}).get(name, [])
+    if not series:
+        return {}
+    return max(series, key=lambda entry: entry["count"])
+
+
+def run_scenario(server, key_count, mode, args):
+    work_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        write_key_files(os.path.join(work_dir, "CHAVES NOTAS"), key_count, args.filiais)
+        env = build_environment(server.base_url, work_dir, mode, args)
+        exit_code, elapsed, rusage = run_pipeline_process(env, os.path.join(work_dir, "console.txt"))
+        report = read_run_report(env["NOTAS_LOG_FOLDER"])
+        if exit_code != 0 or report is None:
+            with open(os.path.join(work_dir, "console.txt"), encoding="utf-8", errors="replace") as f:
+                tail = f.read()[-2000:]
+            raise RuntimeError(f"Pipeline falhou no cenário {key_count} chaves/{mode} (código {exit_code}):\n{tail}")
+
+        latency = histogram_summary(report, "key_seconds")
+        return {
+            "keys": key_count,
+            "mode": mode,
+            "keys_saved": report["keys_saved"],
+            "keys_failed": report["keys_failed"],
+            "wall_seconds": round(elapsed, 3),
+            "keys_per_second": report["keys_per_second"],
+            "p50_seconds": latency.get("p50"),
+            "p95_seconds": latency.get("p95"),
+            "p99_seconds": latency.get("p99"),
+            "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),  # ru_maxrss vem em KB no Linux
+            "cpu_seconds": round(rusage.ru_utime + rusage.ru_stime, 3),
+        }
+    finally:
+        if args.keep:
+            print(f"Arquivos do cenário mantidos em: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def format_seconds(value):
+    return f"{value * 1000:8.1f}" if value is not None else f"{'-':>8}"
+
+
+def print_results(results):
+    print(f"{'chaves':>7} {'modo':<12} {'salvas':>7} {'falhas':>6} {'chaves/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>7} {'CPU s':>7}")
+    for result in results:
+        print(
+            f"{result['keys']:>7} {result['mode']:<12} {result['keys_saved']:>7} {result['keys_failed']:>6} "
+            f"{result['keys_per_second']:>9.1f} {format_seconds(result['p50_seconds'])} "
+            f"{format_seconds(result['p95_seconds'])} {format_seconds(result['p99_seconds'])} "
+            f"{result['peak_rss_mb']:>7.1f} {result['cpu_seconds']:>7.2f}"
+        )
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compara cada cenário com o mesmo cenário (chaves, modo) da execução de referência.
+    Retorna mensagens descrevendo as métricas que pioraram além de `tolerance` (fração).
+    """
+    reference = {(entry["keys"], entry["mode"]): entry for entry in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        previous = reference.get((result["keys"], result["mode"]))
+        if previous is None:
+            continue
+        for field, higher_is_better in REGRESSION_FIELDS:
+            current, before = result.get(field), previous.get(field)
+            if not current or not before:
+                continue
+            change = (before - current) / before if higher_is_better else (current - before) / before
+            if change > tolerance:
+                regressions.append(
+                    f"{result['keys']} chaves/{result['mode']}: {field} {before} -> {current} ({change:+.0%} pior)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, nargs="+", default=[100, 1000], help="Quantidades de chaves (ex: 100 10000 100000).")
+    parser.add_argument("--modes", nargs="+", choices=EXECUTION_MODES, default=list(EXECUTION_MODES), help="Modos de execução comparados.")
+    parser.add_argument("--filiais", type=int, default=4, help="Quantidade de arquivos de filial gerados.")
+    parser.add_argument("--workers", type=int, default=8, help="Workers do pipeline (MAX_WORKERS).")
+    parser.add_argument("--rate-limit", type=float, default=1000.0, help="Requisições por segundo permitidas ao pipeline.")
+    parser.add_argument("--danfe-mode", choices=("remoto", "local"), default="remoto", help="DANFE_GENERATION_MODE.")
+    parser.add_argument("--output-mode", choices=("arquivos", "pacote"), default="arquivos", help="OUTPUT_MODE.")
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL do pipeline durante o benchmark.")
+    parser.add_argument("--xml-latency", default="uniforme:20-60", help="Latência do endpoint de XML (ms): fixa:N, uniforme:A-B, lognormal:MEDIANA,SIGMA.")
+    parser.add_argument("--danfe-latency", default="uniforme:40-120", help="Latência do endpoint de DANFE (ms).")
+    parser.add_argument("--burst-every", type=int, default=0, help="A cada N requisições de cada endpoint começa uma rajada de 502 (0 desliga).")
+    parser.add_argument("--burst-length", type=int, default=0, help="Requisições seguidas com 502 em cada rajada.")
+    parser.add_argument("--streaming", action="store_true", help="STREAMING_TRANSFER_ENABLED: XML/PDF da rede direto para o disco.")
+    parser.add_argument("--xml-items", type=int, default=10, help="Itens por XML (~0,8 KB cada).")
+    parser.add_argument("--pdf-kb", type=int, default=60, help="Tamanho do PDF devolvido (KB).")
+    parser.add_argument("--json", dest="json_path", help="Grava os resultados neste arquivo JSON.")
+    parser.add_argument("--compare", help="JSON de uma execução anterior (--json) para detectar regressões.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Piora aceita antes de acusar regressão (fração).")
+    parser.add_argument("--keep", action="store_true", help="Mantém as pastas temporárias de cada cenário.")
+    args = parser.parse_args()
+
+    server = MockMeuDanfeServer(
+        xml_behavior=EndpointBehavior(LatencyDistribution.parse(args.xml_latency), args.burst_every, args.burst_length),
+        danfe_behavior=EndpointBehavior(LatencyDistribution.parse(args.danfe_latency), args.burst_every, args.burst_length),
+        xml_item_count=args.xml_items,
+        pdf_size_bytes=args.pdf_kb * 1024,
+    ).start()
+    print(
+        f"Servidor simulado em {server.base_url} (XML {server.xml_behavior.latency}, "
+        f"DANFE {server.danfe_behavior.latency}, 502 a cada {args.burst_every or '-'} x{args.burst_length})"
+    )
+
+    results = []
+    try:
+        for key_count in args.keys:
+            for mode in args.modes:
+                print(f"Executando {key_count} chave(s) no modo '{mode}'...", flush=True)
+                results.append(run_scenario(server, key_count, mode, args))
+    finally:
+        server.stop()
+
+    print()
+    print_results(results)
+    print(f"\n502 devolvidos: XML {server.xml_behavior.error_count}, DANFE {server.danfe_behavior.error_count}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressões em relação a", args.compare)
+            for message in regressions:
+                print(f"  - {message}")
+            sys.exit(1)
+        print(f"\nSem regressões em relação a {args.compare} (tolerância {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
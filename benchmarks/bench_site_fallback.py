@@ -0,0 +1,97 @@
+"""
+Exercita o backend "site" (fluxo do site via HTTP, sem navegador) contra o servidor local
+com respostas gravadas do www.meudanfe.com.br (benchmarks/mock_meudanfe_site.py).
+
+Uso:
+    python -m benchmarks.bench_site_fallback --keys 200 --workers 8
+    python -m benchmarks.bench_site_fallback --keys 500 --latency lognormal:40,0.5 --session-max-requests 30
+
+As chaves passam pelos backends "api" e "site", nessa ordem, como no pipeline: o servidor
+recusa o download direto (403) e só entrega o XML depois da consulta feita na mesma
+sessão, então todo XML obtido prova que cookies, token e ordem dos passos foram
+reproduzidos. Termina com código 1 se alguma chave ficou sem XML.
+"""
+import argparse
+import logging
+import os
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_meudanfe import XML_PATH_PREFIX
+from benchmarks.mock_meudanfe_site import MockMeuDanfeSiteServer
+from benchmarks.nfe_samples import make_access_key
+
+
+def fetch_key(key, logger):
+    from src.pipeline.fetchers import iter_fetchers
+
+    started = time.perf_counter()
+    for fetcher in iter_fetchers():
+        result = fetcher.fetch(key, logger)
+        if result.content:
+            return fetcher.source, time.perf_counter() - started
+        if result.stop_fallback:
+            break
+    return None, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=200, help="Quantidade de chaves.")
+    parser.add_argument("--workers", type=int, default=8, help="Chaves processadas em paralelo.")
+    parser.add_argument("--latency", default="fixa:5", help="Latência das rotas do site (ver LatencyDistribution).")
+    parser.add_argument("--session-max-requests", type=int, default=0, help="Requisições por sessão antes de o site expirá-la (0 = nunca).")
+    args = parser.parse_args()
+
+    server = MockMeuDanfeSiteServer(latency=args.latency, session_max_requests=args.session_max_requests).start()
+    # src.config lê as variáveis NOTAS_* no import: precisam existir antes de importar o pipeline
+    os.environ.update({
+        "NOTAS_MEUDANFE_WEB_URL": f"{server.base_url}/",
+        "NOTAS_MEUDANFE_API_XML_DOWNLOAD_BASE_URL": f"{server.base_url}{XML_PATH_PREFIX}",
+        "NOTAS_XML_FETCHER_ORDER": '["api", "site"]',
+        "NOTAS_SITE_SESSION_POOL_SIZE": str(args.workers),
+        "NOTAS_HTTP_POOL_MAXSIZE": str(args.workers),
+    })
+    from src.pipeline.fetchers import close_fetchers
+    from src.pipeline.http_client import close_http_client
+
+    logger = logging.getLogger("bench_site_fallback")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    keys = [make_access_key(number=index + 1) for index in range(args.keys)]
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(lambda key: fetch_key(key, logger), keys))
+    finally:
+        elapsed = time.perf_counter() - started
+        close_fetchers()
+        close_http_client()
+        server.stop()
+
+    by_source = {}
+    for source, _ in results:
+        by_source[source or "nenhuma"] = by_source.get(source or "nenhuma", 0) + 1
+    latencies = sorted(seconds for _, seconds in results)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    site_requests = sum(server.route_counts.values())
+
+    print(f"Chaves: {args.keys}  workers: {args.workers}  latência do site: {server.latency}")
+    print(f"XML por origem: {', '.join(f'{source}={count}' for source, count in sorted(by_source.items()))}")
+    print(f"Vazão: {args.keys / elapsed:.1f} chaves/s  p50: {statistics.median(latencies) * 1000:.1f} ms  p95: {p95 * 1000:.1f} ms")
+    print(f"Sessões abertas no site: {server.sessions_created}  requisições por chave: {site_requests / max(1, args.keys):.2f}")
+    for route, count in sorted(server.route_counts.items()):
+        print(f"  {route:<45} {count:>7}")
+    # ru_maxrss vem em KB no Linux
+    print(f"Pico de memória do processo: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+    if by_source.get("nenhuma"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
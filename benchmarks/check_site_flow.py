@@ -0,0 +1,188 @@
+"""
+Verificações do backend "site" contra o site simulado (benchmarks/mock_meudanfe_site.py),
+sem rede. Diferente dos benchmarks, não mede tempo: cada verificação passa ou falha.
+
+Uso:
+    python -m benchmarks.check_site_flow
+
+Verifica que:
+    - cada passo de DEFAULT_SITE_FLOW chega ao site, na quantidade esperada por chave/sessão;
+    - uma sessão reaproveitada que expirou (401, 403 ou 419) é refeita uma única vez com
+      uma sessão nova, e uma sessão nova que falha não é repetida;
+    - looks_like_xml aceita o XML da nota e recusa páginas HTML e respostas JSON de erro.
+
+Termina com código 1 se alguma verificação falhar.
+"""
+import logging
+import os
+import sys
+import traceback
+from urllib.parse import urlsplit
+
+from benchmarks.mock_meudanfe import XML_PATH_PREFIX, build_sample_xml
+from benchmarks.mock_meudanfe_site import MockMeuDanfeSiteServer, load_fixture, route_of
+from benchmarks.nfe_samples import make_access_key
+
+SESSION_EXPIRED_STATUS = (401, 403, 419)
+
+
+def _configure(base_url):
+    # src.config lê as variáveis NOTAS_* no import: precisam existir antes de importar o pipeline
+    os.environ.update({
+        "NOTAS_MEUDANFE_WEB_URL": f"{base_url}/",
+        "NOTAS_MEUDANFE_API_XML_DOWNLOAD_BASE_URL": f"{base_url}{XML_PATH_PREFIX}",
+        "NOTAS_SITE_FLOW_PATH": "null",
+        # Uma única sessão: as chaves seguintes reaproveitam os cookies da anterior
+        "NOTAS_SITE_SESSION_POOL_SIZE": "1",
+        "NOTAS_SITE_SESSION_MAX_USES": "1000",
+    })
+
+
+def _new_logger():
+    logger = logging.getLogger("check_site_flow")
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return logger
+
+
+def _fetch_keys(server, keys):
+    """
+    Busca as chaves, em ordem, com um SiteXmlFetcher novo. Retorna os FetchResult.
+    """
+    from src.pipeline.fetchers.site import SiteXmlFetcher
+
+    fetcher = SiteXmlFetcher()
+    try:
+        return [fetcher.fetch(key, _new_logger()) for key in keys]
+    finally:
+        fetcher.close()
+
+
+def _expected_routes(base_url, keys, sessions):
+    """
+    Requisições esperadas por rota: passos once_per_session uma vez por sessão, os demais uma vez por chave.
+    """
+    from src.pipeline.fetchers.site import DEFAULT_SITE_FLOW, render_template
+
+    variables = {
+        "web_url": f"{base_url}/",
+        "api_url": base_url,
+        "xml_url": f"{base_url}{XML_PATH_PREFIX}",
+        "key": keys[0],
+    }
+    expected = {}
+    for step in DEFAULT_SITE_FLOW:
+        route = route_of(step["method"], urlsplit(render_template(step["url"], variables)).path or "/")
+        expected[route] = expected.get(route, 0) + (sessions if step.get("once_per_session") else len(keys))
+    return expected
+
+
+def check_default_flow_steps(port):
+    keys = [make_access_key(number=number) for number in (1, 2, 3)]
+    server = MockMeuDanfeSiteServer(port=port).start()
+    try:
+        results = _fetch_keys(server, keys)
+    finally:
+        server.stop()
+
+    for key, result in zip(keys, results):
+        assert result.content == build_sample_xml(key), f"XML da chave {key} diferente do entregue pelo site"
+    assert server.sessions_created == 1, f"esperada 1 sessão no site, abertas {server.sessions_created}"
+    expected = _expected_routes(server.base_url, keys, sessions=1)
+    assert server.route_counts == expected, f"requisições por rota {server.route_counts}, esperadas {expected}"
+
+
+def check_expired_session_retried_once(port, status):
+    keys = [make_access_key(number=number) for number in (1, 2)]
+    # Cada chave faz 2 requisições com a sessão (consulta e XML): a segunda chave a encontra expirada
+    server = MockMeuDanfeSiteServer(port=port, session_max_requests=2, expired_status=status).start()
+    try:
+        results = _fetch_keys(server, keys)
+    finally:
+        server.stop()
+
+    for key, result in zip(keys, results):
+        assert result.content == build_sample_xml(key), f"chave {key} sem XML após a sessão expirar com {status}"
+        assert not result.not_found, f"sessão expirada ({status}) tratada como nota não encontrada"
+    assert server.sessions_created == 2, f"esperadas 2 sessões no site (uma nova para a repetição), abertas {server.sessions_created}"
+    expected = _expected_routes(server.base_url, keys, sessions=2)
+    # A consulta recusada da segunda chave também chega ao site
+    expected[route_of("POST", f"/api/v1/get/nfe/data/MEUDANFE/{keys[1]}")] += 1
+    assert server.route_counts == expected, f"requisições por rota {server.route_counts}, esperadas {expected}"
+
+
+def check_fresh_session_not_retried(port):
+    key = make_access_key(number=1)
+    # A sessão expira já no download do XML da primeira chave: sessão nova não é refeita
+    server = MockMeuDanfeSiteServer(port=port, session_max_requests=1, expired_status=419).start()
+    try:
+        (result,) = _fetch_keys(server, [key])
+    finally:
+        server.stop()
+
+    assert result.content is None, "chave com sessão nova recusada não deveria ter XML"
+    assert not result.not_found, "sessão recusada tratada como nota não encontrada"
+    assert server.sessions_created == 1, f"sessão nova recusada foi repetida ({server.sessions_created} sessões)"
+    expected = _expected_routes(server.base_url, [key], sessions=1)
+    assert server.route_counts == expected, f"requisições por rota {server.route_counts}, esperadas {expected}"
+
+
+def check_looks_like_xml():
+    from src.pipeline.fetchers.site import looks_like_xml
+
+    fixture = load_fixture()
+    xml = build_sample_xml(make_access_key(number=1))
+    xml = xml if isinstance(xml, bytes) else xml.encode("utf-8")
+    accepted = {
+        "XML da nota": xml,
+        "XML com espaços antes": b"\n  " + xml,
+        "XML sem declaração": b"<nfeProc><NFe/></nfeProc>",
+    }
+    rejected = {
+        "página inicial": fixture["pagina_inicial"].encode("utf-8"),
+        "página ver-danfe": fixture["ver_danfe"].encode("utf-8"),
+        "HTML sem doctype": b"  <HTML><body>Login</body></html>",
+        "JSON de acesso negado": fixture["acesso_negado"].encode("utf-8"),
+        "JSON de sessão inválida": fixture["sessao_invalida"].encode("utf-8"),
+        "corpo vazio": b"",
+    }
+    for name, content in accepted.items():
+        assert looks_like_xml(content), f"{name} recusado por looks_like_xml"
+    for name, content in rejected.items():
+        assert not looks_like_xml(content), f"{name} aceito por looks_like_xml"
+
+
+def main():
+    # A porta é fixada antes de importar o pipeline: cada verificação sobe um site novo nele
+    probe = MockMeuDanfeSiteServer()
+    port = probe.server_address[1]
+    probe.server_close()
+    _configure(f"http://127.0.0.1:{port}")
+
+    checks = [("passos de DEFAULT_SITE_FLOW", lambda: check_default_flow_steps(port))]
+    for status in SESSION_EXPIRED_STATUS:
+        checks.append((f"sessão expirada ({status}) refeita uma vez", lambda status=status: check_expired_session_retried_once(port, status)))
+    checks.append(("sessão nova recusada não é repetida", lambda: check_fresh_session_not_retried(port)))
+    checks.append(("looks_like_xml", check_looks_like_xml))
+
+    failures = 0
+    for name, check in checks:
+        try:
+            check()
+        except AssertionError as e:
+            failures += 1
+            print(f"FALHA  {name}: {e}")
+        except Exception:
+            failures += 1
+            print(f"ERRO   {name}:\n{traceback.format_exc()}")
+        else:
+            print(f"ok     {name}")
+
+    print(f"\n{len(checks) - failures}/{len(checks)} verificações passaram.")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
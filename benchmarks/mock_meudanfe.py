@@ -0,0 +1,213 @@
+"""
+Servidor local que imita os endpoints do ws.meudanfe.com usados pelo pipeline.
+
+Serve apenas para benchmarks: nenhuma chamada sai da máquina.
+    POST /api/v1/get/nfe/xml/<chave>          -> XML da nota
+    POST /api/v1/get/nfe/xmltodanfepdf/API    -> PDF (bytes fictícios)
+
+Latência, rajadas de 502 e tamanho das respostas são configuráveis por endpoint,
+para reproduzir o comportamento do serviço real sob carga.
+"""
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.nfe_samples import build_nfe_xml
+
+XML_PATH_PREFIX = "/api/v1/get/nfe/xml/"
+DANFE_PATH = "/api/v1/get/nfe/xmltodanfepdf/API"
+
+
+# Corpo devolvido nas rajadas de 502 (o serviço real responde com HTML do proxy)
+BAD_GATEWAY_BODY = (
+    b"<html><head><title>502 Bad Gateway</title></head>"
+    b"<body><h1>502 Bad Gateway</h1><p>Please try again in 5 seconds.</p></body></html>"
+)
+
+
+def build_sample_xml(key, item_count=1):
+    """
+    Monta um XML de NF-e coerente com os campos da chave de acesso.
+    """
+    return build_nfe_xml(key, item_count=item_count)
+
+
+def build_sample_pdf(size_bytes=1024):
+    """
+    PDF fictício com o tamanho pedido (apenas o cabeçalho é válido).
+    """
+    header = b"%PDF-1.4\n"
+    return header + b"0" * max(0, size_bytes - len(header))
+
+
+class LatencyDistribution:
+    """
+    Distribuição do tempo de resposta de um endpoint, em milissegundos.
+
+    Formatos aceitos por parse():
+        "0" ou "fixa:20"         -> sempre 20 ms
+        "uniforme:10-50"         -> uniforme entre 10 e 50 ms
+        "lognormal:40,0.5"       -> lognormal com mediana 40 ms e sigma 0.5 (cauda longa)
+    """
+
+    def __init__(self, kind="fixa", params=(0.0,), seed=None):
+        if kind not in ("fixa", "uniforme", "lognormal"):
+            raise ValueError(f"Distribuição de latência desconhecida: {kind!r}")
+        self.kind = kind
+        self.params = tuple(float(value) for value in params)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec, seed=None):
+        spec = str(spec).strip()
+        kind, _, values = spec.partition(":")
+        if not values:
+            return cls("fixa", (float(kind),), seed=seed)
+        separator = "-" if kind == "uniforme" else ","
+        return cls(kind, values.split(separator), seed=seed)
+
+    def sample_seconds(self):
+        with self._lock:
+            if self.kind == "fixa":
+                millis = self.params[0]
+            elif self.kind == "uniforme":
+                millis = self._random.uniform(self.params[0], self.params[1])
+            else:
+                median, sigma = self.params
+                millis = self._random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        return max(0.0, millis) / 1000.0
+
+    def __str__(self):
+        separator = "-" if self.kind == "uniforme" else ","
+        return f"{self.kind}:{separator.join(f'{value:g}' for value in self.params)}"
+
+
+class EndpointBehavior:
+    """
+    Comportamento de um endpoint do servidor simulado.
+
+    Args:
+        latency (LatencyDistribution | str): Tempo de resposta.
+        burst_every (int): A cada `burst_every` requisições começa uma rajada de 502 (0 desliga).
+        burst_length (int): Quantas requisições seguidas recebem 502 em cada rajada.
+    """
+
+    def __init__(self, latency="0", burst_every=0, burst_length=0):
+        self.latency = latency if isinstance(latency, LatencyDistribution) else LatencyDistribution.parse(latency)
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.request_count = 0
+        self.error_count = 0
+        self._lock = threading.Lock()
+
+    def next_response_fails(self):
+        """
+        Conta a requisição e indica se ela cai dentro de uma rajada de 502.
+        """
+        with self._lock:
+            position = self.request_count
+            self.request_count += 1
+            fails = bool(self.burst_every and self.burst_length) and (
+                position % self.burst_every >= self.burst_every - self.burst_length
+            )
+            if fails:
+                self.error_count += 1
+            return fails
+
+
+class MockMeuDanfeHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 mantém a conexão aberta entre requisições (keep-alive)
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.register_connection()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond(self, behavior, build_body, content_type):
+        delay = behavior.latency.sample_seconds()
+        if delay:
+            time.sleep(delay)
+        if behavior.next_response_fails():
+            self._send(502, BAD_GATEWAY_BODY, "text/html")
+        else:
+            self._send(200, build_body(), content_type)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        if self.path.startswith(XML_PATH_PREFIX):
+            key = self.path[len(XML_PATH_PREFIX):]
+            self._respond(
+                self.server.xml_behavior,
+                lambda: build_sample_xml(key, item_count=self.server.xml_item_count),
+                "application/xml",
+            )
+        elif self.path == DANFE_PATH:
+            self._respond(self.server.danfe_behavior, lambda: self.server.pdf_body, "application/pdf")
+        else:
+            self._send(404, b"not found", "text/plain")
+
+
+class MockMeuDanfeServer(ThreadingHTTPServer):
+    """
+    Servidor HTTP em thread própria que conta quantas conexões TCP foram abertas.
+
+    Args:
+        handshake_delay_seconds (float): Atraso aplicado a cada conexão nova,
+            simulando o custo de um handshake TCP+TLS com o servidor real.
+        xml_behavior (EndpointBehavior): Latência e rajadas de 502 do endpoint de XML.
+        danfe_behavior (EndpointBehavior): Latência e rajadas de 502 do endpoint de DANFE.
+        xml_item_count (int): Itens (<det>) por XML, controla o tamanho da resposta.
+        pdf_size_bytes (int): Tamanho do PDF devolvido.
+    """
+
+    daemon_threads = True
+    # Muitos clientes simultâneos nos benchmarks: a fila padrão (5) recusaria conexões
+    request_queue_size = 128
+
+    def __init__(self, host="127.0.0.1", port=0, handshake_delay_seconds=0.0,
+                 handler_class=MockMeuDanfeHandler, xml_behavior=None, danfe_behavior=None,
+                 xml_item_count=1, pdf_size_bytes=1024):
+        super().__init__((host, port), handler_class)
+        self.handshake_delay_seconds = handshake_delay_seconds
+        self.xml_behavior = xml_behavior or EndpointBehavior()
+        self.danfe_behavior = danfe_behavior or EndpointBehavior()
+        self.xml_item_count = xml_item_count
+        self.pdf_body = build_sample_pdf(pdf_size_bytes)
+        self.connection_count = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    def register_connection(self):
+        with self._count_lock:
+            self.connection_count += 1
+        if self.handshake_delay_seconds:
+            time.sleep(self.handshake_delay_seconds)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
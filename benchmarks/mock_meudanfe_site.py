@@ -0,0 +1,196 @@
+"""
+Servidor local que imita o caminho do site www.meudanfe.com.br, com respostas gravadas
+do site (benchmarks/fixtures/meudanfe_site.json). Exercita o backend "site" sem rede.
+
+    GET  /                                     -> página inicial, cookie de sessão e token (meta csrf-token)
+    POST /api/v1/get/nfe/data/MEUDANFE/<chave> -> consulta da chave (exige cookie e header x-csrf-token)
+    GET  /ver-danfe                            -> página de resultado
+    POST /api/v1/get/nfe/xml/<chave>           -> XML, apenas para chaves consultadas na mesma sessão
+
+Sem a consulta prévia, o download do XML responde 403, como acontece quando a API
+direta falha: o backend "api" falha e o "site" precisa refazer o caminho completo.
+Com `expired_status`, uma sessão expirada recebe esse status (ex: 419) em qualquer rota da API.
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.mock_meudanfe import XML_PATH_PREFIX, LatencyDistribution, build_sample_xml
+
+CONSULT_PATH_PREFIX = "/api/v1/get/nfe/data/MEUDANFE/"
+SESSION_COOKIE = "sessao"
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "meudanfe_site.json")
+
+
+def route_of(method, path):
+    """
+    Rota usada na contagem de requisições: "METODO /caminho", com a chave trocada por <chave>.
+    """
+    for prefix in (CONSULT_PATH_PREFIX, XML_PATH_PREFIX):
+        if path.startswith(prefix):
+            path = prefix + "<chave>"
+    return f"{method} {path}"
+
+
+def load_fixture(path=FIXTURE_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class SiteSessionState:
+    __slots__ = ("token", "consulted_keys", "requests")
+
+    def __init__(self):
+        self.token = secrets.token_hex(16)
+        self.consulted_keys = set()
+        self.requests = 0
+
+
+class MockMeuDanfeSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type, cookie=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if cookie:
+            self.send_header("Set-Cookie", f"{SESSION_COOKIE}={cookie}; Path=/; HttpOnly")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _session(self):
+        """
+        Sessão do cookie da requisição e se ela expirou (cookie de uma sessão que já não vale).
+        """
+        cookie = SimpleCookie(self.headers.get("Cookie") or "")
+        morsel = cookie.get(SESSION_COOKIE)
+        session_id = morsel.value if morsel else None
+        session = self.server.touch_session(session_id)
+        return session, session is None and session_id in self.server.expired_sessions
+
+    def do_GET(self):
+        self.server.count("GET", self.path)
+        self.server.sleep()
+        fixture = self.server.fixture
+        if self.path == "/":
+            session_id, session = self.server.new_session()
+            self._send(200, fixture["pagina_inicial"].replace("{token}", session.token), "text/html; charset=utf-8", cookie=session_id)
+        elif self.path == "/ver-danfe":
+            self._send(200, fixture["ver_danfe"], "text/html; charset=utf-8")
+        else:
+            self._send(404, b"not found", "text/plain")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.server.count("POST", self.path)
+        self.server.sleep()
+        fixture = self.server.fixture
+        session, expired = self._session()
+        if expired and self.server.expired_status:
+            self._send(self.server.expired_status, fixture["sessao_invalida"], "application/json")
+            return
+
+        if self.path.startswith(CONSULT_PATH_PREFIX):
+            key = self.path[len(CONSULT_PATH_PREFIX):]
+            if session is None or self.headers.get("x-csrf-token") != session.token:
+                self._send(401, fixture["sessao_invalida"], "application/json")
+                return
+            session.consulted_keys.add(key)
+            self._send(200, fixture["consulta"].replace("{key}", key), "application/json")
+        elif self.path.startswith(XML_PATH_PREFIX):
+            key = self.path[len(XML_PATH_PREFIX):]
+            if session is None or key not in session.consulted_keys:
+                self._send(403, fixture["acesso_negado"], "application/json")
+                return
+            self._send(200, build_sample_xml(key), "application/xml")
+        else:
+            self._send(404, b"not found", "text/plain")
+
+
+class MockMeuDanfeSiteServer(ThreadingHTTPServer):
+    """
+    Servidor do site simulado, em thread própria.
+
+    Args:
+        latency (LatencyDistribution | str): Tempo de resposta de todas as rotas.
+        session_max_requests (int): Requisições aceitas por sessão antes de ela expirar
+            (0 = nunca), para exercitar a renovação de sessão do cliente.
+        expired_status (int): Status devolvido a uma sessão expirada (ex: 401, 403, 419);
+            padrão None, em que a consulta responde 401 e o download do XML 403.
+        fixture (dict): Respostas gravadas; padrão benchmarks/fixtures/meudanfe_site.json.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host="127.0.0.1", port=0, latency="0", session_max_requests=0, expired_status=None,
+                 fixture=None):
+        super().__init__((host, port), MockMeuDanfeSiteHandler)
+        self.latency = latency if isinstance(latency, LatencyDistribution) else LatencyDistribution.parse(latency)
+        self.session_max_requests = session_max_requests
+        self.expired_status = expired_status
+        self.fixture = fixture or load_fixture()
+        self.sessions = {}
+        self.expired_sessions = set()
+        self.sessions_created = 0
+        self.route_counts = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def sleep(self):
+        delay = self.latency.sample_seconds()
+        if delay:
+            time.sleep(delay)
+
+    def count(self, method, path):
+        route = route_of(method, path)
+        with self._lock:
+            self.route_counts[route] = self.route_counts.get(route, 0) + 1
+
+    def new_session(self):
+        session_id = secrets.token_hex(12)
+        session = SiteSessionState()
+        with self._lock:
+            self.sessions[session_id] = session
+            self.sessions_created += 1
+        return session_id, session
+
+    def touch_session(self, session_id):
+        """
+        Conta uma requisição da sessão e a retorna, ou None se ela não existe ou expirou.
+        """
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            session.requests += 1
+            if self.session_max_requests and session.requests > self.session_max_requests:
+                del self.sessions[session_id]
+                self.expired_sessions.add(session_id)
+                return None
+            return session
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
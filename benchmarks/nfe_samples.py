@@ -0,0 +1,96 @@
+"""
+Gera XMLs de NF-e sintéticos com a estrutura e o tamanho de notas reais
+(nfeProc com itens, impostos, transporte, assinatura e protocolo).
+"""
+import hashlib
+import random
+
+from src.pipeline.access_key import compute_check_digit
+
+_ITEM_TEMPLATE = (
+    '<det nItem="{n}"><prod><cProd>{code}</cProd><cEAN>SEM GTIN</cEAN>'
+    '<xProd>PRODUTO DE TESTE NUMERO {n} COM DESCRICAO LONGA PARA SIMULAR NOTA REAL</xProd>'
+    '<NCM>84713012</NCM><CFOP>5102</CFOP><uCom>UN</uCom><qCom>{qty}.0000</qCom>'
+    '<vUnCom>{unit}.0000000000</vUnCom><vProd>{total}.00</vProd><cEANTrib>SEM GTIN</cEANTrib>'
+    '<uTrib>UN</uTrib><qTrib>{qty}.0000</qTrib><vUnTrib>{unit}.0000000000</vUnTrib><indTot>1</indTot></prod>'
+    '<imposto><vTotTrib>{tax}.00</vTotTrib><ICMS><ICMS00><orig>0</orig><CST>00</CST><modBC>3</modBC>'
+    '<vBC>{total}.00</vBC><pICMS>18.0000</pICMS><vICMS>{tax}.00</vICMS></ICMS00></ICMS>'
+    '<PIS><PISAliq><CST>01</CST><vBC>{total}.00</vBC><pPIS>1.6500</pPIS><vPIS>0.00</vPIS></PISAliq></PIS>'
+    '<COFINS><COFINSAliq><CST>01</CST><vBC>{total}.00</vBC><pCOFINS>7.6000</pCOFINS><vCOFINS>0.00</vCOFINS>'
+    '</COFINSAliq></COFINS></imposto></det>'
+)
+
+
+def make_access_key(uf="35", year_month="2506", cnpj="12345678000195", model="55", series=1, number=1, numeric_code=None):
+    """
+    Monta uma chave de acesso válida (com dígito verificador correto).
+    """
+    numeric_code = numeric_code if numeric_code is not None else (number * 7919) % 100000000
+    base = f"{uf}{year_month}{cnpj}{model}{series:03d}{number:09d}1{numeric_code:08d}"
+    return base + str(compute_check_digit(base))
+
+
+def build_nfe_xml(key, item_count=10, seed=None):
+    """
+    Monta o XML (bytes) de uma NF-e autorizada coerente com a chave de acesso.
+
+    Args:
+        key (str): Chave de acesso de 44 dígitos.
+        item_count (int): Quantidade de itens (define o tamanho do XML; ~0,8 KB por item).
+        seed (int): Semente para valores reproduzíveis.
+    """
+    rng = random.Random(seed if seed is not None else key)
+    items = []
+    total_products = 0
+    total_tax = 0
+    for n in range(1, item_count + 1):
+        qty = rng.randint(1, 20)
+        unit = rng.randint(1, 500)
+        total = qty * unit
+        tax = total * 18 // 100
+        total_products += total
+        total_tax += tax
+        items.append(_ITEM_TEMPLATE.format(n=n, code=f"{n:06d}", qty=qty, unit=unit, total=total, tax=tax))
+
+    digest = hashlib.sha256(key.encode("ascii")).hexdigest()
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+        '<NFe xmlns="http://www.portalfiscal.inf.br/nfe">'
+        f'<infNFe Id="NFe{key}" versao="4.00">'
+        f'<ide><cUF>{key[0:2]}</cUF><cNF>{key[35:43]}</cNF><natOp>VENDA DE MERCADORIA</natOp>'
+        f'<mod>{key[20:22]}</mod><serie>{int(key[22:25])}</serie><nNF>{int(key[25:34])}</nNF>'
+        f'<dhEmi>20{key[2:4]}-{key[4:6]}-15T09:00:00-03:00</dhEmi><tpNF>1</tpNF><idDest>1</idDest>'
+        '<cMunFG>3550308</cMunFG><tpImp>1</tpImp><tpEmis>1</tpEmis>'
+        f'<cDV>{key[43]}</cDV><tpAmb>1</tpAmb><finNFe>1</finNFe><indFinal>0</indFinal><indPres>1</indPres>'
+        '<procEmi>0</procEmi><verProc>1.0</verProc></ide>'
+        f'<emit><CNPJ>{key[6:20]}</CNPJ><xNome>EMITENTE DE TESTE LTDA</xNome><xFant>EMITENTE</xFant>'
+        '<enderEmit><xLgr>RUA DAS FLORES</xLgr><nro>100</nro><xBairro>CENTRO</xBairro><cMun>3550308</cMun>'
+        '<xMun>SAO PAULO</xMun><UF>SP</UF><CEP>01001000</CEP><cPais>1058</cPais><xPais>BRASIL</xPais></enderEmit>'
+        '<IE>111111111111</IE><CRT>3</CRT></emit>'
+        '<dest><CNPJ>98765432000198</CNPJ><xNome>DESTINATARIO DE TESTE SA</xNome>'
+        '<enderDest><xLgr>AVENIDA BRASIL</xLgr><nro>2000</nro><xBairro>JARDIM</xBairro><cMun>3304557</cMun>'
+        '<xMun>RIO DE JANEIRO</xMun><UF>RJ</UF><CEP>20040002</CEP><cPais>1058</cPais><xPais>BRASIL</xPais></enderDest>'
+        '<indIEDest>1</indIEDest><IE>22222222</IE></dest>'
+        + "".join(items) +
+        f'<total><ICMSTot><vBC>{total_products}.00</vBC><vICMS>{total_tax}.00</vICMS><vICMSDeson>0.00</vICMSDeson>'
+        '<vFCP>0.00</vFCP><vBCST>0.00</vBCST><vST>0.00</vST><vFCPST>0.00</vFCPST><vFCPSTRet>0.00</vFCPSTRet>'
+        f'<vProd>{total_products}.00</vProd><vFrete>0.00</vFrete><vSeg>0.00</vSeg><vDesc>0.00</vDesc>'
+        '<vII>0.00</vII><vIPI>0.00</vIPI><vIPIDevol>0.00</vIPIDevol><vPIS>0.00</vPIS><vCOFINS>0.00</vCOFINS>'
+        f'<vOutro>0.00</vOutro><vNF>{total_products}.00</vNF></ICMSTot></total>'
+        '<transp><modFrete>0</modFrete></transp>'
+        f'<pag><detPag><tPag>01</tPag><vPag>{total_products}.00</vPag></detPag></pag>'
+        '<infAdic><infCpl>DOCUMENTO EMITIDO PARA TESTES DE DESEMPENHO.</infCpl></infAdic>'
+        '</infNFe>'
+        '<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignedInfo>'
+        '<CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+        '<SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>'
+        f'<Reference URI="#NFe{key}"><DigestValue>{digest[:28]}=</DigestValue></Reference></SignedInfo>'
+        f'<SignatureValue>{digest * 5}</SignatureValue>'
+        f'<KeyInfo><X509Data><X509Certificate>{digest * 30}</X509Certificate></X509Data></KeyInfo></Signature>'
+        '</NFe>'
+        f'<protNFe versao="4.00"><infProt><tpAmb>1</tpAmb><verAplic>SP_NFE_PL009_V4</verAplic><chNFe>{key}</chNFe>'
+        f'<dhRecbto>20{key[2:4]}-{key[4:6]}-15T09:00:05-03:00</dhRecbto><nProt>135250000000001</nProt>'
+        f'<digVal>{digest[:28]}=</digVal><cStat>100</cStat><xMotivo>Autorizado o uso da NF-e</xMotivo>'
+        '</infProt></protNFe></nfeProc>'
+    ).encode("utf-8")
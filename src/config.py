@@ -1,3 +1,4 @@
+import json
 import os
 
 # Caminhos das pastas do projeto
@@ -22,4 +23,349 @@ MEUDANFE_API_DANFE_GENERATION_URL = "https://ws.meudanfe.com/api/v1/get/nfe/xmlt
 MEUDANFE_API_KEY = "SUA_CHAVE_AQUI" # <-- COLOQUE SUA CHAVE AQUI!
 
 # Outras configurações
-REQUEST_TIMEOUT_SECONDS = 10
\ No newline at end of file
+REQUEST_TIMEOUT_SECONDS = 10
+
+# --- Log ---
+
+# Nível mínimo geral e níveis específicos por módulo
+LOG_LEVEL = "INFO"
+LOG_MODULE_LEVELS = {
+    "urllib3": "WARNING",
+    "selenium": "WARNING",
+    "WDM": "WARNING",
+}
+
+# Formato do arquivo de log: "texto" ou "json" (uma linha JSON por registro); o console é sempre texto
+LOG_FORMAT = "texto"
+
+# Rotação do arquivo: "nenhuma" (um arquivo por dia de execução), "tamanho" (LOG_MAX_BYTES) ou "diaria" (à meia-noite)
+LOG_ROTATION = "nenhuma"
+LOG_MAX_BYTES = 20 * 1024 * 1024
+LOG_BACKUP_COUNT = 7
+
+# Registros aguardando gravação; com a fila cheia, novos registros são descartados (os workers nunca esperam pelo log)
+LOG_QUEUE_SIZE = 10000
+
+# Tamanho máximo de uma mensagem; conteúdos maiores (XML, HTML de erro) são cortados
+LOG_MESSAGE_MAX_CHARS = 2000
+
+# Fração das mensagens DEBUG/INFO mantidas por logger (ex: {"src.pipeline.http_client": 0.1}); avisos e erros são sempre mantidos
+LOG_SAMPLING = {}
+
+# --- Execução e limite de requisições ---
+
+# Modo de execução do pipeline: "sequencial" (uma chave por vez), "concorrente" (várias chaves ao mesmo tempo)
+# ou "estagios" (download do XML, geração da DANFE e gravação em estágios separados, ligados por filas)
+EXECUTION_MODE = "concorrente"
+
+# Número de threads que processam chaves em paralelo no modo concorrente
+MAX_WORKERS = 8
+
+# Limite de requisições por segundo enviadas ao ws.meudanfe.com (token bucket)
+RATE_LIMIT_REQUESTS_PER_SECOND = 4
+
+# Rajada máxima de requisições permitida pelo token bucket (None = igual à taxa por segundo)
+RATE_LIMIT_BURST = None
+
+# Número máximo de requisições em andamento ao mesmo tempo
+RATE_LIMIT_MAX_IN_FLIGHT = 8
+
+# --- Pipeline em estágios (EXECUTION_MODE = "estagios") ---
+
+# Número de threads de cada estágio
+STAGE_XML_WORKERS = MAX_WORKERS
+STAGE_DANFE_WORKERS = 4
+STAGE_SAVE_WORKERS = 2
+
+# Capacidade das filas entre os estágios (limita quantos XMLs/PDFs ficam em memória)
+STAGE_QUEUE_SIZE = 50
+
+# Intervalo, em segundos, entre os relatórios de profundidade das filas no log (0 desativa)
+STAGE_QUEUE_REPORT_INTERVAL_SECONDS = 10
+
+# --- Gravação dos documentos ---
+
+# "arquivos": um XML e um PDF soltos por nota em <filial>/<data>/XML e DANFE
+# "pacote": as notas do dia de cada filial são acrescentadas a <filial>/<data>.tar, com índice <data>.idx.jsonl
+OUTPUT_MODE = "arquivos"
+
+# Threads que gravam XML/PDF em segundo plano (modos "sequencial" e "concorrente").
+# Com armazenamento em bucket, o número de threads passa a ser STORAGE_MAX_CONCURRENCY.
+WRITER_MAX_WORKERS = 2
+
+# Notas aguardando gravação antes de os workers de download esperarem (limita a memória)
+WRITER_MAX_PENDING = 32
+
+# fsync dos arquivos gravados: "nenhum", "cada" (cada arquivo) ou "lote" (a cada WRITER_FSYNC_BATCH_SIZE notas)
+WRITER_FSYNC_MODE = "nenhum"
+WRITER_FSYNC_BATCH_SIZE = 50
+
+# Se True, o XML e o PDF são gravados em disco à medida que chegam da rede, em blocos de
+# STREAMING_CHUNK_SIZE_BYTES, e o número da nota é lido do XML durante o download. Entre
+# os estágios passa apenas o arquivo temporário (em STREAMING_SPOOL_FOLDER, no mesmo disco
+# da saída para a gravação final ser um rename), então a memória por chave não depende do
+# tamanho dos documentos.
+STREAMING_TRANSFER_ENABLED = False
+STREAMING_CHUNK_SIZE_BYTES = 64 * 1024
+STREAMING_SPOOL_FOLDER = os.path.join(OUTPUT_BASE_FOLDER, ".transferencias")
+
+# --- Armazenamento dos documentos ---
+
+# "local": grava em OUTPUT_BASE_FOLDER
+# "s3": bucket S3 ou compatível (MinIO etc.), requer boto3
+# "gcs": bucket do Google Cloud Storage, requer google-cloud-storage
+# "memoria": bucket em memória (testes e benchmarks; nada é persistido)
+STORAGE_BACKEND = "local"
+
+# Bucket e prefixo dos objetos (ex: "notas-fiscais" e "NOTAS E XML")
+STORAGE_BUCKET = ""
+STORAGE_PREFIX = "NOTAS E XML"
+
+# Endpoint e região do S3 (None = AWS padrão; para MinIO: "http://localhost:9000")
+STORAGE_ENDPOINT_URL = None
+STORAGE_REGION = None
+
+# Conexões/uploads simultâneos ao bucket
+STORAGE_MAX_CONCURRENCY = 8
+
+# Documentos a partir deste tamanho são enviados em partes paralelas (multipart)
+STORAGE_MULTIPART_THRESHOLD_BYTES = 8 * 1024 * 1024
+
+# Tamanho de cada parte do upload multipart (o S3 exige no mínimo 5 MB)
+STORAGE_MULTIPART_PART_SIZE_BYTES = 5 * 1024 * 1024
+
+# --- Pool de conexões HTTP (keep-alive) ---
+
+# Quantidade de hosts distintos que mantêm um pool de conexões próprio
+HTTP_POOL_CONNECTIONS = 4
+
+# Conexões mantidas abertas por host (recomendado: >= MAX_WORKERS)
+HTTP_POOL_MAXSIZE = MAX_WORKERS
+
+# --- Obtenção do XML ---
+
+# Backends tentados em ordem até um obter o XML (src/pipeline/fetchers/):
+# "api" (ws.meudanfe.com), "site" (fluxo do site reproduzido com requisições HTTP, sem
+# navegador) e "navegador" (site, via Selenium). Cada backend só é importado quando
+# chega a vez dele; sem "navegador", o Selenium não precisa estar instalado.
+XML_FETCHER_ORDER = ["api", "site", "navegador"]
+
+# --- Fluxo do site sem navegador (backend "site") ---
+
+# Arquivo JSON com o roteiro de requisições gravado do site; None usa o roteiro
+# padrão (DEFAULT_SITE_FLOW em src/pipeline/fetchers/site.py)
+SITE_FLOW_PATH = None
+
+# Sessões HTTP (cada uma com seus cookies e tokens) mantidas ao mesmo tempo
+SITE_SESSION_POOL_SIZE = MAX_WORKERS
+
+# Quantidade de chaves atendidas por uma sessão antes de ela recomeçar do zero (cookies novos)
+SITE_SESSION_MAX_USES = 50
+
+# --- Pool de navegadores (fallback via Selenium) ---
+
+# Número máximo de navegadores Chrome abertos ao mesmo tempo (um por worker)
+WEBDRIVER_POOL_SIZE = MAX_WORKERS
+
+# Quantidade de chaves atendidas por um navegador antes de ele ser fechado e substituído
+WEBDRIVER_MAX_USES = 25
+
+# Se True, abre todos os navegadores do pool de uma vez no primeiro fallback
+WEBDRIVER_POOL_PREWARM = True
+
+# Prazo máximo para o download do XML terminar após o clique em "Baixar XML"
+SELENIUM_DOWNLOAD_TIMEOUT_SECONDS = 30
+
+# Intervalo entre verificações da pasta de downloads
+DOWNLOAD_POLL_INTERVAL_SECONDS = 0.1
+
+# --- Retomada de execuções ---
+
+# Pasta com os arquivos de estado do pipeline (manifesto de retomada, caches)
+STATE_FOLDER = os.path.join(BASE_DIR, "ESTADO")
+
+# Se True, chaves já salvas em execuções anteriores são puladas
+RESUME_ENABLED = True
+
+# Banco SQLite com o andamento de cada chave de acesso
+RUN_STATE_DB_PATH = os.path.join(STATE_FOLDER, "execucao.sqlite3")
+
+# --- Geração da DANFE ---
+
+# "remoto": envia o XML para a API de conversão do meudanfe
+# "local": renderiza o PDF no próprio processo, sem a segunda requisição
+DANFE_GENERATION_MODE = "remoto"
+
+# Processos que renderizam as DANFEs no modo "local", compartilhados pelas threads do
+# pipeline (None: um por núcleo de CPU; 0: renderiza na própria thread, sem processos)
+DANFE_RENDER_PROCESSES = None
+
+# --- Ordem de processamento ---
+
+# None: processa as chaves na ordem dos arquivos, à medida que são lidas
+# "emitente" ou "mes": ordena o lote pelo CNPJ emitente ou pelo mês de emissão contidos na chave de acesso
+KEY_ORDERING = None
+
+# Se True, as chaves das filiais são intercaladas (fila justa por filial, src/pipeline/scheduler.py)
+# em vez de processadas arquivo por arquivo: uma filial com poucas chaves não espera o
+# lote inteiro de uma filial grande. Com KEY_ORDERING, a ordenação vale dentro de cada filial.
+FAIR_SCHEDULING_ENABLED = True
+
+# Fatia das requisições de cada filial quando várias têm chaves pendentes (padrão 1 para
+# as não listadas). Ex: {"FILIAL 04": 3} faz a FILIAL 04 receber 3 chaves para cada 1 das demais.
+FILIAL_SHARES = {}
+
+# Prioridade de cada filial (padrão 0): filiais de prioridade maior são atendidas primeiro
+# e as demais só recebem chaves quando elas não têm nenhuma pendente.
+FILIAL_PRIORITIES = {}
+
+# Chaves que falharam por erro temporário voltam para a fila da filial depois de uma espera (dobra a cada vez,
+# até o máximo), no máximo SCHEDULER_MAX_REQUEUES vezes antes de serem dadas como falha;
+# notas não encontradas no serviço não são reagendadas
+SCHEDULER_MAX_REQUEUES = 2
+SCHEDULER_REQUEUE_DELAY_SECONDS = 30
+SCHEDULER_REQUEUE_MAX_DELAY_SECONDS = 300
+
+# --- Novas tentativas e disjuntor (ws.meudanfe.com) ---
+
+# Total de tentativas por requisição em falhas temporárias (conexão, timeout, 429/5xx)
+RETRY_MAX_ATTEMPTS = 4
+
+# Espera base do backoff exponencial (dobra a cada tentativa, com jitter)
+RETRY_BASE_DELAY_SECONDS = 1
+
+# Espera máxima entre tentativas (também limita o Retry-After informado pelo servidor)
+RETRY_MAX_DELAY_SECONDS = 60
+
+# Falhas seguidas em um endpoint que pausam todas as requisições a ele
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+
+# Tempo mínimo de pausa com o circuito aberto (a página de erro 502 pede 30 segundos)
+CIRCUIT_BREAKER_RECOVERY_SECONDS = 30
+
+# --- Tempo limite adaptativo, requisições duplicadas e prazo por chave ---
+
+# Se True, o tempo limite de cada endpoint vem da latência observada (percentil
+# ADAPTIVE_TIMEOUT_QUANTILE x ADAPTIVE_TIMEOUT_MULTIPLIER), entre o mínimo abaixo
+# e REQUEST_TIMEOUT_SECONDS. Até juntar LATENCY_MIN_SAMPLES respostas, vale REQUEST_TIMEOUT_SECONDS.
+ADAPTIVE_TIMEOUT_ENABLED = True
+ADAPTIVE_TIMEOUT_QUANTILE = 0.99
+ADAPTIVE_TIMEOUT_MULTIPLIER = 3
+ADAPTIVE_TIMEOUT_MIN_SECONDS = 1
+
+# Respostas mais recentes de cada endpoint usadas para calcular os percentis
+LATENCY_WINDOW_SIZE = 500
+LATENCY_MIN_SAMPLES = 50
+
+# Endpoints em que uma requisição mais lenta que o percentil HEDGE_QUANTILE ganha uma
+# cópia em paralelo (vale a primeira resposta). Lista vazia desativa.
+HEDGE_ENDPOINTS = ["xml"]
+HEDGE_QUANTILE = 0.95
+
+# Fração máxima das requisições de um endpoint que podem ser duplicadas (limita a carga extra)
+HEDGE_MAX_RATIO = 0.05
+
+# Tempo total máximo de uma chave (requisições, novas tentativas e esperas) antes de ela
+# ser dada como falha; None desativa
+KEY_DEADLINE_SECONDS = 90
+
+# --- Métricas ---
+
+# Se True, grava ao final de cada execução um relatório JSON em LOGS/ (relatorio_AAAA-MM-DD_HHMMSS.json)
+METRICS_REPORT_ENABLED = True
+
+# Porta do endpoint GET /metrics no formato do Prometheus durante a execução (None desativa)
+METRICS_HTTP_PORT = None
+
+# --- Execução distribuída (python -m src.worker) ---
+
+# Fila compartilhada entre os processos/hosts. Em vários hosts, o arquivo precisa estar em
+# um sistema de arquivos com travas confiáveis (SQLite não funciona bem sobre NFS comum).
+WORK_QUEUE_DB_PATH = os.path.join(STATE_FOLDER, "fila.sqlite3")
+
+# Tempo de posse de uma chave por um worker; renovado enquanto ele está vivo.
+# Se o worker cair, a chave volta para a fila quando o prazo expira.
+WORK_QUEUE_LEASE_SECONDS = 120
+
+# Chaves reservadas por vez em cada consulta à fila
+WORK_QUEUE_CLAIM_BATCH = 16
+
+# Reservas de uma mesma chave (inclusive por workers que caíram) antes de ela ser dada como falha
+WORK_QUEUE_MAX_ATTEMPTS = 3
+
+# Intervalo entre consultas quando a fila está vazia mas outros workers ainda têm chaves
+WORK_QUEUE_POLL_SECONDS = 2
+
+# Divisão das chaves em partições: "hash" (chave de acesso) ou "filial" (todas as chaves
+# de uma filial na mesma partição). Cada worker atende primeiro as suas partições.
+WORK_QUEUE_SHARD_BY = "hash"
+WORK_QUEUE_SHARD_COUNT = 4
+
+# Processos iniciados por "python -m src.worker executar" (o limite de requisições
+# RATE_LIMIT_REQUESTS_PER_SECOND é dividido entre eles)
+WORKER_PROCESSES = 4
+
+# --- Modo contínuo (python -m src.daemon) ---
+
+# Posição já processada de cada arquivo de chaves (inode + byte), para ler só as linhas novas
+DAEMON_OFFSETS_PATH = os.path.join(STATE_FOLDER, "posicoes_entrada.json")
+
+# Como perceber arquivos novos/alterados: "auto" (inotify no Linux, senão verificação
+# periódica), "inotify" ou "polling" (ex: pasta em compartilhamento de rede)
+DAEMON_WATCH_BACKEND = "auto"
+
+# Intervalo da verificação periódica (modo "polling")
+DAEMON_POLL_INTERVAL_SECONDS = 2
+
+# Releitura completa da pasta a cada N segundos, como garantia contra eventos perdidos
+DAEMON_RESCAN_SECONDS = 300
+
+# --- Cache de chaves sem nota ---
+
+# Lembra as chaves para as quais todos os backends que rodaram responderam definitivamente
+# "não encontrada" (404), para não repetir as requisições (e o navegador) a cada execução
+NEGATIVE_CACHE_ENABLED = True
+
+# Arquivo JSON com as chaves lembradas, mantido entre execuções
+NEGATIVE_CACHE_PATH = os.path.join(STATE_FOLDER, "chaves_nao_encontradas.json")
+
+# Por quanto tempo uma chave não encontrada deixa de ser consultada (a nota pode
+# ainda não ter chegado ao serviço e aparecer depois)
+NEGATIVE_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Máximo de chaves lembradas; as usadas há mais tempo são descartadas primeiro
+NEGATIVE_CACHE_MAX_ENTRIES = 100000
+
+# --- Sobrescrita por variáveis de ambiente ---
+
+# Qualquer configuração acima pode ser sobrescrita por uma variável de ambiente com o
+# prefixo NOTAS_ (ex: NOTAS_EXECUTION_MODE=estagios, NOTAS_MAX_WORKERS=16). Usado pelos
+# benchmarks para apontar o pipeline para o servidor local. Valores derivados de outros
+# (ex: HTTP_POOL_MAXSIZE, RUN_STATE_DB_PATH) precisam ser sobrescritos também.
+ENV_PREFIX = "NOTAS_"
+
+
+def _parse_env_value(raw, current):
+    if isinstance(current, bool):
+        return raw.strip().lower() in ("1", "true", "sim", "yes")
+    if isinstance(current, (int, float)):
+        # Permite frações também nos valores inteiros (ex: RETRY_BASE_DELAY_SECONDS=0.05)
+        value = float(raw)
+        return int(value) if isinstance(current, int) and value.is_integer() else value
+    if isinstance(current, (dict, list)):
+        return json.loads(raw)
+    if current is None:
+        # Sem tipo de referência: aceita números/JSON e, se não for, mantém o texto
+        if raw.strip().lower() in ("", "none"):
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return raw
+    return raw
+
+
+for _name, _raw in os.environ.items():
+    if _name.startswith(ENV_PREFIX) and _name[len(ENV_PREFIX):] in globals() and _name[len(ENV_PREFIX):].isupper():
+        _setting = _name[len(ENV_PREFIX):]
+        globals()[_setting] = _parse_env_value(_raw, globals()[_setting])
@@ -0,0 +1,212 @@
+"""
+Modo contínuo do pipeline: observa a pasta de entrada e processa as chaves à medida
+que são acrescentadas aos arquivos "CHAVES FILIAL *.txt", sem reler o lote inteiro.
+
+Uso:
+    python -m src.daemon
+
+A pasta é observada com inotify (Linux) ou por verificação periódica (DAEMON_WATCH_BACKEND).
+De cada arquivo é lido apenas o trecho novo, a partir da posição guardada em
+DAEMON_OFFSETS_PATH, que sobrevive a reinícios. Encerre com Ctrl+C ou SIGTERM: as
+chaves em andamento são concluídas antes de sair.
+"""
+import datetime
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.logger_config import setup_logger, shutdown_logging
+from src.main import process_and_save_key, write_run_report
+from src.pipeline.fetchers import close_fetchers
+from src.pipeline.writer import close_document_writer
+from src.pipeline.danfe_renderer import close_danfe_render_pool
+from src.pipeline.key_cache import save_negative_cache, close_negative_cache
+from src.pipeline.run_state import RunStateStore
+from src.pipeline.http_client import close_http_client
+from src.pipeline.concurrency import TokenBucketRateLimiter
+from src.pipeline.extract import parse_filial_from_filename
+from src.pipeline.metrics import metrics, MetricsServer
+from src.pipeline.watcher import FileOffsetTracker, create_watcher, is_key_file
+from src.config import (
+    INPUT_FOLDER,
+    MAX_WORKERS,
+    RATE_LIMIT_REQUESTS_PER_SECOND,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_MAX_IN_FLIGHT,
+    RESUME_ENABLED,
+    RUN_STATE_DB_PATH,
+    METRICS_REPORT_ENABLED,
+    METRICS_HTTP_PORT,
+    DAEMON_OFFSETS_PATH,
+    DAEMON_WATCH_BACKEND,
+    DAEMON_POLL_INTERVAL_SECONDS,
+    DAEMON_RESCAN_SECONDS,
+)
+
+# Espera máxima do observador por evento antes de conferir o pedido de encerramento
+_WAIT_SLICE_SECONDS = 1.0
+
+def list_key_files(folder):
+    try:
+        return sorted(name for name in os.listdir(folder) if is_key_file(name))
+    except FileNotFoundError:
+        return []
+
+def run_daemon(stop_event=None):
+    """
+    Processa continuamente as chaves novas da pasta de entrada até `stop_event` ser
+    sinalizado (ou o processo receber SIGINT/SIGTERM). Retorna (sucessos, falhas).
+    """
+    stop_event = stop_event or threading.Event()
+    logger = setup_logger()
+    logger.info(f"Modo contínuo iniciado em {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, observando '{INPUT_FOLDER}'.")
+    metrics.reset()
+    metrics_server = None
+    os.makedirs(INPUT_FOLDER, exist_ok=True)
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    run_state = RunStateStore(RUN_STATE_DB_PATH) if RESUME_ENABLED else None
+    tracker = FileOffsetTracker(DAEMON_OFFSETS_PATH)
+    watcher = create_watcher(INPUT_FOLDER, DAEMON_WATCH_BACKEND, DAEMON_POLL_INTERVAL_SECONDS, logger)
+    logger.info(f"Observador da pasta: {watcher.name}.")
+    rate_limiter = TokenBucketRateLimiter(
+        requests_per_second=RATE_LIMIT_REQUESTS_PER_SECOND,
+        max_in_flight=RATE_LIMIT_MAX_IN_FLIGHT,
+        burst=RATE_LIMIT_BURST,
+    )
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="continuo")
+    # Limita as chaves lidas e ainda não concluídas (o restante espera no arquivo)
+    slots = threading.BoundedSemaphore(MAX_WORKERS * 2)
+    in_flight = set()
+    # Sem o registro de retomada, as chaves já vistas ficam em memória (como inteiros)
+    seen_keys = set()
+    state_lock = threading.Lock()
+    counts = {"found": 0, "skipped": 0, "success": 0, "failure": 0}
+
+    def finish(key, chunk_id, success):
+        with state_lock:
+            in_flight.discard(key)
+            counts["success" if success else "failure"] += 1
+        tracker.key_done(chunk_id)
+        slots.release()
+
+    def handle(filial_code, key, chunk_id, arrived_at):
+        def on_saved(success):
+            # Latência ponta a ponta: da leitura da linha no arquivo até a nota gravada
+            metrics.observe("key_arrival_seconds", time.time() - arrived_at, outcome="salva" if success else "falha")
+            finish(key, chunk_id, success)
+
+        try:
+            fetched = process_and_save_key(filial_code, key, logger, rate_limiter=rate_limiter, run_state=run_state, on_saved=on_saved)
+        except Exception as e:
+            logger.error(f"Erro inesperado ao processar a chave {key[:10]}... (Filial: {filial_code}): {e}", exc_info=True)
+            metrics.inc("keys_total", filial=filial_code, outcome="erro_inesperado")
+            if run_state is not None:
+                run_state.record_failure(key, filial_code, e)
+            fetched = False
+        if not fetched:
+            finish(key, chunk_id, False)
+
+    def is_duplicate(key):
+        with state_lock:
+            if key in in_flight or (run_state is not None and run_state.is_completed(key)):
+                return True
+            if run_state is None:
+                if int(key) in seen_keys:
+                    return True
+                seen_keys.add(int(key))
+            in_flight.add(key)
+            return False
+
+    def process_file(filename):
+        filial_code = parse_filial_from_filename(filename)
+        keys, chunk_id = tracker.read_new_lines(INPUT_FOLDER, filename, logger)
+        if not keys:
+            return
+        arrived_at = time.time()
+        logger.info(f"{len(keys)} chave(s) nova(s) em '{filename}' (Filial: {filial_code}).")
+        for key in keys:
+            counts["found"] += 1
+            if is_duplicate(key):
+                counts["skipped"] += 1
+                metrics.inc("keys_total", filial=filial_code, outcome="pulada")
+                tracker.key_done(chunk_id)
+                continue
+            while not slots.acquire(timeout=_WAIT_SLICE_SECONDS):
+                if stop_event.is_set():
+                    # As chaves restantes do trecho não são confirmadas e serão lidas de novo no próximo início
+                    return
+            executor.submit(handle, filial_code, key, chunk_id, arrived_at)
+
+    try:
+        if METRICS_HTTP_PORT:
+            metrics_server = MetricsServer(METRICS_HTTP_PORT).start()
+            logger.info(f"Métricas disponíveis em http://localhost:{metrics_server.port}/metrics")
+
+        # Arquivos removidos enquanto o processo estava parado saem do registro de posições
+        present = set(list_key_files(INPUT_FOLDER))
+        for filename in tracker.known_files():
+            if filename not in present:
+                tracker.forget(filename)
+
+        # Recupera o que chegou enquanto o processo estava parado
+        for filename in sorted(present):
+            process_file(filename)
+        last_rescan = time.monotonic()
+
+        while not stop_event.is_set():
+            changed, rescan = watcher.wait(_WAIT_SLICE_SECONDS)
+            if rescan or time.monotonic() - last_rescan >= DAEMON_RESCAN_SECONDS:
+                changed = set(list_key_files(INPUT_FOLDER))
+                last_rescan = time.monotonic()
+            for filename in sorted(changed):
+                if stop_event.is_set():
+                    break
+                if not is_key_file(filename):
+                    continue
+                if os.path.exists(os.path.join(INPUT_FOLDER, filename)):
+                    process_file(filename)
+                else:
+                    tracker.forget(filename)
+            tracker.save()
+            save_negative_cache()
+
+    except KeyboardInterrupt:
+        logger.info("Encerramento solicitado; concluindo as chaves em andamento.")
+    except Exception as e:
+        logger.critical(f"Erro crítico no modo contínuo: {e}", exc_info=True)
+    finally:
+        stop_event.set()
+        executor.shutdown(wait=True)
+        close_http_client()
+        close_fetchers()
+        close_danfe_render_pool()
+        close_document_writer()
+        close_negative_cache()
+        tracker.save()
+        watcher.close()
+        if run_state is not None:
+            run_state.close()
+        if METRICS_REPORT_ENABLED:
+            try:
+                write_run_report(
+                    logger, counts, counts["success"], counts["failure"],
+                    extra={"execution_mode": "continuo", "watch_backend": watcher.name},
+                )
+            except OSError as e:
+                logger.error(f"Não foi possível gravar o relatório da execução: {e}")
+        if metrics_server is not None:
+            metrics_server.stop()
+        logger.info(
+            f"Modo contínuo finalizado em {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: "
+            f"{counts['success']} nota(s) salva(s), {counts['failure']} falha(s)."
+        )
+        shutdown_logging()
+    return counts["success"], counts["failure"]
+
+if __name__ == "__main__":
+    run_daemon()
@@ -1,35 +1,236 @@
+import atexit
+import copy
+import datetime
+import json
 import logging
+import logging.handlers
 import os
-import datetime
-from src.config import LOG_FOLDER # Importa a pasta de logs definida em config.py
+import queue
+import random
+from src.config import (
+    LOG_FOLDER, # Importa a pasta de logs definida em config.py
+    LOG_LEVEL,
+    LOG_MODULE_LEVELS,
+    LOG_FORMAT,
+    LOG_ROTATION,
+    LOG_MAX_BYTES,
+    LOG_BACKUP_COUNT,
+    LOG_QUEUE_SIZE,
+    LOG_MESSAGE_MAX_CHARS,
+    LOG_SAMPLING,
+)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Logger do projeto devolvido por setup_logger; os módulos registram em filhos dele (ver module_logger)
+PROJECT_LOGGER_NAME = "src"
+
+_listener = None
+
+
+def module_logger(logger, module_name):
+    """
+    Logger com o nome do módulo `module_name` (use __name__) para um módulo que recebe o
+    logger do pipeline como argumento: assim LOG_MODULE_LEVELS e LOG_SAMPLING valem por
+    módulo (ex: "src.pipeline.http_client"). Com logger=None, retorna o logger do módulo;
+    um logger de fora do projeto (ex: de quem usa o pipeline como biblioteca) é mantido.
+    """
+    if logger is None or logger.name == PROJECT_LOGGER_NAME or logger.name.startswith(PROJECT_LOGGER_NAME + "."):
+        return logging.getLogger(module_name)
+    return logger
+
+
+def truncate_payload(value, limit=LOG_MESSAGE_MAX_CHARS):
+    """
+    Reduz conteúdos grandes (XML, HTML de erro, bytes) a um trecho inicial para o log,
+    indicando o tamanho total. Use ao incluir corpos de resposta em mensagens.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        total = len(value)
+        value = bytes(value[:limit]).decode("utf-8", errors="replace")
+    else:
+        value = str(value)
+        total = len(value)
+    if total <= limit:
+        return value
+    return f"{value[:limit]}... [truncado, {total} no total]"
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Uma linha JSON por registro: timestamp, nível, logger, thread, mensagem e exceção (se houver).
+    """
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class PayloadTruncationFilter(logging.Filter):
+    """
+    Rede de segurança contra mensagens gigantes: corta qualquer mensagem acima de
+    `max_chars` antes que ela entre na fila de log.
+    """
+
+    def __init__(self, max_chars):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def filter(self, record):
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            record.msg = truncate_payload(message, self.max_chars)
+            record.args = None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Mantém apenas uma fração das mensagens DEBUG/INFO dos loggers configurados
+    (ex: {"src.pipeline.http_client": 0.1}). Avisos e erros são sempre mantidos.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            rate = self.rates.get(name)
+            if rate is not None:
+                return random.random() < rate
+            name = name.rpartition(".")[0]
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que nunca bloqueia a thread que loga: com a fila cheia, o
+    registro é descartado e contado (o total é informado ao encerrar o log).
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Monta a mensagem na thread de origem (os argumentos podem mudar depois), mas
+        # mantém o traceback em exc_text para o formatador JSON registrá-lo em campo próprio.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _build_file_handler(log_folder):
+    extension = "jsonl" if LOG_FORMAT == "json" else "txt"
+    if LOG_ROTATION == "tamanho":
+        log_filepath = os.path.join(log_folder, f"processamento.{extension}")
+        return logging.handlers.RotatingFileHandler(
+            log_filepath, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    if LOG_ROTATION == "diaria":
+        log_filepath = os.path.join(log_folder, f"processamento.{extension}")
+        return logging.handlers.TimedRotatingFileHandler(
+            log_filepath, when="midnight", backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    # Sem rotação: um arquivo por dia de início da execução (comportamento original)
+    log_filename = f"processamento_{datetime.datetime.now().strftime('%Y-%m-%d')}.{extension}"
+    return logging.FileHandler(os.path.join(log_folder, log_filename), encoding='utf-8')
+
+
+def shutdown_logging():
+    """
+    Esvazia a fila de log, gravando os registros pendentes, e encerra a thread de escrita.
+    """
+    global _listener
+    if _listener is None:
+        return
+    listener, _listener = _listener, None
+    listener.stop()
+    for handler in logging.root.handlers:
+        if isinstance(handler, NonBlockingQueueHandler) and handler.dropped:
+            for target in listener.handlers:
+                target.handle(logging.makeLogRecord({
+                    "name": __name__,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": f"{handler.dropped} mensagem(ns) de log descartada(s) por fila cheia.",
+                }))
+    for target in listener.handlers:
+        target.close()
+
 
 def setup_logger():
     """
     Configura e retorna um logger para o projeto.
-    Cria um arquivo de log diário na pasta LOGS/ e também imprime no console.
+    Cria o arquivo de log na pasta LOGS/ e também imprime no console.
+
+    As threads do pipeline apenas colocam os registros em uma fila (QueueHandler);
+    a gravação em arquivo e no console acontece em uma thread própria (QueueListener),
+    de modo que o I/O de log nunca bloqueia os workers.
     """
+    global _listener
+
     # 1. Garante que a pasta de logs exista
     os.makedirs(LOG_FOLDER, exist_ok=True)
 
-    # 2. Define o nome do arquivo de log com a data atual
-    log_filename = f"processamento_{datetime.datetime.now().strftime('%Y-%m-%d')}.txt"
-    log_filepath = os.path.join(LOG_FOLDER, log_filename)
-
-    # 3. Configura o logger raiz (root logger)
-   
     # Remove handlers existentes para evitar duplicação em múltiplas chamadas
     # Isso é útil se a função for chamada mais de uma vez na mesma execução.
+    shutdown_logging()
     for handler in logging.root.handlers[:]:
         logging.root.removeHandler(handler)
 
-    logging.basicConfig(
-        level=logging.INFO, # Define o nível mínimo das mensagens a serem processadas (INFO, WARNING, ERROR, CRITICAL)
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', # Formato das mensagens de log
-        handlers=[
-            logging.FileHandler(log_filepath, encoding='utf-8'), # Handler para salvar em arquivo
-            logging.StreamHandler() # Handler para imprimir no console (stdout)
-        ]
+    # 2. Handlers de destino (executados na thread do QueueListener)
+    formatter = JsonLinesFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    file_handler = _build_file_handler(LOG_FOLDER)
+    console_handler = logging.StreamHandler() # Handler para imprimir no console (stdout)
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    file_handler.setFormatter(formatter)
+
+    # 3. Configura o logger raiz (root logger) com a fila
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLING))
+    queue_handler.addFilter(PayloadTruncationFilter(LOG_MESSAGE_MAX_CHARS))
+    logging.root.addHandler(queue_handler)
+    logging.root.setLevel(LOG_LEVEL)
+
+    # Níveis por módulo (ex: silenciar urllib3/selenium ou detalhar um estágio)
+    for module_name, level in LOG_MODULE_LEVELS.items():
+        logging.getLogger(module_name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(
+        queue_handler.queue, file_handler, console_handler, respect_handler_level=True
     )
+    _listener.start()
+
+    # Retorna o logger principal que será usado no main.py e em outros módulos; os módulos
+    # do pipeline registram em filhos dele, com o próprio nome (module_logger)
+    return logging.getLogger(PROJECT_LOGGER_NAME)
+
 
-    # Retorna o logger principal que será usado no main.py e em outros módulos
-    return logging.getLogger(__name__) # '__name__' garante um logger com o nome do módulo
\ No newline at end of file
+atexit.register(shutdown_logging)
@@ -1,61 +1,454 @@
 import datetime
+import threading
 import time
-from src.logger_config import setup_logger
-from src.pipeline.extract import get_all_filial_keys
-from src.pipeline.transform import process_single_key
-from src.pipeline.load import save_documents
-from src.config import INPUT_FOLDER
+from src.logger_config import setup_logger, shutdown_logging
+from src.pipeline.extract import iter_filial_keys, iter_keys_by_filial
+from src.pipeline.transform import process_single_key, fetch_xml_for_key, generate_danfe
+from src.pipeline.fetchers import close_fetchers
+from src.pipeline.load import save_documents, save_documents_async, get_output_paths
+from src.pipeline.writer import close_document_writer
+from src.pipeline.danfe_renderer import close_danfe_render_pool
+from src.pipeline.storage import discard_documents
+from src.pipeline.key_cache import close_negative_cache
+from src.pipeline.access_key import decode_access_keys_bulk
+from src.pipeline.run_state import RunStateStore, STAGE_XML_FETCHED, STAGE_DANFE_GENERATED, STAGE_SAVED
+from src.pipeline.http_client import close_http_client
+from src.pipeline.latency import deadline_scope, new_key_deadline
+from src.pipeline.concurrency import TokenBucketRateLimiter, run_in_thread_pool
+from src.pipeline.stages import StagedPipeline
+from src.pipeline.scheduler import FairShareScheduler
+from src.pipeline.metrics import metrics, MetricsServer
+from src.config import (
+    INPUT_FOLDER,
+    LOG_FOLDER,
+    EXECUTION_MODE,
+    MAX_WORKERS,
+    RATE_LIMIT_REQUESTS_PER_SECOND,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_MAX_IN_FLIGHT,
+    RESUME_ENABLED,
+    RUN_STATE_DB_PATH,
+    KEY_ORDERING,
+    FAIR_SCHEDULING_ENABLED,
+    STAGE_XML_WORKERS,
+    STAGE_DANFE_WORKERS,
+    STAGE_SAVE_WORKERS,
+    STAGE_QUEUE_SIZE,
+    STAGE_QUEUE_REPORT_INTERVAL_SECONDS,
+    METRICS_REPORT_ENABLED,
+    METRICS_HTTP_PORT,
+)
 
-# pequeno atraso entre as requisições
-# Comece com algo como 0.5 a 1 segundo.
-REQUEST_DELAY_SECONDS = 1 
+def record_save_result(filial_code, key, note_number, date_str, success, logger, run_state=None, started_at=None):
+    """
+    Registra no log e em `run_state` o resultado da gravação dos documentos de uma chave.
+    `started_at` (time.perf_counter() do início da chave) alimenta a latência ponta a ponta.
+    """
+    outcome = "salva" if success else "falha_gravacao"
+    metrics.inc("keys_total", filial=filial_code, outcome=outcome)
+    if started_at is not None:
+        metrics.observe("key_seconds", time.perf_counter() - started_at, outcome=outcome)
+    if success:
+        logger.info(f"Nota {note_number} (Filial: {filial_code}) processada e salva com sucesso.")
+        if run_state is not None:
+            xml_path, pdf_path = get_output_paths(filial_code, date_str, note_number)
+            run_state.record_stage(key, filial_code, STAGE_SAVED, note_number=note_number, xml_path=xml_path, pdf_path=pdf_path)
+    else:
+        logger.error(f"Falha ao salvar documentos para nota {note_number} (Filial: {filial_code}).")
+        if run_state is not None:
+            run_state.record_failure(key, filial_code, f"Falha ao salvar documentos da nota {note_number}.")
+
+def save_key_documents(filial_code, key, note_number, xml_content, pdf_content, logger, run_state=None, started_at=None):
+    """
+    Estágio de Carregamento de uma chave, na thread atual: grava o XML e o PDF e registra o resultado em `run_state`.
+    Retorna True se os documentos foram salvos com sucesso.
+    """
+    current_date_str = datetime.datetime.now().strftime("%Y-%m-%d")
+    success = save_documents(
+        filial_code,
+        current_date_str,
+        note_number,
+        xml_content,
+        pdf_content,
+        logger,
+        access_key=key,
+    )
+    record_save_result(filial_code, key, note_number, current_date_str, success, logger, run_state, started_at)
+    return success
+
+def submit_key_documents(filial_code, key, note_number, xml_content, pdf_content, logger, run_state=None, on_complete=None,
+                         started_at=None):
+    """
+    Estágio de Carregamento de uma chave, em segundo plano: agenda a gravação no gravador
+    compartilhado e retorna sem esperar o disco. Ao final, registra o resultado em
+    `run_state` e chama on_complete(sucesso) se informado.
+    """
+    current_date_str = datetime.datetime.now().strftime("%Y-%m-%d")
+
+    def done(success):
+        record_save_result(filial_code, key, note_number, current_date_str, success, logger, run_state, started_at)
+        if on_complete:
+            on_complete(success)
+
+    save_documents_async(filial_code, current_date_str, note_number, xml_content, pdf_content, logger, on_complete=done, access_key=key)
+
+def process_and_save_key(filial_code, key, logger, rate_limiter=None, run_state=None, on_saved=None, requeue=None):
+    """
+    Executa os estágios de Transformação e Carregamento para uma única chave.
+    Se `run_state` for informado, o andamento de cada estágio é registrado nele.
+
+    Sem `on_saved`, grava os documentos na thread atual e retorna True se a nota foi
+    obtida e salva com sucesso. Com `on_saved`, a gravação é agendada no gravador em
+    segundo plano (a thread já segue para a próxima chave) e on_saved(sucesso) é chamado
+    ao final; nesse caso o retorno indica apenas se a nota foi obtida.
+
+    Com `requeue`, uma chave cuja transformação falhou por um erro temporário é oferecida a
+    requeue(filial_code, key) (ex: FairShareScheduler.requeue); notas que o serviço informou
+    não existirem não são reagendadas. Se ela for reagendada, a falha não é registrada e o
+    retorno é None.
+    """
+    logger.info(f"Processando chave: {key[:10]}... (Filial: {filial_code})")
+    started_at = time.perf_counter()
+
+    stage_callback = None
+    if run_state is not None:
+        def stage_callback(stage, note_number):
+            run_state.record_stage(key, filial_code, stage, note_number=note_number)
+
+    # Estágio 2: Transformação
+    xml_content, pdf_content, note_number, not_found = process_single_key(
+        key, logger, rate_limiter=rate_limiter, stage_callback=stage_callback
+    )
+
+    if not (xml_content and pdf_content and note_number):
+        if requeue is not None and not not_found and requeue(filial_code, key):
+            return None
+        logger.error(f"Falha ao obter XML/DANFE para a chave: {key[:10]}... Detalhes no log da função 'process_single_key'.")
+        metrics.inc("keys_total", filial=filial_code, outcome="falha_transformacao")
+        if run_state is not None:
+            run_state.record_failure(key, filial_code, "Falha ao obter XML/DANFE.")
+        return False
+
+    # Estágio 3: Carregamento
+    if on_saved is not None:
+        submit_key_documents(
+            filial_code, key, note_number, xml_content, pdf_content, logger, run_state,
+            on_complete=on_saved, started_at=started_at,
+        )
+        return True
+    return save_key_documents(filial_code, key, note_number, xml_content, pdf_content, logger, run_state, started_at)
+
+def iter_pending_keys(filial_keys, run_state, stats):
+    """
+    Repassa as tuplas (filial_code, key) extraídas, pulando as chaves já salvas
+    em execuções anteriores. Atualiza os contadores 'found' e 'skipped' em `stats`.
+    """
+    for filial_code, key in filial_keys:
+        stats["found"] += 1
+        if run_state is not None and run_state.is_completed(key):
+            stats["skipped"] += 1
+            metrics.inc("keys_total", filial=filial_code, outcome="pulada")
+            continue
+        yield filial_code, key
+
+# Campos da chave de acesso usados para ordenar o lote, conforme KEY_ORDERING
+KEY_ORDERING_FIELDS = {
+    "emitente": ("emitter_cnpj", "year_month", "series", "note_number"),
+    "mes": ("year_month", "emitter_cnpj", "series", "note_number"),
+}
+
+def order_keys_by_access_key_fields(filial_keys, ordering):
+    """
+    Ordena as tuplas (filial_code, key) pelos campos decodificados da chave de acesso
+    (emitente ou mês de emissão), antes de qualquer requisição.
+    """
+    filial_keys = list(filial_keys)
+    decoded = decode_access_keys_bulk(key for _, key in filial_keys)
+    for index in decoded.order_by(*KEY_ORDERING_FIELDS[ordering]):
+        yield filial_keys[index]
+
+def build_fair_scheduler(logger, run_state, stats):
+    """
+    Monta o FairShareScheduler com uma fila por filial (FILIAL_SHARES, FILIAL_PRIORITIES),
+    já sem as chaves salvas em execuções anteriores e, com KEY_ORDERING, ordenadas
+    dentro de cada filial.
+    """
+    sources = {}
+    for filial_code, filial_keys in iter_keys_by_filial(logger).items():
+        filial_keys = iter_pending_keys(filial_keys, run_state, stats)
+        if KEY_ORDERING:
+            filial_keys = order_keys_by_access_key_fields(filial_keys, KEY_ORDERING)
+        sources[filial_code] = filial_keys
+    if KEY_ORDERING:
+        logger.info(f"Ordenando as chaves de cada filial por '{KEY_ORDERING}' a partir dos campos da chave de acesso.")
+    logger.info(f"Escalonamento justo entre {len(sources)} filial(is).")
+    return FairShareScheduler(sources, logger=logger)
+
+class KeyJob:
+    """
+    Chave em trânsito entre os estágios do pipeline (modo "estagios").
+    `queue_seconds` acumula a espera nas filas dos estágios, que fica fora da latência
+    da chave (key_seconds) e vai para o histograma stage_queue_seconds.
+    """
+
+    __slots__ = ("filial_code", "key", "note_number", "xml_content", "pdf_content", "started_at", "queued_at",
+                 "queue_seconds", "deadline")
+
+    def __init__(self, filial_code, key):
+        self.filial_code = filial_code
+        self.key = key
+        self.started_at = time.perf_counter()
+        self.queued_at = self.started_at
+        self.queue_seconds = 0.0
+        self.deadline = None
+        self.note_number = None
+        self.xml_content = None
+        self.pdf_content = None
+
+def run_thread_pool_pipeline(pending_keys_data, logger, rate_limiter, run_state, max_workers, scheduler=None):
+    """
+    Processa cada chave (XML e DANFE) em um pool de threads; a gravação dos documentos
+    fica com o gravador em segundo plano. Retorna (sucessos, falhas).
+    Com `scheduler` (FairShareScheduler que gera `pending_keys_data`), as chaves que
+    falharam por um erro temporário são reagendadas e o fim de cada uma é informado a ele.
+    """
+    counts = {"success": 0, "failure": 0}
+    counts_lock = threading.Lock()
+
+    def count(success):
+        with counts_lock:
+            counts["success" if success else "failure"] += 1
+
+    def worker(filial_key):
+        filial_code, key = filial_key
+        if scheduler is None:
+            return process_and_save_key(filial_code, key, logger, rate_limiter=rate_limiter, run_state=run_state, on_saved=count)
+        try:
+            return process_and_save_key(
+                filial_code, key, logger, rate_limiter=rate_limiter, run_state=run_state, on_saved=count,
+                requeue=scheduler.requeue,
+            )
+        finally:
+            scheduler.done(filial_code, key)
+
+    for (filial_code, key), fetched, error in run_in_thread_pool(pending_keys_data, worker, max_workers):
+        if error is not None:
+            logger.error(f"Erro inesperado ao processar a chave {key[:10]}... (Filial: {filial_code}): {error}", exc_info=error)
+            metrics.inc("keys_total", filial=filial_code, outcome="erro_inesperado")
+            if run_state is not None:
+                run_state.record_failure(key, filial_code, error)
+            count(False)
+        elif fetched is False:
+            # None: chave reagendada, volta a ser entregue pelo escalonador
+            count(False)
+
+    # Aguarda as gravações ainda na fila antes de contabilizar o resultado
+    close_document_writer()
+    return counts["success"], counts["failure"]
+
+def run_staged_pipeline(pending_keys_data, logger, rate_limiter, run_state, scheduler=None):
+    """
+    Processa as chaves em três estágios ligados por filas limitadas: download do XML,
+    geração da DANFE e gravação. Cada estágio tem seu próprio número de workers, de modo
+    que requisições e gravações em disco de chaves diferentes acontecem ao mesmo tempo.
+    Com `scheduler`, as chaves cujo XML ou DANFE falhou por um erro temporário são reagendadas nele.
+    Retorna (sucessos, falhas).
+    """
+    counts = {"success": 0, "failure": 0}
+    counts_lock = threading.Lock()
+
+    def count(outcome):
+        with counts_lock:
+            counts[outcome] += 1
+
+    def finish(job):
+        if scheduler is not None:
+            scheduler.done(job.filial_code, job.key)
+
+    def fail(job, message, outcome):
+        count("failure")
+        metrics.inc("keys_total", filial=job.filial_code, outcome=outcome)
+        if run_state is not None:
+            run_state.record_failure(job.key, job.filial_code, message)
+        finish(job)
+
+    def requeue(job):
+        if scheduler is None or not scheduler.requeue(job.filial_code, job.key):
+            return False
+        finish(job)
+        return True
+
+    def dequeue(job, stage_name):
+        waited = time.perf_counter() - job.queued_at
+        job.queue_seconds += waited
+        metrics.observe("stage_queue_seconds", waited, stage=stage_name)
+
+    def enqueue(job):
+        job.queued_at = time.perf_counter()
+        return job
+
+    def fetch_stage(job):
+        dequeue(job, "xml")
+        logger.info(f"Processando chave: {job.key[:10]}... (Filial: {job.filial_code})")
+        # O prazo da chave vale para os estágios de XML e DANFE, a partir do início do download;
+        # a espera na fila da DANFE não conta (o prazo fica pausado entre os dois estágios)
+        job.deadline = new_key_deadline()
+        with deadline_scope(job.deadline):
+            job.xml_content, job.note_number, not_found = fetch_xml_for_key(job.key, logger, rate_limiter=rate_limiter)
+        if not job.xml_content:
+            # Nota inexistente no serviço: reagendar só repetiria a mesma resposta
+            if not not_found and requeue(job):
+                return None
+            logger.error(f"Falha ao obter XML para a chave: {job.key[:10]}... (Filial: {job.filial_code}).")
+            fail(job, "Falha ao obter XML.", "falha_transformacao")
+            return None
+        if run_state is not None:
+            run_state.record_stage(job.key, job.filial_code, STAGE_XML_FETCHED, note_number=job.note_number)
+        if job.deadline is not None:
+            job.deadline.pause()
+        return enqueue(job)
+
+    def danfe_stage(job):
+        dequeue(job, "danfe")
+        if job.deadline is not None:
+            job.deadline.resume()
+        with deadline_scope(job.deadline):
+            job.pdf_content = generate_danfe(job.key, job.xml_content, job.note_number, logger, rate_limiter=rate_limiter)
+        if not job.pdf_content:
+            discard_documents(job.xml_content)
+            if requeue(job):
+                return None
+            fail(job, "Falha ao gerar DANFE.", "falha_transformacao")
+            return None
+        if run_state is not None:
+            run_state.record_stage(job.key, job.filial_code, STAGE_DANFE_GENERATED, note_number=job.note_number)
+        return enqueue(job)
+
+    def save_stage(job):
+        dequeue(job, "salvar")
+        # Sem a espera nas filas, key_seconds mede o mesmo que nos modos com pool de threads
+        success = save_key_documents(
+            job.filial_code, job.key, job.note_number, job.xml_content, job.pdf_content, logger, run_state,
+            started_at=job.started_at + job.queue_seconds,
+        )
+        count("success" if success else "failure")
+        finish(job)
+
+    def on_error(stage_name, job, error):
+        logger.error(
+            f"Erro inesperado no estágio '{stage_name}' para a chave {job.key[:10]}... (Filial: {job.filial_code}): {error}",
+            exc_info=error,
+        )
+        # Na gravação, o gravador já entregou ou descartou os arquivos temporários
+        if stage_name != "salvar":
+            discard_documents(job.xml_content, job.pdf_content)
+        fail(job, error, "erro_inesperado")
+
+    pipeline = StagedPipeline(logger, report_interval=STAGE_QUEUE_REPORT_INTERVAL_SECONDS)
+    pipeline.add_stage("xml", fetch_stage, workers=STAGE_XML_WORKERS, queue_size=STAGE_QUEUE_SIZE)
+    pipeline.add_stage("danfe", danfe_stage, workers=STAGE_DANFE_WORKERS, queue_size=STAGE_QUEUE_SIZE)
+    pipeline.add_stage("salvar", save_stage, workers=STAGE_SAVE_WORKERS, queue_size=STAGE_QUEUE_SIZE)
+    pipeline.run((KeyJob(filial_code, key) for filial_code, key in pending_keys_data), on_error=on_error)
+    return counts["success"], counts["failure"]
+
+def write_run_report(logger, extraction_stats, success_count, failure_count, extra=None, suffix=None):
+    """
+    Grava em LOGS/ o relatório JSON da execução: totais, contadores e percentis de latência por estágio.
+    `extra` acrescenta campos ao relatório e `suffix` identifica o processo no nome do arquivo.
+    """
+    duration = max(time.time() - metrics.started_at, 1e-9)
+    xml_fetches = metrics.counter_value("xml_fetch_total")
+    selenium_fallbacks = metrics.counter_value("selenium_fallback_total")
+    report_path = metrics.write_report(LOG_FOLDER, extra={
+        "execution_mode": EXECUTION_MODE,
+        "keys_found": extraction_stats["found"],
+        "keys_skipped": extraction_stats["skipped"],
+        "keys_saved": success_count,
+        "keys_failed": failure_count,
+        "keys_per_second": round((success_count + failure_count) / duration, 3),
+        "selenium_fallback_rate": round(selenium_fallbacks / xml_fetches, 4) if xml_fetches else 0.0,
+        **(extra or {}),
+    }, suffix=suffix)
+    logger.info(f"Relatório da execução gravado em: {report_path}")
 
 def run_data_pipeline():
     logger = setup_logger()
     logger.info(f"Iniciando o pipeline de automação de notas em {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    run_state = None
+    metrics_server = None
+    metrics.reset()
+    extraction_stats = {"found": 0, "skipped": 0}
+    success_count = 0
+    failure_count = 0
 
     try:
+        if METRICS_HTTP_PORT:
+            metrics_server = MetricsServer(METRICS_HTTP_PORT).start()
+            logger.info(f"Métricas disponíveis em http://localhost:{metrics_server.port}/metrics")
+
         logger.info(f"Estágio de Extração: Lendo chaves da pasta '{INPUT_FOLDER}'.")
-        all_filial_keys_data = get_all_filial_keys(logger)
+        if RESUME_ENABLED:
+            run_state = RunStateStore(RUN_STATE_DB_PATH)
+
+        # As chaves são lidas sob demanda: o processamento começa enquanto os arquivos ainda são lidos
+        scheduler = None
+        if FAIR_SCHEDULING_ENABLED:
+            scheduler = build_fair_scheduler(logger, run_state, extraction_stats)
+            pending_keys_data = scheduler
+        else:
+            pending_keys_data = iter_pending_keys(iter_filial_keys(logger), run_state, extraction_stats)
+            if KEY_ORDERING:
+                logger.info(f"Ordenando as chaves por '{KEY_ORDERING}' a partir dos campos da chave de acesso.")
+                pending_keys_data = order_keys_by_access_key_fields(pending_keys_data, KEY_ORDERING)
+
+        # O limite de requisições ao ws.meudanfe.com substitui a pausa fixa entre chaves
+        rate_limiter = TokenBucketRateLimiter(
+            requests_per_second=RATE_LIMIT_REQUESTS_PER_SECOND,
+            max_in_flight=RATE_LIMIT_MAX_IN_FLIGHT,
+            burst=RATE_LIMIT_BURST,
+        )
+
+        if EXECUTION_MODE == "estagios":
+            logger.info(
+                f"Modo de execução: 'estagios' com {STAGE_XML_WORKERS} worker(s) de XML, {STAGE_DANFE_WORKERS} de DANFE "
+                f"e {STAGE_SAVE_WORKERS} de gravação, limite de {RATE_LIMIT_REQUESTS_PER_SECOND} req/s."
+            )
+            success_count, failure_count = run_staged_pipeline(pending_keys_data, logger, rate_limiter, run_state, scheduler)
+        else:
+            max_workers = MAX_WORKERS if EXECUTION_MODE == "concorrente" else 1
+            logger.info(f"Modo de execução: '{EXECUTION_MODE}' com {max_workers} worker(s), limite de {RATE_LIMIT_REQUESTS_PER_SECOND} req/s.")
+            success_count, failure_count = run_thread_pool_pipeline(
+                pending_keys_data, logger, rate_limiter, run_state, max_workers, scheduler,
+            )
 
-        if not all_filial_keys_data:
+        if not extraction_stats["found"]:
             logger.warning("Nenhum arquivo .txt com chaves válidas encontrado ou extraído.")
             return
 
-        logger.info(f"Total de {len(all_filial_keys_data)} chaves encontradas para processamento.")
-
-        for filial_code, key in all_filial_keys_data:
-            logger.info(f"Processando chave: {key[:10]}... (Filial: {filial_code})")
-            
-            # Estágio 2: Transformação
-            xml_content, pdf_content, note_number = process_single_key(key, logger)
-            
-            if xml_content and pdf_content and note_number:
-                # Estágio 3: Carregamento
-                current_date_str = datetime.datetime.now().strftime("%Y-%m-%d")
-                success = save_documents(
-                    filial_code,
-                    current_date_str,
-                    note_number,
-                    xml_content,
-                    pdf_content,
-                    logger
-                )
-                if success:
-                    logger.info(f"Nota {note_number} (Filial: {filial_code}) processada e salva com sucesso.")
-                else:
-                    logger.error(f"Falha ao salvar documentos para nota {note_number} (Filial: {filial_code}).")
-            else:
-                logger.error(f"Falha ao obter XML/DANFE para a chave: {key[:10]}... Detalhes no log da função 'process_single_key'.")
-
-            # --- ADICIONE ESTA LINHA AQUI ---
-            logger.debug(f"Aguardando {REQUEST_DELAY_SECONDS} segundos antes da próxima requisição.")
-            time.sleep(REQUEST_DELAY_SECONDS) 
+        logger.info(f"Total de {extraction_stats['found']} chaves encontradas para processamento.")
+        if extraction_stats["skipped"]:
+            logger.info(f"Retomada: {extraction_stats['skipped']} chave(s) já salvas em execuções anteriores foram puladas.")
+        logger.info(f"Resumo: {success_count} nota(s) salva(s), {failure_count} falha(s).")
 
     except Exception as e:
         logger.critical(f"Erro crítico no pipeline principal: {e}", exc_info=True)
     finally:
+        close_http_client()
+        close_fetchers()
+        close_danfe_render_pool()
+        close_document_writer()
+        close_negative_cache()
+        if run_state is not None:
+            run_state.close()
+        if METRICS_REPORT_ENABLED:
+            try:
+                write_run_report(logger, extraction_stats, success_count, failure_count)
+            except OSError as e:
+                logger.error(f"Não foi possível gravar o relatório da execução: {e}")
+        if metrics_server is not None:
+            metrics_server.stop()
         logger.info(f"Pipeline de automação de notas finalizado em {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        shutdown_logging()
 
 if __name__ == "__main__":
-    run_data_pipeline()
\ No newline at end of file
+    run_data_pipeline()
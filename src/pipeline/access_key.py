@@ -0,0 +1,154 @@
+import re
+from array import array
+
+# Chave de acesso: exatamente 44 dígitos numéricos
+ACCESS_KEY_PATTERN = re.compile(r"\d{44}")
+
+# Códigos de UF do IBGE aceitos na chave de acesso
+VALID_UF_CODES = frozenset({
+    "11", "12", "13", "14", "15", "16", "17",
+    "21", "22", "23", "24", "25", "26", "27", "28", "29",
+    "31", "32", "33", "35",
+    "41", "42", "43",
+    "50", "51", "52", "53",
+})
+
+# Modelos de documento: 55 = NF-e, 65 = NFC-e
+VALID_MODELS = frozenset({"55", "65"})
+
+
+def compute_check_digit(first_43_digits):
+    """
+    Calcula o dígito verificador (módulo 11, pesos 2 a 9 da direita para a esquerda)
+    a partir dos 43 primeiros dígitos da chave de acesso.
+    """
+    total = 0
+    weight = 2
+    for digit in reversed(first_43_digits):
+        total += (ord(digit) - 48) * weight
+        weight = 2 if weight == 9 else weight + 1
+    remainder = total % 11
+    return 0 if remainder < 2 else 11 - remainder
+
+
+def validate_access_key(key):
+    """
+    Valida formato, UF, mês, modelo e dígito verificador da chave de acesso.
+
+    Returns:
+        str or None: Motivo da rejeição, ou None se a chave for válida.
+    """
+    if not ACCESS_KEY_PATTERN.fullmatch(key):
+        return "formato inválido (esperados 44 dígitos)"
+    if key[0:2] not in VALID_UF_CODES:
+        return f"código de UF inválido ({key[0:2]})"
+    if not "01" <= key[4:6] <= "12":
+        return f"mês de emissão inválido ({key[4:6]})"
+    if key[20:22] not in VALID_MODELS:
+        return f"modelo de documento inválido ({key[20:22]})"
+    if compute_check_digit(key[:43]) != ord(key[43]) - 48:
+        return "dígito verificador inválido"
+    return None
+
+
+def is_valid_access_key(key):
+    return validate_access_key(key) is None
+
+
+class AccessKey:
+    """
+    Campos da chave de acesso decodificados, sem precisar baixar ou ler o XML.
+
+    Layout dos 44 dígitos:
+        cUF(2) AAMM(4) CNPJ(14) mod(2) serie(3) nNF(9) tpEmis(1) cNF(8) cDV(1)
+    """
+
+    __slots__ = (
+        "key", "uf", "year_month", "emitter_cnpj", "model",
+        "series", "note_number", "emission_type", "numeric_code", "check_digit",
+    )
+
+    def __init__(self, key):
+        self.key = key
+        self.uf = key[0:2]
+        self.year_month = key[2:6]
+        self.emitter_cnpj = key[6:20]
+        self.model = key[20:22]
+        self.series = int(key[22:25])
+        self.note_number = int(key[25:34])
+        self.emission_type = key[34]
+        self.numeric_code = key[35:43]
+        self.check_digit = int(key[43])
+
+    @property
+    def issue_month(self):
+        """
+        Mês de emissão no formato 'AAAA-MM'.
+        """
+        return f"20{self.year_month[0:2]}-{self.year_month[2:4]}"
+
+    def __repr__(self):
+        return (f"AccessKey(uf={self.uf}, mes={self.issue_month}, cnpj={self.emitter_cnpj}, "
+                f"modelo={self.model}, serie={self.series}, nNF={self.note_number})")
+
+
+def decode_access_key(key):
+    """
+    Decodifica uma chave de acesso válida em um AccessKey.
+    Lança ValueError se a chave não passar na validação.
+    """
+    rejection_reason = validate_access_key(key)
+    if rejection_reason is not None:
+        raise ValueError(f"Chave de acesso inválida: {rejection_reason}.")
+    return AccessKey(key)
+
+
+class DecodedKeyColumns:
+    """
+    Decodificação em lote de chaves de acesso no formato colunar (um array por campo).
+
+    Cada campo numérico fica em um array.array compacto, indexado na mesma ordem
+    das chaves, o que permite agrupar e ordenar milhões de chaves com pouca memória.
+    """
+
+    __slots__ = ("keys", "uf", "year_month", "emitter_cnpj", "model", "series", "note_number")
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        blob = "".join(self.keys)
+
+        def column(typecode, start, end):
+            return array(typecode, map(int, (blob[offset + start:offset + end] for offset in range(0, len(blob), 44))))
+
+        self.uf = column("B", 0, 2)
+        self.year_month = column("H", 2, 6)
+        self.emitter_cnpj = column("Q", 6, 20)
+        self.model = column("B", 20, 22)
+        self.series = column("H", 22, 25)
+        self.note_number = column("L", 25, 34)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def order_by(self, *fields):
+        """
+        Retorna os índices das chaves ordenados pelos campos informados (ex: "emitter_cnpj", "year_month").
+        """
+        columns = [getattr(self, field) for field in fields]
+        return sorted(range(len(self.keys)), key=lambda index: tuple(column[index] for column in columns))
+
+    def group_by(self, field):
+        """
+        Agrupa os índices das chaves pelo valor de um campo. Retorna {valor: [índices]}.
+        """
+        groups = {}
+        for index, value in enumerate(getattr(self, field)):
+            groups.setdefault(value, []).append(index)
+        return groups
+
+
+def decode_access_keys_bulk(keys):
+    """
+    Decodifica uma sequência de chaves válidas de uma só vez, no formato colunar.
+    """
+    return DecodedKeyColumns(keys)
@@ -0,0 +1,255 @@
+import json
+import os
+import shutil
+import tarfile
+import threading
+import time
+
+from src.pipeline.storage import SpooledDocument
+from src.logger_config import module_logger
+
+# Pacote diário de uma filial: <base>/<filial>/<data>.tar + índice <data>.idx.jsonl
+ARCHIVE_SUFFIX = ".tar"
+INDEX_SUFFIX = ".idx.jsonl"
+
+# Separador entre o caminho do pacote e o nome do documento dentro dele (ex: 2025-06-12.tar#XML/123.xml)
+MEMBER_SEPARATOR = "#"
+
+_BLOCK_SIZE = tarfile.BLOCKSIZE
+_END_OF_ARCHIVE = b"\0" * (_BLOCK_SIZE * 2)
+
+DOCUMENT_KINDS = ("xml", "pdf")
+
+
+def archive_paths(base_path, filial_code, date_str):
+    """
+    Retorna (caminho do .tar, caminho do índice) do pacote da filial/data.
+    """
+    filial_folder = os.path.join(base_path, filial_code)
+    return (
+        os.path.join(filial_folder, date_str + ARCHIVE_SUFFIX),
+        os.path.join(filial_folder, date_str + INDEX_SUFFIX),
+    )
+
+
+def member_names(note_number):
+    """
+    Nomes do XML e do PDF dentro do pacote (mesma estrutura das pastas soltas).
+    """
+    return f"XML/{note_number}.xml", f"DANFE/{note_number}.pdf"
+
+
+class NoteArchive:
+    """
+    Pacote .tar com as notas de uma filial em um dia, gravado apenas por acréscimo.
+
+    Cada nota vira dois membros do tar (XML/<nNF>.xml e DANFE/<nNF>.pdf), então o
+    pacote pode ser aberto por qualquer ferramenta (tar -xf). Ao lado fica um índice
+    JSON-lines com a posição de cada documento, para leitura direta por número da
+    nota ou chave de acesso sem percorrer o tar.
+
+    O acréscimo é seguro contra quedas: a linha do índice só é escrita depois que os
+    dados da nota estão no tar, e o índice registra onde o pacote terminava após a
+    nota. Na próxima gravação o tar é truncado nesse ponto, descartando qualquer
+    nota gravada pela metade; linhas incompletas no fim do índice também são descartadas.
+
+    Args:
+        archive_path (str): Caminho do .tar.
+        index_path (str): Caminho do índice .idx.jsonl.
+        logger: Logger do pipeline.
+    """
+
+    def __init__(self, archive_path, index_path, logger=None):
+        self.archive_path = archive_path
+        self.index_path = index_path
+        self.logger = module_logger(logger, __name__)
+        self._entries = []
+        self._by_note_number = {}
+        self._by_access_key = {}
+        self._committed_end = 0
+        self._lock = threading.Lock()
+        self._archive_file = None
+        self._index_file = None
+        self._open()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.archive_path), exist_ok=True)
+        valid_length = self._load_index()
+        archive_size = os.path.getsize(self.archive_path) if os.path.exists(self.archive_path) else 0
+
+        # Com fsync desligado, uma queda de energia pode perder dados do tar já indexados:
+        # as entradas que apontam além do fim real do arquivo são descartadas.
+        if self._committed_end > archive_size:
+            kept = [entry for entry in self._entries if entry["end"] <= archive_size]
+            self.logger.warning(
+                f"Pacote {self.archive_path} menor que o índice: {len(self._entries) - len(kept)} nota(s) descartada(s) do índice."
+            )
+            self._rewrite_index(kept)
+        elif valid_length is not None:
+            with open(self.index_path, "r+b") as f:
+                f.truncate(valid_length)
+
+        self._archive_file = open(self.archive_path, "r+b" if os.path.exists(self.archive_path) else "w+b")
+        self._index_file = open(self.index_path, "ab")
+
+    def _load_index(self):
+        """
+        Lê o índice existente. Retorna o tamanho válido do arquivo se houver uma
+        linha incompleta no final (que deve ser truncada) ou None se estiver íntegro.
+        """
+        if not os.path.exists(self.index_path):
+            return None
+        valid_length = 0
+        with open(self.index_path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("linha incompleta")
+                    entry = json.loads(line)
+                except ValueError:
+                    self.logger.warning(f"Índice {self.index_path} com registro incompleto no final; registro descartado.")
+                    return valid_length
+                self._add_entry(entry)
+                valid_length += len(line)
+        return None
+
+    def _rewrite_index(self, entries):
+        self._entries = []
+        self._by_note_number = {}
+        self._by_access_key = {}
+        self._committed_end = 0
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n")
+                self._add_entry(entry)
+        os.replace(temp_path, self.index_path)
+
+    def _add_entry(self, entry):
+        self._entries.append(entry)
+        self._by_note_number[str(entry["note_number"])] = entry
+        if entry.get("access_key"):
+            self._by_access_key[entry["access_key"]] = entry
+        self._committed_end = entry["end"]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _write_member(self, name, content, mtime):
+        """
+        Escreve cabeçalho, conteúdo e preenchimento de um membro na posição atual do tar.
+        Um SpooledDocument é copiado do arquivo temporário em blocos, sem ir inteiro para a memória.
+        Retorna a posição do conteúdo no pacote.
+        """
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        info.mtime = mtime
+        info.mode = 0o644
+        header = info.tobuf(format=tarfile.USTAR_FORMAT, encoding="utf-8", errors="strict")
+        self._archive_file.write(header)
+        data_offset = self._archive_file.tell()
+        if isinstance(content, SpooledDocument):
+            with content.open() as source:
+                shutil.copyfileobj(source, self._archive_file)
+        else:
+            self._archive_file.write(content)
+        self._archive_file.write(b"\0" * (-len(content) % _BLOCK_SIZE))
+        return data_offset
+
+    def append(self, note_number, xml_content, pdf_content, access_key=None, fsync=False):
+        """
+        Acrescenta o XML e o PDF de uma nota ao pacote e registra a nota no índice.
+        Retorna os nomes dos membros (xml_member, pdf_member).
+        """
+        xml_member, pdf_member = member_names(note_number)
+        mtime = int(time.time())
+        with self._lock:
+            # Descarta o que houver depois da última nota confirmada (fim do tar ou nota incompleta)
+            self._archive_file.seek(self._committed_end)
+            self._archive_file.truncate()
+            xml_offset = self._write_member(xml_member, xml_content, mtime)
+            pdf_offset = self._write_member(pdf_member, pdf_content, mtime)
+            end = self._archive_file.tell()
+            self._archive_file.write(_END_OF_ARCHIVE)
+            self._archive_file.flush()
+            if fsync:
+                os.fsync(self._archive_file.fileno())
+
+            entry = {
+                "note_number": str(note_number),
+                "access_key": access_key,
+                "xml": [xml_offset, len(xml_content)],
+                "pdf": [pdf_offset, len(pdf_content)],
+                "end": end,
+            }
+            self._index_file.write(json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n")
+            self._index_file.flush()
+            if fsync:
+                os.fsync(self._index_file.fileno())
+            self._add_entry(entry)
+        return xml_member, pdf_member
+
+    def find(self, note_number=None, access_key=None):
+        """
+        Retorna o registro do índice da nota (pelo número ou pela chave de acesso) ou None.
+        Se a nota foi gravada mais de uma vez, vale a última gravação.
+        """
+        with self._lock:
+            if access_key is not None:
+                return self._by_access_key.get(access_key)
+            return self._by_note_number.get(str(note_number))
+
+    def read(self, kind="xml", note_number=None, access_key=None):
+        """
+        Lê diretamente do pacote o XML ("xml") ou o PDF ("pdf") de uma nota.
+        Retorna os bytes do documento ou None se a nota não estiver no pacote.
+        """
+        if kind not in DOCUMENT_KINDS:
+            raise ValueError(f"Tipo de documento desconhecido: {kind!r}")
+        entry = self.find(note_number=note_number, access_key=access_key)
+        if entry is None:
+            return None
+        offset, size = entry[kind]
+        with open(self.archive_path, "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def close(self):
+        with self._lock:
+            for f in (self._archive_file, self._index_file):
+                if f is not None:
+                    f.close()
+            self._archive_file = None
+            self._index_file = None
+
+
+class ArchiveStore:
+    """
+    Mantém abertos os pacotes em uso, um por (filial, data).
+    """
+
+    def __init__(self, base_path, logger=None):
+        self.base_path = base_path
+        self.logger = module_logger(logger, __name__)
+        self._archives = {}
+        self._lock = threading.Lock()
+
+    def get(self, filial_code, date_str):
+        cache_key = (filial_code, date_str)
+        with self._lock:
+            archive = self._archives.get(cache_key)
+            if archive is None:
+                archive_path, index_path = archive_paths(self.base_path, filial_code, date_str)
+                archive = NoteArchive(archive_path, index_path, logger=self.logger)
+                self._archives[cache_key] = archive
+            return archive
+
+    def close(self):
+        with self._lock:
+            archives, self._archives = list(self._archives.values()), {}
+        for archive in archives:
+            archive.close()
@@ -0,0 +1,123 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from src.pipeline.metrics import metrics
+
+
+class TokenBucketRateLimiter:
+    """
+    Limitador de requisições no formato "token bucket", compartilhado entre threads.
+
+    Cada requisição consome um token; os tokens são repostos a uma taxa fixa
+    (requisições por segundo) até o limite do balde (rajada máxima). Além da taxa,
+    limita quantas requisições podem estar em andamento ao mesmo tempo.
+
+    Uso:
+        with rate_limiter:
+            requests.post(...)
+    """
+
+    def __init__(self, requests_per_second, max_in_flight, burst=None):
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second deve ser maior que zero.")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight deve ser pelo menos 1.")
+
+        self.rate = float(requests_per_second)
+        self.capacity = float(burst if burst is not None else max(1.0, requests_per_second))
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    def acquire(self, timeout=None):
+        """
+        Bloqueia até existir uma vaga de requisição em andamento e um token disponível.
+        O tempo de espera é registrado na métrica rate_limit_wait_seconds.
+        Com `timeout` (segundos), desiste quando a espera passaria dele e retorna False
+        (sem ocupar vaga nem consumir token); caso contrário retorna True.
+        """
+        started = time.perf_counter()
+        give_up_at = None if timeout is None else started + timeout
+        if not self._in_flight.acquire(timeout=timeout):
+            return False
+        try:
+            while True:
+                with self._lock:
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        metrics.observe("rate_limit_wait_seconds", time.perf_counter() - started)
+                        return True
+                    wait_seconds = (1 - self._tokens) / self.rate
+                if give_up_at is not None and time.perf_counter() + wait_seconds > give_up_at:
+                    self._in_flight.release()
+                    return False
+                time.sleep(wait_seconds)
+        except BaseException:
+            self._in_flight.release()
+            raise
+
+    def release(self):
+        """
+        Libera a vaga de requisição em andamento obtida em acquire().
+        """
+        self._in_flight.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+
+def run_in_thread_pool(items, worker_func, max_workers, max_pending=None):
+    """
+    Executa worker_func(item) para cada item usando um pool de threads limitado.
+
+    Os itens são consumidos sob demanda (funciona com geradores) e no máximo
+    `max_pending` tarefas ficam enfileiradas/em execução ao mesmo tempo, evitando
+    carregar todas as chaves em memória.
+
+    Args:
+        items (iterable): Itens a processar.
+        worker_func (function): Função chamada para cada item.
+        max_workers (int): Número de threads do pool.
+        max_pending (int): Limite de tarefas submetidas ainda não concluídas.
+            Padrão: 2x max_workers.
+
+    Yields:
+        tuple: (item, resultado, exceção) na ordem em que as tarefas terminam.
+    """
+    max_pending = max_pending or max_workers * 2
+    pending = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in items:
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield _collect(pending.pop(future), future)
+
+            pending[executor.submit(worker_func, item)] = item
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield _collect(pending.pop(future), future)
+
+
+def _collect(item, future):
+    exception = future.exception()
+    if exception is not None:
+        return item, None, exception
+    return item, future.result(), None
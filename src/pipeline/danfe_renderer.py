@@ -0,0 +1,485 @@
+import multiprocessing
+import os
+import sys
+import threading
+import zlib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+from src.config import DANFE_RENDER_PROCESSES
+
+# Tamanho A4 em pontos (1/72 de polegada) e margem das páginas
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 20
+
+# Padrões de barras do Code 128 (valores 0 a 105) e o padrão de parada
+_CODE128_PATTERNS = (
+    "212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 "
+    "221312 231212 112232 122132 122231 113222 123122 123221 223211 221132 "
+    "221231 213212 223112 312131 311222 321122 321221 312212 322112 322211 "
+    "212123 212321 232121 111323 131123 131321 112313 132113 132311 211313 "
+    "231113 231311 112133 112331 132131 113123 113321 133121 313121 211331 "
+    "231131 213113 213311 213131 311123 311321 331121 312113 312311 332111 "
+    "314111 221411 431111 111224 111422 121124 121421 141122 141221 112214 "
+    "112412 122114 122411 142112 142211 241211 221114 413111 241112 134111 "
+    "111242 121142 121241 114212 124112 124211 411212 421112 421211 212141 "
+    "214121 412121 111143 111341 131141 114113 114311 411113 411311 113141 "
+    "114131 311141 411131 211412 211214 211232"
+).split()
+_CODE128_STOP = "2331112"
+_CODE128_START_C = 105
+
+# Quantidade de linhas da tabela de produtos por página
+_ITEMS_FIRST_PAGE = 28
+_ITEMS_OTHER_PAGES = 58
+_ITEM_ROW_HEIGHT = 11
+
+
+class PdfCanvas:
+    """
+    Gerador mínimo de PDF (texto, linhas, retângulos) sem dependências externas.
+
+    Usa as fontes padrão Helvetica/Helvetica-Bold com codificação WinAnsi,
+    suficiente para os acentos do português.
+    """
+
+    def __init__(self):
+        self._pages = []
+        self._ops = None
+
+    def new_page(self):
+        self._ops = []
+        self._pages.append(self._ops)
+
+    @staticmethod
+    def _escape(text):
+        raw = str(text).encode("cp1252", errors="replace")
+        return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+    def text(self, x, y, value, size=7, bold=False):
+        font = b"/F2" if bold else b"/F1"
+        self._ops.append(
+            b"BT " + font + b" %d Tf %.2f %.2f Td (" % (size, x, PAGE_HEIGHT - y) + self._escape(value) + b") Tj ET"
+        )
+
+    def rect(self, x, y, width, height, fill=False):
+        op = b"f" if fill else b"S"
+        self._ops.append(b"%.2f %.2f %.2f %.2f re %s" % (x, PAGE_HEIGHT - y - height, width, height, op))
+
+    def line(self, x1, y1, x2, y2):
+        self._ops.append(b"%.2f %.2f m %.2f %.2f l S" % (x1, PAGE_HEIGHT - y1, x2, PAGE_HEIGHT - y2))
+
+    def build(self):
+        """
+        Monta o arquivo PDF completo e retorna seus bytes.
+        """
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            None,  # Pages, preenchido após conhecer os ids das páginas
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        ]
+        page_ids = []
+        for ops in self._pages:
+            stream = zlib.compress(b"0.5 w\n" + b"\n".join(ops))
+            objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+            content_id = len(objects)
+            objects.append(
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+                % (PAGE_WIDTH, PAGE_HEIGHT, content_id)
+            )
+            page_ids.append(len(objects))
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+        objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+        output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(output))
+            output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        xref_offset = len(output)
+        output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        for offset in offsets:
+            output += b"%010d 00000 n \n" % offset
+        output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+        return bytes(output)
+
+
+def _strip_namespaces(root):
+    for element in root.iter():
+        if isinstance(element.tag, str) and "}" in element.tag:
+            element.tag = element.tag.split("}", 1)[1]
+    return root
+
+
+def _text(node, path, default=""):
+    if node is None:
+        return default
+    found = node.find(path)
+    if found is None or found.text is None:
+        return default
+    return found.text.strip()
+
+
+def parse_danfe_data(xml_content):
+    """
+    Lê do XML da NF-e os campos exibidos na DANFE.
+
+    Returns:
+        dict: Dados da nota (ide, emitente, destinatário, totais, itens, protocolo).
+    """
+    root = _strip_namespaces(ET.fromstring(xml_content))
+    inf_nfe = root if root.tag == "infNFe" else root.find(".//infNFe")
+    if inf_nfe is None:
+        raise ValueError("XML não contém o grupo 'infNFe' de uma NF-e.")
+
+    ide = inf_nfe.find("ide")
+    emit = inf_nfe.find("emit")
+    dest = inf_nfe.find("dest")
+    totals = inf_nfe.find("total/ICMSTot")
+    inf_prot = root.find(".//protNFe/infProt")
+
+    access_key = inf_nfe.get("Id", "").replace("NFe", "") or _text(inf_prot, "chNFe")
+
+    def address(node, group):
+        ender = node.find(group) if node is not None else None
+        street = ", ".join(part for part in (_text(ender, "xLgr"), _text(ender, "nro")) if part)
+        return {
+            "street": street,
+            "district": _text(ender, "xBairro"),
+            "city": _text(ender, "xMun"),
+            "uf": _text(ender, "UF"),
+            "cep": _text(ender, "CEP"),
+        }
+
+    items = []
+    for det in inf_nfe.findall("det"):
+        prod = det.find("prod")
+        items.append({
+            "code": _text(prod, "cProd"),
+            "description": _text(prod, "xProd"),
+            "ncm": _text(prod, "NCM"),
+            "cfop": _text(prod, "CFOP"),
+            "unit": _text(prod, "uCom"),
+            "quantity": _text(prod, "qCom"),
+            "unit_value": _text(prod, "vUnCom"),
+            "total_value": _text(prod, "vProd"),
+        })
+
+    return {
+        "access_key": access_key,
+        "number": _text(ide, "nNF"),
+        "series": _text(ide, "serie"),
+        "issue_date": _text(ide, "dhEmi") or _text(ide, "dEmi"),
+        "operation_nature": _text(ide, "natOp"),
+        "operation_type": _text(ide, "tpNF"),
+        "emitter": {
+            "name": _text(emit, "xNome"),
+            "cnpj": _text(emit, "CNPJ") or _text(emit, "CPF"),
+            "ie": _text(emit, "IE"),
+            **address(emit, "enderEmit"),
+        },
+        "recipient": {
+            "name": _text(dest, "xNome"),
+            "cnpj": _text(dest, "CNPJ") or _text(dest, "CPF"),
+            "ie": _text(dest, "IE"),
+            **address(dest, "enderDest"),
+        },
+        "totals": {
+            "icms_base": _text(totals, "vBC", "0.00"),
+            "icms": _text(totals, "vICMS", "0.00"),
+            "products": _text(totals, "vProd", "0.00"),
+            "freight": _text(totals, "vFrete", "0.00"),
+            "insurance": _text(totals, "vSeg", "0.00"),
+            "discount": _text(totals, "vDesc", "0.00"),
+            "other": _text(totals, "vOutro", "0.00"),
+            "ipi": _text(totals, "vIPI", "0.00"),
+            "note": _text(totals, "vNF", "0.00"),
+        },
+        "protocol": " ".join(part for part in (_text(inf_prot, "nProt"), _text(inf_prot, "dhRecbto")) if part),
+        "additional_info": _text(inf_nfe, "infAdic/infCpl"),
+        "items": items,
+    }
+
+
+def code128c_widths(digits):
+    """
+    Retorna a sequência de larguras (barra, espaço, ...) do Code 128 subconjunto C
+    para uma string com quantidade par de dígitos (como a chave de acesso).
+    """
+    values = [_CODE128_START_C] + [int(digits[i:i + 2]) for i in range(0, len(digits), 2)]
+    checksum = (values[0] + sum(value * position for position, value in enumerate(values[1:], 1))) % 103
+    patterns = [_CODE128_PATTERNS[value] for value in values + [checksum]] + [_CODE128_STOP]
+    return [int(width) for pattern in patterns for width in pattern]
+
+
+def _draw_barcode(canvas, x, y, width, height, digits):
+    widths = code128c_widths(digits)
+    module = width / sum(widths)
+    cursor = x
+    for index, units in enumerate(widths):
+        if index % 2 == 0:
+            canvas.rect(cursor, y, units * module, height, fill=True)
+        cursor += units * module
+
+
+def _format_key(access_key):
+    return " ".join(access_key[i:i + 4] for i in range(0, len(access_key), 4))
+
+
+def _fit(value, max_chars):
+    value = str(value)
+    return value if len(value) <= max_chars else value[:max_chars - 3] + "..."
+
+
+def _field(canvas, x, y, width, label, value, height=20, max_chars=None):
+    canvas.rect(x, y, width, height)
+    canvas.text(x + 2, y + 7, label, size=5)
+    canvas.text(x + 2, y + 16, _fit(value, max_chars or int(width / 3.6)), size=7)
+
+
+def _draw_header(canvas, data, page_number, page_count):
+    width = PAGE_WIDTH - 2 * MARGIN
+    y = MARGIN
+    emitter = data["emitter"]
+
+    canvas.rect(MARGIN, y, 230, 90)
+    canvas.text(MARGIN + 5, y + 18, _fit(emitter["name"], 45), size=9, bold=True)
+    canvas.text(MARGIN + 5, y + 34, _fit(emitter["street"], 60))
+    canvas.text(MARGIN + 5, y + 44, _fit(f"{emitter['district']} - {emitter['cep']}", 60))
+    canvas.text(MARGIN + 5, y + 54, _fit(f"{emitter['city']} - {emitter['uf']}", 60))
+
+    canvas.rect(MARGIN + 230, y, 95, 90)
+    canvas.text(MARGIN + 257, y + 16, "DANFE", size=12, bold=True)
+    canvas.text(MARGIN + 234, y + 26, "Documento Auxiliar da", size=6)
+    canvas.text(MARGIN + 234, y + 33, "Nota Fiscal Eletrônica", size=6)
+    canvas.text(MARGIN + 234, y + 45, "0 - ENTRADA   1 - SAÍDA", size=6)
+    canvas.rect(MARGIN + 305, y + 38, 12, 10)
+    canvas.text(MARGIN + 308, y + 46, data["operation_type"], size=8, bold=True)
+    canvas.text(MARGIN + 234, y + 62, f"Nº {data['number']}", size=8, bold=True)
+    canvas.text(MARGIN + 234, y + 72, f"SÉRIE {data['series']}", size=8, bold=True)
+    canvas.text(MARGIN + 234, y + 82, f"FOLHA {page_number}/{page_count}", size=7)
+
+    key_x = MARGIN + 325
+    key_width = width - 325
+    canvas.rect(key_x, y, key_width, 90)
+    if len(data["access_key"]) == 44 and data["access_key"].isdigit():
+        _draw_barcode(canvas, key_x + 10, y + 6, key_width - 20, 34, data["access_key"])
+    canvas.text(key_x + 4, y + 52, "CHAVE DE ACESSO", size=5)
+    canvas.text(key_x + 4, y + 62, _format_key(data["access_key"]), size=7, bold=True)
+    canvas.text(key_x + 4, y + 76, "Consulta de autenticidade no portal nacional da NF-e", size=5)
+    canvas.text(key_x + 4, y + 84, "www.nfe.fazenda.gov.br/portal", size=5)
+
+    y += 90
+    _field(canvas, MARGIN, y, 325, "NATUREZA DA OPERAÇÃO", data["operation_nature"])
+    _field(canvas, MARGIN + 325, y, width - 325, "PROTOCOLO DE AUTORIZAÇÃO DE USO", data["protocol"])
+    y += 20
+    _field(canvas, MARGIN, y, 185, "INSCRIÇÃO ESTADUAL", emitter["ie"])
+    _field(canvas, MARGIN + 185, y, 185, "CNPJ", emitter["cnpj"])
+    _field(canvas, MARGIN + 370, y, width - 370, "DATA DE EMISSÃO", data["issue_date"][:10])
+    return y + 20
+
+
+def _draw_recipient_and_totals(canvas, data, y):
+    width = PAGE_WIDTH - 2 * MARGIN
+    recipient = data["recipient"]
+    totals = data["totals"]
+
+    canvas.text(MARGIN, y + 9, "DESTINATÁRIO / REMETENTE", size=6, bold=True)
+    y += 11
+    _field(canvas, MARGIN, y, 370, "NOME / RAZÃO SOCIAL", recipient["name"])
+    _field(canvas, MARGIN + 370, y, width - 370, "CNPJ / CPF", recipient["cnpj"])
+    y += 20
+    _field(canvas, MARGIN, y, 300, "ENDEREÇO", recipient["street"])
+    _field(canvas, MARGIN + 300, y, 135, "BAIRRO / DISTRITO", recipient["district"])
+    _field(canvas, MARGIN + 435, y, width - 435, "CEP", recipient["cep"])
+    y += 20
+    _field(canvas, MARGIN, y, 300, "MUNICÍPIO", recipient["city"])
+    _field(canvas, MARGIN + 300, y, 40, "UF", recipient["uf"])
+    _field(canvas, MARGIN + 340, y, width - 340, "INSCRIÇÃO ESTADUAL", recipient["ie"])
+    y += 24
+
+    canvas.text(MARGIN, y + 9, "CÁLCULO DO IMPOSTO", size=6, bold=True)
+    y += 11
+    column = width / 5
+    first_row = [("BASE DE CÁLC. DO ICMS", "icms_base"), ("VALOR DO ICMS", "icms"), ("VALOR DO IPI", "ipi"),
+                 ("V. TOTAL PRODUTOS", "products"), ("VALOR DO FRETE", "freight")]
+    second_row = [("VALOR DO SEGURO", "insurance"), ("DESCONTO", "discount"), ("OUTRAS DESPESAS", "other"),
+                  ("", None), ("V. TOTAL DA NOTA", "note")]
+    for row in (first_row, second_row):
+        for index, (label, field_name) in enumerate(row):
+            _field(canvas, MARGIN + index * column, y, column, label, totals[field_name] if field_name else "")
+        y += 20
+    return y + 4
+
+
+_ITEM_COLUMNS = (
+    ("CÓDIGO", 55, "code"),
+    ("DESCRIÇÃO DO PRODUTO / SERVIÇO", 200, "description"),
+    ("NCM", 45, "ncm"),
+    ("CFOP", 30, "cfop"),
+    ("UN", 25, "unit"),
+    ("QUANT.", 50, "quantity"),
+    ("V. UNITÁRIO", 75, "unit_value"),
+    ("V. TOTAL", 75, "total_value"),
+)
+
+
+def _draw_items(canvas, items, y):
+    canvas.text(MARGIN, y + 9, "DADOS DOS PRODUTOS / SERVIÇOS", size=6, bold=True)
+    y += 11
+    x = MARGIN
+    for label, column_width, _ in _ITEM_COLUMNS:
+        canvas.rect(x, y, column_width, 12)
+        canvas.text(x + 2, y + 8, label, size=5, bold=True)
+        x += column_width
+    y += 12
+    for item in items:
+        x = MARGIN
+        for _, column_width, field_name in _ITEM_COLUMNS:
+            canvas.text(x + 2, y + 8, _fit(item[field_name], int(column_width / 3.4)), size=6)
+            x += column_width
+        y += _ITEM_ROW_HEIGHT
+    canvas.line(MARGIN, y + 2, PAGE_WIDTH - MARGIN, y + 2)
+    return y + 6
+
+
+def _draw_additional_info(canvas, data, y):
+    canvas.text(MARGIN, y + 9, "DADOS ADICIONAIS", size=6, bold=True)
+    y += 11
+    height = PAGE_HEIGHT - MARGIN - y
+    canvas.rect(MARGIN, y, PAGE_WIDTH - 2 * MARGIN, height)
+    info = data["additional_info"]
+    line_chars = 140
+    max_lines = max(0, int((height - 6) / 8))
+    for index in range(min(max_lines, (len(info) + line_chars - 1) // line_chars)):
+        canvas.text(MARGIN + 3, y + 9 + index * 8, info[index * line_chars:(index + 1) * line_chars], size=6)
+
+
+def render_danfe_pdf(xml_content):
+    """
+    Gera localmente o PDF da DANFE (layout retrato simplificado) a partir do XML da NF-e.
+
+    Args:
+        xml_content (bytes): Conteúdo XML da nota (nfeProc ou NFe).
+
+    Returns:
+        bytes: Conteúdo do PDF gerado.
+    """
+    data = parse_danfe_data(xml_content)
+    items = data["items"]
+    remaining = max(0, len(items) - _ITEMS_FIRST_PAGE)
+    page_count = 1 + (remaining + _ITEMS_OTHER_PAGES - 1) // _ITEMS_OTHER_PAGES
+
+    canvas = PdfCanvas()
+    canvas.new_page()
+    y = _draw_header(canvas, data, 1, page_count)
+    y = _draw_recipient_and_totals(canvas, data, y)
+    y = _draw_items(canvas, items[:_ITEMS_FIRST_PAGE], y)
+    _draw_additional_info(canvas, data, y)
+
+    for page_number in range(2, page_count + 1):
+        start = _ITEMS_FIRST_PAGE + (page_number - 2) * _ITEMS_OTHER_PAGES
+        canvas.new_page()
+        y = _draw_header(canvas, data, page_number, page_count)
+        _draw_items(canvas, items[start:start + _ITEMS_OTHER_PAGES], y)
+
+    return canvas.build()
+
+
+def _render_or_none(xml_content):
+    try:
+        return render_danfe_pdf(xml_content)
+    except Exception:
+        return None
+
+
+def render_danfe_batch(xml_contents, max_workers=None):
+    """
+    Gera as DANFEs de vários XMLs em paralelo, usando um processo por núcleo de CPU.
+
+    Args:
+        xml_contents (list): Lista de conteúdos XML (bytes).
+        max_workers (int): Número de processos. Padrão: quantidade de CPUs.
+
+    Returns:
+        list: PDFs (bytes) na mesma ordem da entrada; None para XMLs que não puderam ser renderizados.
+    """
+    xml_contents = list(xml_contents)
+    if len(xml_contents) <= 1 or max_workers == 1:
+        return [_render_or_none(xml_content) for xml_content in xml_contents]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        chunksize = max(1, len(xml_contents) // ((max_workers or os.cpu_count() or 1) * 4))
+        return list(executor.map(_render_or_none, xml_contents, chunksize=chunksize))
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_danfe_render_pool():
+    """
+    Retorna o pool de processos compartilhado da renderização (DANFE_RENDER_PROCESSES),
+    criando-o na primeira chamada, ou None se a renderização deve ficar na thread que a pede.
+    """
+    global _shared_pool
+    if DANFE_RENDER_PROCESSES == 0:
+        return None
+    if _shared_pool is None:
+        with _shared_pool_lock:
+            if _shared_pool is None:
+                # "spawn" em vez de fork: o pool nasce com as threads do pipeline (HTTP, gravador)
+                # já rodando, e um fork copiaria os locks que elas estiverem segurando
+                _shared_pool = ProcessPoolExecutor(
+                    max_workers=DANFE_RENDER_PROCESSES or os.cpu_count() or 1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _shared_pool
+
+
+def render_danfe_pdf_in_pool(xml_content):
+    """
+    Gera o PDF da DANFE em um processo do pool compartilhado e aguarda o resultado: a
+    renderização usa os núcleos de CPU sem disputar o GIL com as threads do pipeline.
+    Levanta as mesmas exceções de render_danfe_pdf.
+    """
+    pool = get_danfe_render_pool()
+    if pool is None:
+        return render_danfe_pdf(xml_content)
+    return pool.submit(render_danfe_pdf, xml_content).result()
+
+
+def close_danfe_render_pool():
+    """
+    Encerra os processos do pool compartilhado (chamado ao final do pipeline).
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is not None:
+            _shared_pool.shutdown(wait=True)
+            _shared_pool = None
+
+
+if __name__ == "__main__":
+    # Uso: python -m src.pipeline.danfe_renderer <pasta_com_xmls> [pasta_de_saida]
+    # Gera um PDF para cada .xml da pasta (útil para refazer DANFEs de XMLs já salvos).
+    source_folder = sys.argv[1]
+    target_folder = sys.argv[2] if len(sys.argv) > 2 else source_folder
+    os.makedirs(target_folder, exist_ok=True)
+
+    xml_names = sorted(name for name in os.listdir(source_folder) if name.lower().endswith(".xml"))
+    xml_batch = []
+    for name in xml_names:
+        with open(os.path.join(source_folder, name), "rb") as f:
+            xml_batch.append(f.read())
+
+    rendered = render_danfe_batch(xml_batch)
+    for name, pdf_content in zip(xml_names, rendered):
+        if pdf_content is None:
+            print(f"Falha ao gerar DANFE para '{name}'.")
+            continue
+        with open(os.path.join(target_folder, os.path.splitext(name)[0] + ".pdf"), "wb") as f:
+            f.write(pdf_content)
+    print(f"{sum(1 for pdf in rendered if pdf)} de {len(xml_names)} DANFE(s) gerada(s) em '{target_folder}'.")
@@ -0,0 +1,62 @@
+import os
+import shutil
+import time
+
+# Extensões de arquivos que o Chrome (e outros navegadores) usam enquanto o download não terminou
+PARTIAL_DOWNLOAD_SUFFIXES = (".crdownload", ".part", ".tmp")
+
+
+def clear_download_dir(download_dir):
+    """
+    Esvazia o diretório de downloads de uma sessão, mantendo a pasta em si.
+    """
+    os.makedirs(download_dir, exist_ok=True)
+    for entry in os.scandir(download_dir):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def wait_for_download(download_dir, timeout_seconds, extension=".xml", poll_interval=0.1):
+    """
+    Aguarda um download terminar no diretório informado e retorna o caminho do arquivo.
+
+    O download é considerado concluído quando existe um arquivo com a extensão
+    esperada e não há mais arquivos parciais (ex: '.crdownload'). Retorna assim
+    que a condição é satisfeita, em vez de esperar um tempo fixo.
+
+    Args:
+        download_dir (str): Diretório de downloads exclusivo da sessão do navegador.
+        timeout_seconds (float): Prazo máximo de espera.
+        extension (str): Extensão do arquivo esperado.
+        poll_interval (float): Intervalo entre verificações, em segundos.
+
+    Returns:
+        str or None: Caminho do arquivo baixado, ou None se o prazo expirar.
+    """
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        completed = []
+        partial = False
+        try:
+            with os.scandir(download_dir) as entries:
+                for entry in entries:
+                    name = entry.name.lower()
+                    if name.endswith(PARTIAL_DOWNLOAD_SUFFIXES):
+                        partial = True
+                    elif name.endswith(extension):
+                        completed.append(entry.path)
+        except FileNotFoundError:
+            pass
+
+        if completed and not partial:
+            return max(completed, key=os.path.getmtime)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(poll_interval, remaining))
@@ -1,69 +1,134 @@
 import os
 import re
 from src.config import INPUT_FOLDER
+from src.pipeline.access_key import validate_access_key
+from src.logger_config import module_logger
+
+# Padrão regex para encontrar "FILIAL XX" no nome do arquivo
+FILIAL_FILENAME_PATTERN = re.compile(r'FILIAL (\d+)', re.IGNORECASE)
 
 def parse_filial_from_filename(filename):
     """
     Extrai o código da filial do nome do arquivo (Ex: 'CHAVES FILIAL 04.txt' -> 'FILIAL 04').
     Retorna None se o padrão não for encontrado.
     """
-    # Padrão regex para encontrar "FILIAL XX"
-    match = re.search(r'FILIAL (\d+)', filename, re.IGNORECASE)
+    match = FILIAL_FILENAME_PATTERN.search(filename)
     if match:
         # Retorna o código da filial formatado como "FILIAL 04"
         return f"FILIAL {match.group(1).zfill(2)}"
     return None
 
-def read_keys_from_file(filepath, logger):
+def iter_keys_from_file(filepath, logger):
     """
-    Lê um arquivo .txt e extrai as chaves de acesso.
-    Espera 44 dígitos numéricos por linha.
+    Lê um arquivo .txt linha a linha e gera as chaves de acesso válidas.
+    Cada linha deve ter 44 dígitos com UF, modelo e dígito verificador corretos;
+    linhas inválidas são registradas no log e ignoradas.
     """
-    keys = []
+    logger = module_logger(logger, __name__)
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             for line_num, line in enumerate(f, 1):
                 # Remove espaços em branco, quebras de linha
                 clean_line = line.strip()
-                # Padrão regex para 44 dígitos numéricos
-                if re.fullmatch(r'\d{44}', clean_line):
-                    keys.append(clean_line)
+                if not clean_line:
+                    continue
+                rejection_reason = validate_access_key(clean_line)
+                if rejection_reason is None:
+                    yield clean_line
                 else:
-                    logger.warning(f"Linha {line_num} no arquivo '{os.path.basename(filepath)}' ignorada: '{clean_line}' (Formato inválido).")
-        return keys
+                    logger.warning(f"Linha {line_num} no arquivo '{os.path.basename(filepath)}' ignorada: '{clean_line}' ({rejection_reason}).")
     except FileNotFoundError:
         logger.error(f"Arquivo '{filepath}' não encontrado.")
-        return []
     except Exception as e:
         logger.error(f"Erro ao ler o arquivo '{filepath}': {e}", exc_info=True)
-        return []
 
-def get_all_filial_keys(logger):
+def read_keys_from_file(filepath, logger):
     """
-    Percorre a pasta de entrada, lê todos os arquivos .txt e
-    retorna uma lista de tuplas (filial_code, key).
+    Lê um arquivo .txt e retorna a lista de chaves de acesso válidas.
     """
-    all_data = []
-    
-    try:
-        for filename in os.listdir(INPUT_FOLDER):
-            if filename.endswith(".txt"):
-                filepath = os.path.join(INPUT_FOLDER, filename)
-                filial_code = parse_filial_from_filename(filename)
+    return list(iter_keys_from_file(filepath, logger))
 
-                if not filial_code:
-                    logger.warning(f"Nome de arquivo inválido para filial: '{filename}'. Pulando.")
-                    continue
-
-                logger.info(f"Processando arquivo de chaves: '{filename}' para filial: '{filial_code}'.")
-                keys = read_keys_from_file(filepath, logger)
-
-                for key in keys:
-                    all_data.append((filial_code, key))
-        return all_data
+def iter_key_files(logger):
+    """
+    Gera tuplas (filename, filepath, filial_code) para os arquivos .txt da pasta de
+    entrada, em ordem alfabética. Arquivos sem código de filial no nome são ignorados.
+    """
+    logger = module_logger(logger, __name__)
+    try:
+        filenames = sorted(os.listdir(INPUT_FOLDER))
     except FileNotFoundError:
         logger.error(f"Pasta de entrada '{INPUT_FOLDER}' não encontrada. Certifique-se de que ela existe.")
-        return []
+        return
     except Exception as e:
         logger.critical(f"Erro crítico ao listar arquivos na pasta de entrada: {e}", exc_info=True)
-        return []
\ No newline at end of file
+        return
+
+    for filename in filenames:
+        if not filename.endswith(".txt"):
+            continue
+        filial_code = parse_filial_from_filename(filename)
+
+        if not filial_code:
+            logger.warning(f"Nome de arquivo inválido para filial: '{filename}'. Pulando.")
+            continue
+        yield filename, os.path.join(INPUT_FOLDER, filename), filial_code
+
+def _iter_unique_file_keys(filename, filepath, filial_code, seen_keys, logger):
+    """
+    Gera as chaves do arquivo ainda não presentes em `seen_keys` (conjunto compartilhado
+    entre os arquivos, com as chaves como inteiros) e as acrescenta a ele.
+    """
+    logger = module_logger(logger, __name__)
+    logger.info(f"Processando arquivo de chaves: '{filename}' para filial: '{filial_code}'.")
+    duplicate_count = 0
+    for key in iter_keys_from_file(filepath, logger):
+        key_id = int(key)
+        if key_id in seen_keys:
+            duplicate_count += 1
+            continue
+        seen_keys.add(key_id)
+        yield key
+
+    if duplicate_count:
+        logger.warning(f"{duplicate_count} chave(s) duplicada(s) ignorada(s) no arquivo '{filename}'.")
+
+def iter_filial_keys(logger):
+    """
+    Percorre a pasta de entrada e gera tuplas (filial_code, key) à medida que os
+    arquivos são lidos, sem carregar todas as chaves em memória.
+    Chaves repetidas (no mesmo arquivo ou em arquivos de filiais diferentes) são
+    geradas apenas na primeira ocorrência.
+    """
+    # As chaves já vistas são guardadas como inteiros, que ocupam menos memória que strings
+    seen_keys = set()
+    for filename, filepath, filial_code in iter_key_files(logger):
+        for key in _iter_unique_file_keys(filename, filepath, filial_code, seen_keys, logger):
+            yield filial_code, key
+
+def _iter_filial_files(files, filial_code, seen_keys, logger):
+    for filename, filepath in files:
+        for key in _iter_unique_file_keys(filename, filepath, filial_code, seen_keys, logger):
+            yield filial_code, key
+
+def iter_keys_by_filial(logger):
+    """
+    Retorna {filial_code: gerador de tuplas (filial_code, key)}, um por filial, para que
+    as chaves de cada filial possam ser consumidas de forma intercalada. Cada gerador lê
+    os arquivos da sua filial sob demanda. Chaves repetidas em filiais diferentes são
+    geradas apenas pela filial que chegar a elas primeiro.
+    """
+    seen_keys = set()
+    files_by_filial = {}
+    for filename, filepath, filial_code in iter_key_files(logger):
+        files_by_filial.setdefault(filial_code, []).append((filename, filepath))
+    return {
+        filial_code: _iter_filial_files(files, filial_code, seen_keys, logger)
+        for filial_code, files in files_by_filial.items()
+    }
+
+def get_all_filial_keys(logger):
+    """
+    Percorre a pasta de entrada, lê todos os arquivos .txt e
+    retorna uma lista de tuplas (filial_code, key).
+    """
+    return list(iter_filial_keys(logger))
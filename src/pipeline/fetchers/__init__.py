@@ -0,0 +1,67 @@
+"""
+Backends de obtenção do XML (API direta, fluxo do site via HTTP, navegador, ...), carregados sob demanda.
+
+Cada backend só é importado e inicializado quando é usado pela primeira vez: uma
+execução em que a API responde nunca importa o Selenium, e ambientes sem navegador
+não precisam dele instalado. A ordem de tentativa vem de XML_FETCHER_ORDER.
+"""
+import importlib
+import threading
+
+from src.config import XML_FETCHER_ORDER
+from src.pipeline.fetchers.base import FetchResult, XmlFetcher
+
+# Nome do backend -> "módulo:classe", importado apenas no primeiro uso
+FETCHER_BACKENDS = {
+    "api": "src.pipeline.fetchers.api:ApiXmlFetcher",
+    "site": "src.pipeline.fetchers.site:SiteXmlFetcher",
+    "navegador": "src.pipeline.fetchers.browser:BrowserXmlFetcher",
+}
+
+_fetchers = {}
+_fetchers_lock = threading.Lock()
+
+
+def register_fetcher(name, target):
+    """
+    Registra um backend adicional ("módulo:classe"), utilizável em XML_FETCHER_ORDER.
+    """
+    FETCHER_BACKENDS[name] = target
+
+
+def get_fetcher(name):
+    """
+    Retorna a instância do backend `name` no processo, importando o módulo na primeira chamada.
+    """
+    fetcher = _fetchers.get(name)
+    if fetcher is None:
+        with _fetchers_lock:
+            fetcher = _fetchers.get(name)
+            if fetcher is None:
+                try:
+                    module_name, class_name = FETCHER_BACKENDS[name].split(":")
+                except KeyError:
+                    raise ValueError(f"Backend de XML desconhecido: {name!r} (disponíveis: {', '.join(FETCHER_BACKENDS)})") from None
+                fetcher_class = getattr(importlib.import_module(module_name), class_name)
+                fetcher = _fetchers[name] = fetcher_class()
+    return fetcher
+
+
+def iter_fetchers(order=None):
+    """
+    Gera os backends na ordem configurada, importando cada um apenas quando chega a vez dele.
+    """
+    for name in order or XML_FETCHER_ORDER:
+        yield get_fetcher(name)
+
+
+def close_fetchers():
+    """
+    Libera os recursos dos backends inicializados (ex: fecha os navegadores do pool).
+    """
+    with _fetchers_lock:
+        fetchers = list(_fetchers.values())
+        _fetchers.clear()
+    for fetcher in fetchers:
+        fetcher.close()
+
@@ -0,0 +1,65 @@
+"""
+Backend "api": baixa o XML direto do ws.meudanfe.com (POST, chave na URL, payload texto puro).
+"""
+from src.config import (
+    MEUDANFE_API_XML_DOWNLOAD_BASE_URL,  # URL base para download de XML
+    STREAMING_TRANSFER_ENABLED,
+)
+from src.logger_config import module_logger, truncate_payload
+from src.pipeline.fetchers.base import FetchResult, XmlFetcher, is_not_found_response
+from src.pipeline.http_client import get_http_client
+from src.pipeline.resilience import RETRYABLE_STATUS_CODES
+from src.pipeline.streaming import receive_nfe_xml
+
+
+class ApiXmlFetcher(XmlFetcher):
+    """
+    Obtém o XML pela API do meudanfe usando o cliente HTTP compartilhado (keep-alive,
+    novas tentativas e disjuntor). Com STREAMING_TRANSFER_ENABLED, o XML vai da conexão
+    direto para um arquivo temporário e o nNF é lido durante o download.
+    """
+
+    name = "api"
+    source = "api"
+
+    def fetch(self, key, logger, rate_limiter=None, http_client=None):
+        logger = module_logger(logger, __name__)
+        http_client = http_client or get_http_client()
+        xml_download_url = f"{MEUDANFE_API_XML_DOWNLOAD_BASE_URL}{key}"
+
+        # Payload para a requisição de download do XML (a própria chave codificada em bytes)
+        # Os headers padrão já estão configurados na sessão do cliente HTTP.
+        xml_payload = key.encode("utf-8")
+
+        logger.debug(
+            f"Tentando baixar XML de: {xml_download_url} com payload de {len(xml_payload)} bytes."
+        )
+
+        xml_response = http_client.post(
+            xml_download_url,
+            data=xml_payload,
+            rate_limiter=rate_limiter,
+            endpoint="xml",
+            logger=logger,
+            stream=STREAMING_TRANSFER_ENABLED,
+        )
+
+        if xml_response.status_code == 200:
+            if STREAMING_TRANSFER_ENABLED:
+                xml_document, note_number = receive_nfe_xml(xml_response)
+                return FetchResult(xml_document, note_number=note_number)
+            return FetchResult(xml_response.content)
+
+        # Com o endpoint fora do ar (circuito aberto), abrir o navegador só desperdiça tempo:
+        # a chave fica como falha e é refeita na próxima execução.
+        if xml_response.status_code in RETRYABLE_STATUS_CODES and http_client.get_circuit_breaker("xml").is_open:
+            logger.error(
+                f"Endpoint de XML indisponível (status {xml_response.status_code}) após {http_client.retry_policy.max_attempts} tentativa(s). "
+                f"Os demais meios de obter o XML não serão usados para a chave {key}."
+            )
+            return FetchResult(stop_fallback=True)
+
+        logger.error(
+            f"Erro ao baixar XML para a chave {key}: Status {xml_response.status_code} - Resposta: {truncate_payload(xml_response.text)}"
+        )
+        return FetchResult(not_found=is_not_found_response(xml_response.status_code))
@@ -0,0 +1,49 @@
+class FetchResult:
+    """
+    Resultado de uma tentativa de obter o XML por um backend.
+
+    Args:
+        content (bytes | SpooledDocument): XML obtido (em memória ou, na transferência em
+            fluxo, em arquivo temporário), ou None se o backend não conseguiu.
+        stop_fallback (bool): Se True, os backends seguintes não são tentados
+            (ex: o serviço está fora do ar e o navegador também falharia).
+        not_found (bool): Se True, o serviço respondeu definitivamente que a nota não
+            existe (e não uma falha temporária); a chave pode ir para o cache negativo.
+        note_number (str): nNF já lido do XML durante o download, se o backend o leu.
+    """
+
+    __slots__ = ("content", "stop_fallback", "not_found", "note_number")
+
+    def __init__(self, content=None, stop_fallback=False, not_found=False, note_number=None):
+        self.content = content
+        self.stop_fallback = stop_fallback
+        self.not_found = not_found
+        self.note_number = note_number
+
+
+def is_not_found_response(status_code):
+    """
+    Se a resposta indica definitivamente que a nota não existe no serviço (404).
+    Os demais status, inclusive 401, 403, 429 e páginas de erro ou de login com "not found"
+    no texto, são falhas temporárias: a chave não vai para o cache negativo.
+    """
+    return status_code == 404
+
+
+class XmlFetcher:
+    """
+    Backend de obtenção do XML de uma nota a partir da chave de acesso.
+
+    Subclasses definem `name` (usado em XML_FETCHER_ORDER), `source` (rótulo da
+    métrica xml_fetch_total) e fetch(). Recursos caros (navegadores, sessões) devem
+    ser criados no primeiro fetch(), não no construtor, e liberados em close().
+    """
+
+    name = None
+    source = None
+
+    def fetch(self, key, logger, rate_limiter=None, http_client=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
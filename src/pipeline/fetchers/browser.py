@@ -0,0 +1,381 @@
+"""
+Backend "navegador": busca a chave no site meudanfe.com.br com um Chrome headless
+(Selenium) e baixa o XML pela página de resultados.
+
+Este módulo só é importado quando o backend é usado pela primeira vez, então o
+Selenium e o webdriver_manager são dependências opcionais.
+"""
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service as ChromeService
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
+from webdriver_manager.chrome import ChromeDriverManager
+import functools
+import threading
+import time
+import os
+import shutil # Para limpar a pasta de downloads entre os testes
+
+from src.config import (
+    REQUEST_TIMEOUT_SECONDS,
+    MEUDANFE_WEB_URL,
+    WEBDRIVER_POOL_SIZE,
+    WEBDRIVER_MAX_USES,
+    WEBDRIVER_POOL_PREWARM,
+    SELENIUM_DOWNLOAD_TIMEOUT_SECONDS,
+    DOWNLOAD_POLL_INTERVAL_SECONDS,
+)
+from src.pipeline.downloads import wait_for_download
+from src.pipeline.fetchers.base import FetchResult, XmlFetcher
+from src.pipeline.metrics import metrics
+from src.pipeline.transform import extract_note_number_from_xml
+from src.pipeline.webdriver_pool import WebDriverPool
+from src.logger_config import module_logger
+
+SELENIUM_HEADLESS = True # Mude para False para VER o navegador abrindo e agindo.
+# Caminho para downloads temporários do Selenium (cada navegador do pool usa uma subpasta própria).
+# A pasta só é criada quando o primeiro navegador é aberto.
+TEMP_DOWNLOAD_DIR = os.path.abspath("temp_downloads_selenium")
+
+_webdriver_pool = None
+_webdriver_pool_lock = threading.Lock()
+
+def make_logger_func(logger):
+    """
+    Adapta um logger padrão para a assinatura logger_func(level, message, **kwargs)
+    usada pelas funções do Selenium.
+    """
+    logger = module_logger(logger, __name__)
+    def logger_func(level, message, **kwargs):
+        getattr(logger, level)(message, **kwargs)
+    return logger_func
+
+@functools.lru_cache(maxsize=None)
+def resolve_chromedriver_path():
+    """
+    Resolve (e baixa, se necessário) o binário do ChromeDriver uma única vez por processo.
+    """
+    return ChromeDriverManager().install()
+
+def initialize_webdriver(headless_mode, timeout_seconds, download_dir, logger_func, driver_path=None, clean_download_dir=True):
+    """
+    Inicializa e configura um WebDriver Chrome para automação,
+    com foco em downloads automáticos e modo headless.
+
+    Args:
+        headless_mode (bool): Se True, o navegador não será exibido.
+        timeout_seconds (int): Tempo limite para carregamento de páginas e elementos.
+        download_dir (str): Caminho para o diretório de downloads temporário.
+        logger_func (function): Função de log a ser usada (ex: logger.info, log_message).
+        driver_path (str): Caminho do ChromeDriver já resolvido. Se None, usa o ChromeDriverManager.
+        clean_download_dir (bool): Se True, apaga e recria o diretório de downloads.
+
+    Returns:
+        webdriver.Chrome or None: Uma instância configurada do WebDriver, ou None em caso de erro.
+    """
+    # 1. Garante que o diretório de downloads esteja limpo e pronto
+    if clean_download_dir and os.path.exists(download_dir):
+        shutil.rmtree(download_dir) # Remove a pasta e todo o seu conteúdo
+        time.sleep(0.5) # Pequena pausa para garantir que a pasta foi deletada
+    os.makedirs(download_dir, exist_ok=True) # Recria a pasta vazia
+    logger_func("info", f"Pasta de downloads temporária pronta: {download_dir}")
+
+    driver = None
+    try:
+        chrome_options = Options()
+        if headless_mode:
+            chrome_options.add_argument("--headless")
+        
+        # Argumentos para otimização e estabilidade
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--window-size=1920,1080")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--allow-running-insecure-content")
+        chrome_options.add_argument("--ignore-certificate-errors")
+        
+        # --- OPÇÕES CRÍTICAS PARA DOWNLOADS AUTOMÁTICOS ---
+        prefs = {
+            "download.default_directory": download_dir,
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "plugins.always_open_pdf_externally": True,
+            
+            # Preferências de Segurança para Download (ajustadas para 'safeBrowse.enabled' corretamente)
+            "safeBrowse.enabled": False, # Desabilita a Navegação Segura por completo
+            "safeBrowse.disable_download_protection": True, # Desabilita proteção de download
+            "safeBrowse.disable_extension_blacklist": True,
+            "profile.default_content_setting_values.automatic_downloads": 1, # Permite downloads automáticos
+            "profile.default_content_setting_values.notifications": 2, # Bloqueia notificações
+        }
+        chrome_options.add_experimental_option("prefs", prefs)
+
+        # Argumentos adicionais para burlar verificações de download e segurança
+        chrome_options.add_argument("--disable-features=SafeBrowse") # Outra forma de desabilitar SafeBrowse
+        chrome_options.add_argument("--allow-untrusted-downloads")
+        chrome_options.add_argument("--disable-popup-blocking")
+        chrome_options.add_argument("--no-default-browser-check")
+        
+        # Argumentos que podem ser necessários para evitar detecção de automação
+        chrome_options.add_argument("--disable-blink-features=AutomationControlled")
+        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        chrome_options.add_experimental_option('useAutomationExtension', False)
+
+        logger_func("info", f"Inicializando o WebDriver Chrome com opções de download no diretório: {download_dir}")
+        service = ChromeService(driver_path or resolve_chromedriver_path())
+        driver = webdriver.Chrome(service=service, options=chrome_options)
+        driver.set_page_load_timeout(timeout_seconds)
+        logger_func("info", "WebDriver inicializado com sucesso.")
+        return driver
+
+    except WebDriverException as e:
+        logger_func("error", f"WebDriverException ao inicializar o WebDriver. Verifique se o Chrome está instalado e o ChromeDriver é compatível. Erro: {e}")
+        logger_func("error", "Tente atualizar o Chrome ou a biblioteca webdriver-manager.")
+        return None
+    except Exception as e:
+        logger_func("error", f"Erro inesperado ao inicializar o WebDriver: {e}", exc_info=True)
+        return None
+
+def perform_meudanfe_search(driver, key, web_url, timeout_seconds, logger_func):
+    """
+    Navega para a página do meudanfe.com.br, insere a chave de acesso e clica no botão de busca.
+
+    Args:
+        driver (webdriver.Chrome): A instância do WebDriver.
+        key (str): A chave de acesso da nota fiscal.
+        web_url (str): A URL base do site (MEUDANFE_WEB_URL).
+        timeout_seconds (int): Tempo limite para espera de elementos.
+        logger_func (function): Função de log a ser usada (ex: log_message).
+
+    Returns:
+        bool: True se a busca foi realizada com sucesso, False caso contrário.
+    """
+    if not driver:
+        logger_func("error", "WebDriver não está inicializado para realizar a busca.")
+        return False
+
+    try:
+        logger_func("info", f"Navegando para: {web_url}")
+        driver.get(web_url)
+
+        # --- LOCALIZADORES COM BASE NO HTML FORNECIDO ---
+        # Campo de input da chave de acesso (pelo placeholder)
+        input_field_locator = (By.XPATH, "//input[@placeholder='Digite a CHAVE DE ACESSO']")
+        
+        # Botão "Buscar DANFE/XML" (pelo texto)
+        consult_button_locator = (By.XPATH, "//button[contains(text(), 'Buscar DANFE/XML')]")
+
+        logger_func("info", f"Procurando campo de input da chave com {input_field_locator}")
+        WebDriverWait(driver, timeout_seconds).until(
+            EC.presence_of_element_located(input_field_locator)
+        )
+        input_element = driver.find_element(*input_field_locator)
+        input_element.send_keys(key)
+        logger_func("info", f"Chave {key[:10]}... inserida no campo.")
+
+        logger_func("info", f"Procurando botão de consulta com {consult_button_locator}")
+        WebDriverWait(driver, timeout_seconds).until(
+            EC.element_to_be_clickable(consult_button_locator)
+        )
+        driver.find_element(*consult_button_locator).click()
+        logger_func("info", "Botão 'Buscar DANFE/XML' clicado. Aguardando resultados...")
+
+        # Aguardar que a URL mude para /ver-danfe
+        logger_func("info", "Aguardando carregamento da página de resultados (/ver-danfe)...")
+        WebDriverWait(driver, timeout_seconds).until(
+            EC.url_contains("/ver-danfe")
+        )
+        logger_func("info", f"Página de resultados carregada: {driver.current_url}")
+        
+    
+        return True
+
+    except TimeoutException:
+        logger_func("error", "Tempo limite excedido ao esperar por elemento ou carregamento da página.")
+        return False
+    except NoSuchElementException as e:
+        logger_func("error", f"Elemento não encontrado na página durante a busca: {e}")
+        return False
+    except WebDriverException as e:
+        logger_func("error", f"Erro no WebDriver durante a busca: {e}", exc_info=True)
+        return False
+    except Exception as e:
+        logger_func("error", f"Erro inesperado na navegação/inserção da chave: {e}", exc_info=True)
+        return False
+
+
+def extract_xml_results_page(driver, key, timeout_seconds, download_dir, logger_func, extract_nfe_func):
+    """
+    Extrai o conteúdo XML e PDF da página de resultados (/ver-danfe).
+
+    Args:
+        driver (webdriver.Chrome): A instância do WebDriver.
+        key (str): A chave de acesso da nota fiscal (para logs e simulação de número).
+        timeout_seconds (int): Tempo limite para espera de elementos.
+        download_dir (str): Diretório de downloads exclusivo da sessão do navegador.
+        logger_func (function): Função de log a ser usada.
+        extract_nfe_func (function): Função para extrair o número da nota do XML.
+
+    Returns:
+        bytes or None: Conteúdo do XML baixado, ou None em caso de falha.
+    """
+    xml_content = None
+    
+    if not driver:
+        logger_func("error", "WebDriver não está inicializado para extrair documentos.")
+        return None
+
+    try:
+        # Espera adicional para garantir que a página de resultados está totalmente pronta
+        # Isso pode ser ajustado com base na sua observação da página /ver-danfe.
+        logger_func("info", "Aguardando elementos específicos na página de resultados...")
+        # Ex: esperar por um botão de download, ou um elemento que indica sucesso na busca.
+        # WebDriverWait(driver, timeout_seconds).until(EC.presence_of_element_located((By.ID, "algum_id_do_resultado")))
+        
+        # --- Lógica de clique no pop-up de segurança de download (se ainda ocorrer) ---
+        # Adicione aqui o bloco de try-except para clicar no pop-up "Baixar arquivo não verificado"
+        # que desenvolvemos anteriormente.
+        try:
+            unverified_download_button_locator = (By.XPATH, "//button[contains(text(), 'Baixar arquivo não verificado')]")
+            WebDriverWait(driver, 5).until(EC.element_to_be_clickable(unverified_download_button_locator))
+            driver.find_element(*unverified_download_button_locator).click()
+            logger_func("info", "Botão 'Baixar arquivo não verificado' clicado.")
+            time.sleep(1) # Pequena pausa após o clique
+        except (TimeoutException, NoSuchElementException):
+            logger_func("debug", "Pop-up 'Baixar arquivo não verificado' não encontrado ou não apareceu.")
+        except Exception as e:
+            logger_func("error", f"Erro ao tentar clicar no pop-up de segurança: {e}")
+
+        # --- ETAPA DE DOWNLOAD DO XML ---
+        xml_download_locator = (By.XPATH, "//button[contains(text(), 'Baixar XML')]")
+
+        logger_func("info", f"Procurando botão/link de download de XML: {xml_download_locator}")
+        WebDriverWait(driver, timeout_seconds).until(
+            EC.element_to_be_clickable(xml_download_locator)
+        )
+        xml_download_element = driver.find_element(*xml_download_locator)
+        
+        logger_func("info", "Botão/link de Baixar XML encontrado. Clicando...")
+        xml_download_element.click() 
+
+        # Aguarda o download terminar (sem arquivos '.crdownload') ou o prazo expirar
+        downloaded_xml_path = wait_for_download(
+            download_dir,
+            timeout_seconds=SELENIUM_DOWNLOAD_TIMEOUT_SECONDS,
+            extension=".xml",
+            poll_interval=DOWNLOAD_POLL_INTERVAL_SECONDS,
+        )
+
+        if downloaded_xml_path:
+            logger_func("info", f"Arquivo XML baixado encontrado: {downloaded_xml_path}")
+            with open(downloaded_xml_path, 'rb') as f:
+                xml_content = f.read()
+            logger_func("info", "Conteúdo XML lido do arquivo baixado.")
+        else:
+            logger_func("error", f"Nenhum XML concluído na pasta de downloads em até {SELENIUM_DOWNLOAD_TIMEOUT_SECONDS}s após o clique.")
+            
+        return xml_content    
+
+    except TimeoutException:
+        logger_func("error", f"Tempo limite excedido ao esperar por elemento na página de resultados para a chave: {key}.")
+    except NoSuchElementException as e:
+        logger_func("error", f"Elemento esperado não encontrado na página de resultados para a chave: {key}: {e}")
+    except WebDriverException as e:
+        logger_func("error", f"Erro no WebDriver (navegador) durante a extração de documentos: {e}", exc_info=True)
+    except Exception as e:
+        logger_func("critical", f"Erro crítico e inesperado durante a extração de documentos: {e}", exc_info=True)
+    
+    return None
+
+
+def get_webdriver_pool(logger):
+    """
+    Retorna o pool de WebDrivers do processo, criando-o no primeiro fallback.
+    O binário do ChromeDriver é resolvido uma única vez e reaproveitado por todos os navegadores.
+    """
+    global _webdriver_pool
+    if _webdriver_pool is None:
+        with _webdriver_pool_lock:
+            if _webdriver_pool is None:
+                logger_func = make_logger_func(logger)
+                if os.path.exists(TEMP_DOWNLOAD_DIR):
+                    shutil.rmtree(TEMP_DOWNLOAD_DIR)
+                driver_path = resolve_chromedriver_path()
+
+                def driver_factory(download_dir):
+                    return initialize_webdriver(
+                        headless_mode=SELENIUM_HEADLESS,
+                        timeout_seconds=REQUEST_TIMEOUT_SECONDS,
+                        download_dir=download_dir,
+                        logger_func=logger_func,
+                        driver_path=driver_path,
+                        clean_download_dir=False,
+                    )
+
+                pool = WebDriverPool(
+                    size=WEBDRIVER_POOL_SIZE,
+                    driver_factory=driver_factory,
+                    max_uses=WEBDRIVER_MAX_USES,
+                    logger=logger,
+                    download_root=TEMP_DOWNLOAD_DIR,
+                )
+                if WEBDRIVER_POOL_PREWARM:
+                    pool.warm_up()
+                _webdriver_pool = pool
+    return _webdriver_pool
+
+def close_webdriver_pool():
+    """
+    Encerra os navegadores do pool, se ele chegou a ser criado.
+    """
+    global _webdriver_pool
+    with _webdriver_pool_lock:
+        if _webdriver_pool is not None:
+            _webdriver_pool.close()
+            _webdriver_pool = None
+
+def fetch_xml_with_selenium(key, logger):
+    """
+    Fallback via navegador: busca a chave no site meudanfe.com.br usando um
+    WebDriver emprestado do pool e baixa o XML pela página de resultados.
+    Retorna o conteúdo XML em bytes ou None em caso de falha.
+    """
+    logger = module_logger(logger, __name__)
+    logger_func = make_logger_func(logger)
+    with metrics.timer("selenium_fetch_seconds") as timer:
+        xml_content = None
+        with get_webdriver_pool(logger).driver() as pooled:
+            if pooled is None:
+                logger.error(f"Nenhum WebDriver disponível para o fallback da chave {key[:10]}...")
+            elif perform_meudanfe_search(driver=pooled.driver, key=key, web_url=MEUDANFE_WEB_URL, timeout_seconds=REQUEST_TIMEOUT_SECONDS, logger_func=logger_func):
+                xml_content = extract_xml_results_page(
+                    driver=pooled.driver,
+                    key=key,
+                    timeout_seconds=REQUEST_TIMEOUT_SECONDS,
+                    download_dir=pooled.download_dir,
+                    logger_func=logger_func,
+                    extract_nfe_func=extract_note_number_from_xml
+                )
+        outcome = "ok" if xml_content else "falha"
+        timer.set(outcome=outcome)
+    metrics.inc("selenium_fallback_total", outcome=outcome)
+    return xml_content
+
+
+
+class BrowserXmlFetcher(XmlFetcher):
+    """
+    Obtém o XML pelo site, com um navegador emprestado do pool (aberto no primeiro uso).
+    """
+
+    name = "navegador"
+    source = "selenium"
+
+    def fetch(self, key, logger, rate_limiter=None, http_client=None):
+        return FetchResult(fetch_xml_with_selenium(key, logger))
+
+    def close(self):
+        close_webdriver_pool()
@@ -0,0 +1,382 @@
+"""
+Backend "site": reproduz com requisições HTTP comuns o caminho que o navegador faz no
+www.meudanfe.com.br (página inicial -> consulta da chave -> ver-danfe -> download do XML),
+incluindo cookies de sessão e tokens extraídos das respostas.
+
+Custa algumas requisições por chave, contra segundos e centenas de MB de um Chrome;
+o backend "navegador" fica como último recurso. O roteiro de requisições é um dado
+(DEFAULT_SITE_FLOW), substituível por um arquivo JSON gravado do site (SITE_FLOW_PATH)
+quando o site mudar, sem alterar o código.
+"""
+import contextlib
+import json
+import queue
+import re
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import (
+    MEUDANFE_WEB_URL,
+    MEUDANFE_API_XML_DOWNLOAD_BASE_URL,
+    REQUEST_TIMEOUT_SECONDS,
+    HTTP_POOL_CONNECTIONS,
+    SITE_FLOW_PATH,
+    SITE_SESSION_POOL_SIZE,
+    SITE_SESSION_MAX_USES,
+)
+from src.logger_config import module_logger, truncate_payload
+from src.pipeline.fetchers.base import FetchResult, XmlFetcher, is_not_found_response
+from src.pipeline.http_client import DEFAULT_HEADERS
+from src.pipeline.latency import bound_timeout, rate_limited
+from src.pipeline.metrics import metrics
+
+# Headers de navegação (carregamento de página), aplicados por cima dos headers da sessão.
+# Valores None removem o header da sessão nesta requisição.
+NAVIGATION_HEADERS = {
+    "authority": None,
+    "origin": None,
+    "content-type": None,
+    "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "sec-fetch-dest": "document",
+    "sec-fetch-mode": "navigate",
+    "sec-fetch-site": "same-origin",
+    "upgrade-insecure-requests": "1",
+}
+
+# Roteiro padrão, montado a partir das requisições do site observadas no navegador.
+# Cada passo:
+#   name              nome do passo (rótulo das métricas e dos logs)
+#   method, url       método e URL; {variavel} é substituída (ver _base_variables)
+#   headers, body     opcionais; um header que cita variável inexistente não é enviado
+#   expect_status     status aceitos (padrão [200])
+#   once_per_session  se True, só roda quando a sessão é nova (cookies, tokens)
+#   extract           lista de {"var", "from": body|cookie|header|json, "pattern"|"name"|"path", "required"}
+#   result            marca o passo cuja resposta é o XML
+DEFAULT_SITE_FLOW = [
+    {
+        "name": "pagina_inicial",
+        "method": "GET",
+        "url": "{web_url}",
+        "headers": NAVIGATION_HEADERS,
+        "once_per_session": True,
+        "extract": [
+            {"var": "token", "from": "body", "pattern": r'<meta\s+name="csrf-token"\s+content="([^"]+)"', "required": False},
+        ],
+    },
+    {
+        "name": "consulta",
+        "method": "POST",
+        "url": "{api_url}/api/v1/get/nfe/data/MEUDANFE/{key}",
+        "body": "{key}",
+        "headers": {"x-csrf-token": "{token}"},
+    },
+    {
+        "name": "ver_danfe",
+        "method": "GET",
+        "url": "{web_url}ver-danfe",
+        "headers": dict(NAVIGATION_HEADERS, referer="{web_url}"),
+    },
+    {
+        "name": "xml",
+        "method": "POST",
+        "url": "{xml_url}{key}",
+        "body": "{key}",
+        "headers": {"referer": "{web_url}ver-danfe", "x-csrf-token": "{token}"},
+        "result": True,
+    },
+]
+
+# Status que indicam sessão expirada: a chave é refeita uma vez com uma sessão nova
+_SESSION_EXPIRED_STATUS = (401, 403, 419)
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+class SiteFlowError(Exception):
+    """
+    Falha em um passo do roteiro (status inesperado, variável ausente, resposta sem XML).
+    """
+
+    def __init__(self, step_name, message, status_code=None, not_found=False):
+        super().__init__(f"passo '{step_name}': {message}")
+        self.status_code = status_code
+        self.not_found = not_found
+
+
+def render_template(template, variables):
+    """
+    Substitui {nome} pelas variáveis. Chaves de JSON ({"a": 1}) não são afetadas.
+    Levanta KeyError com o nome da variável se ela não existir.
+    """
+    def replace(match):
+        return str(variables[match.group(1)])
+    return _PLACEHOLDER.sub(replace, template)
+
+
+def extract_variable(rule, response):
+    """
+    Aplica uma regra de extração a uma resposta. Retorna o valor ou None se não encontrado.
+    """
+    source = rule.get("from", "body")
+    if source == "cookie":
+        return response.cookies.get(rule["name"])
+    if source == "header":
+        return response.headers.get(rule["name"])
+    if source == "json":
+        try:
+            value = response.json()
+            for part in rule["path"].split("."):
+                value = value[int(part)] if isinstance(value, list) else value[part]
+        except (ValueError, KeyError, IndexError, TypeError):
+            return None
+        return None if value is None else str(value)
+    match = re.search(rule["pattern"], response.text)
+    return match.group(1) if match else None
+
+
+def looks_like_xml(content):
+    """
+    Se o corpo parece um XML de nota (e não uma página HTML de erro ou login).
+    """
+    head = content.lstrip()[:64].lower()
+    return head.startswith(b"<") and not head.startswith((b"<html", b"<!doctype"))
+
+
+def load_site_flow(path=None):
+    """
+    Carrega o roteiro de um arquivo JSON (lista de passos) ou retorna o roteiro padrão.
+    """
+    if path is None:
+        return DEFAULT_SITE_FLOW
+    with open(path, "r", encoding="utf-8") as f:
+        flow = json.load(f)
+    if not isinstance(flow, list) or not flow:
+        raise ValueError(f"Roteiro do site em '{path}' deve ser uma lista de passos.")
+    for step in flow:
+        missing = [field for field in ("name", "method", "url") if field not in step]
+        if missing:
+            raise ValueError(f"Passo do roteiro sem {', '.join(missing)}: {step!r}")
+    if sum(1 for step in flow if step.get("result")) != 1:
+        raise ValueError(f"Roteiro do site em '{path}' precisa de exatamente um passo com \"result\": true.")
+    return flow
+
+
+def _mentions_key(step):
+    """
+    Se o passo consulta a chave (usa {key} na URL ou no corpo).
+    """
+    return any("{key}" in (step.get(field) or "") for field in ("url", "body"))
+
+
+def _base_variables():
+    api = urlsplit(MEUDANFE_API_XML_DOWNLOAD_BASE_URL)
+    return {
+        "web_url": MEUDANFE_WEB_URL,
+        "api_url": f"{api.scheme}://{api.netloc}",
+        "xml_url": MEUDANFE_API_XML_DOWNLOAD_BASE_URL,
+    }
+
+
+class SiteSession:
+    """
+    Uma sessão do site: cookies, variáveis extraídas nos passos de sessão e contagem de usos.
+    `ready` indica que os passos de sessão (once_per_session) já rodaram com sucesso.
+    """
+
+    __slots__ = ("session", "variables", "uses", "ready")
+
+    def __init__(self, session):
+        self.session = session
+        self.reset()
+
+    def reset(self):
+        self.session.cookies.clear()
+        self.variables = {}
+        self.uses = 0
+        self.ready = False
+
+
+class SiteSessionPool:
+    """
+    Sessões HTTP emprestadas uma por chave, para que cookies e tokens de chaves
+    simultâneas não se misturem. Todas compartilham o mesmo pool de conexões
+    keep-alive (um único HTTPAdapter); descartar uma sessão apenas limpa os
+    cookies, sem fechar conexões.
+
+    Args:
+        size (int): Número máximo de sessões em uso ao mesmo tempo.
+        max_uses (int): Chaves atendidas por uma sessão antes de ela recomeçar (cookies novos).
+    """
+
+    def __init__(self, size, max_uses):
+        if size < 1:
+            raise ValueError("O pool de sessões do site precisa de pelo menos 1 sessão.")
+        self.size = size
+        self.max_uses = max_uses
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._adapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_CONNECTIONS,
+            pool_maxsize=size,
+            pool_block=True,
+            max_retries=0,
+        )
+
+    def _create(self):
+        session = requests.Session()
+        session.headers.update(DEFAULT_HEADERS)
+        session.mount("https://", self._adapter)
+        session.mount("http://", self._adapter)
+        metrics.inc("site_sessions_total")
+        return SiteSession(session)
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Empresta uma sessão (a mais recente ociosa, com cookies ainda válidos).
+        Se o bloco levantar exceção, a sessão volta ao pool zerada.
+        """
+        self._slots.acquire()
+        try:
+            try:
+                site_session = self._idle.get_nowait()
+            except queue.Empty:
+                site_session = self._create()
+            try:
+                yield site_session
+            except BaseException:
+                site_session.reset()
+                raise
+            finally:
+                if site_session.uses >= self.max_uses:
+                    site_session.reset()
+                self._idle.put(site_session)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._adapter.close()
+
+
+class SiteXmlFetcher(XmlFetcher):
+    """
+    Obtém o XML reproduzindo o roteiro de requisições do site, com uma sessão
+    emprestada do pool (criado no primeiro uso).
+    """
+
+    name = "site"
+    source = "site"
+
+    def __init__(self):
+        self._pool = None
+        self._flow = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._flow = load_site_flow(SITE_FLOW_PATH)
+                    self._pool = SiteSessionPool(SITE_SESSION_POOL_SIZE, SITE_SESSION_MAX_USES)
+        return self._pool
+
+    def _run_step(self, step, site_session, variables, rate_limiter):
+        name = step["name"]
+        try:
+            url = render_template(step["url"], variables)
+            body = render_template(step["body"], variables).encode("utf-8") if step.get("body") is not None else None
+        except KeyError as e:
+            raise SiteFlowError(name, f"variável {e} não disponível") from None
+
+        headers = {}
+        for header, value in (step.get("headers") or {}).items():
+            if value is None:
+                headers[header] = None
+                continue
+            try:
+                headers[header] = render_template(value, variables)
+            except KeyError:
+                continue
+
+        endpoint = f"site_{name}"
+        with rate_limited(rate_limiter):
+            with metrics.timer("http_request_seconds", endpoint=endpoint) as timer:
+                response = site_session.session.request(
+                    step["method"], url, data=body, headers=headers, timeout=bound_timeout(REQUEST_TIMEOUT_SECONDS),
+                )
+                timer.set(status=response.status_code)
+        metrics.inc("http_responses_total", endpoint=endpoint, status=response.status_code)
+
+        if response.status_code not in step.get("expect_status", (200,)):
+            # Só os passos que consultam a chave dizem algo sobre ela: um 404 na página
+            # inicial indica que o site mudou, não que a nota não existe
+            raise SiteFlowError(
+                name, f"status {response.status_code} - Resposta: {truncate_payload(response.text)}", response.status_code,
+                not_found=_mentions_key(step) and is_not_found_response(response.status_code),
+            )
+
+        extracted = {}
+        for rule in step.get("extract") or ():
+            value = extract_variable(rule, response)
+            if value is None:
+                if rule.get("required", True):
+                    raise SiteFlowError(name, f"variável '{rule['var']}' não encontrada na resposta")
+                continue
+            extracted[rule["var"]] = value
+        return response, extracted
+
+    def _run_flow(self, key, site_session, rate_limiter):
+        variables = dict(_base_variables(), **site_session.variables, key=key)
+        for step in self._flow:
+            if step.get("once_per_session") and site_session.ready:
+                continue
+            response, extracted = self._run_step(step, site_session, variables, rate_limiter)
+            variables.update(extracted)
+            if step.get("once_per_session"):
+                site_session.variables.update(extracted)
+            if step.get("result"):
+                if not looks_like_xml(response.content):
+                    raise SiteFlowError(step["name"], f"resposta não é XML: {truncate_payload(response.text)}")
+                site_session.ready = True
+                site_session.uses += 1
+                return response.content
+        raise SiteFlowError("fim", "o roteiro terminou sem um passo com \"result\": true")
+
+    def fetch(self, key, logger, rate_limiter=None, http_client=None):
+        logger = module_logger(logger, __name__)
+        pool = self._get_pool()
+        with metrics.timer("site_fetch_seconds") as timer:
+            xml_content = None
+            not_found = False
+            with pool.session() as site_session:
+                # Uma sessão reaproveitada pode ter expirado no site: refaz a chave uma vez do zero
+                for fresh_retry in (False, True):
+                    try:
+                        xml_content = self._run_flow(key, site_session, rate_limiter)
+                        break
+                    except SiteFlowError as e:
+                        reused = site_session.ready and not fresh_retry
+                        site_session.reset()
+                        if reused and e.status_code in _SESSION_EXPIRED_STATUS:
+                            logger.debug(f"Sessão do site expirada ({e}); refazendo a chave {key[:10]}... com sessão nova.")
+                            continue
+                        logger.error(f"Fluxo do site falhou para a chave {key}: {e}")
+                        not_found = e.not_found
+                        break
+                    except requests.exceptions.RequestException as e:
+                        site_session.reset()
+                        metrics.inc("http_errors_total", endpoint="site", error=type(e).__name__)
+                        logger.error(f"Erro de rede no fluxo do site para a chave {key}: {e}")
+                        break
+            outcome = "ok" if xml_content else "falha"
+            timer.set(outcome=outcome)
+        return FetchResult(xml_content, not_found=not_found)
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
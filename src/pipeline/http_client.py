@@ -0,0 +1,336 @@
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FutureTimeoutError, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import (
+    REQUEST_TIMEOUT_SECONDS,
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAXSIZE,
+    RETRY_MAX_ATTEMPTS,
+    RETRY_BASE_DELAY_SECONDS,
+    RETRY_MAX_DELAY_SECONDS,
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RECOVERY_SECONDS,
+)
+from src.pipeline.latency import DeadlineExceeded, LatencyPolicy, bound_timeout, current_deadline, rate_limited
+from src.pipeline.metrics import metrics
+from src.pipeline.storage import SpooledDocument
+from src.pipeline.resilience import (
+    RETRYABLE_STATUS_CODES,
+    CircuitBreaker,
+    RetryPolicy,
+    parse_retry_after,
+)
+from src.logger_config import module_logger
+
+# Headers enviados em todas as requisições ao ws.meudanfe.com.
+# Montados uma única vez e reaproveitados pela sessão compartilhada.
+DEFAULT_HEADERS = {
+    "authority": "ws.meudanfe.com",
+    "accept": "*/*",
+    "accept-encoding": "gzip, deflate, br, zstd",
+    "accept-language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
+    "content-type": "text/plain;charset=UTF-8",
+    "origin": "https://www.meudanfe.com.br",
+    "referer": "https://www.meudanfe.com.br/",
+    "sec-ch-ua": '"Google Chrome";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+    "sec-fetch-dest": "empty",
+    "sec-fetch-mode": "cors",
+    "sec-fetch-site": "cross-site",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
+}
+
+
+class MeuDanfeHttpClient:
+    """
+    Cliente HTTP compartilhado entre threads para as APIs do meudanfe.
+
+    Mantém um pool de conexões keep-alive por host (urllib3), de modo que
+    chaves consecutivas reaproveitam a conexão TCP+TLS já aberta em vez de
+    fazer um novo handshake a cada requisição.
+
+    Sem tempo limite explícito, cada requisição usa o tempo derivado da latência
+    observada no endpoint (LatencyPolicy), cortado pelo prazo da chave em
+    processamento (ver src/pipeline/latency.py). Nos endpoints configurados, uma
+    requisição mais lenta que o normal ganha uma cópia em paralelo e vale a
+    primeira resposta.
+
+    Args:
+        pool_connections (int): Quantidade de hosts distintos com pool próprio.
+        pool_maxsize (int): Conexões mantidas abertas por host (use >= número de workers).
+        timeout (int): Tempo limite padrão das requisições, em segundos.
+        default_headers (dict): Headers aplicados a todas as requisições.
+        retry_policy (RetryPolicy): Política de novas tentativas para requisições com `endpoint`.
+        latency_policy (LatencyPolicy): Tempos limite adaptativos e cópias de requisições lentas.
+    """
+
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 timeout=REQUEST_TIMEOUT_SECONDS, default_headers=None, retry_policy=None, latency_policy=None):
+        self.timeout = timeout
+        self.latency_policy = latency_policy or LatencyPolicy(max_timeout=timeout)
+        self._hedge_workers = pool_maxsize * 2
+        self._hedge_executor = None
+        self._hedge_executor_lock = threading.Lock()
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_attempts=RETRY_MAX_ATTEMPTS,
+            base_delay=RETRY_BASE_DELAY_SECONDS,
+            max_delay=RETRY_MAX_DELAY_SECONDS,
+        )
+        self._circuit_breakers = {}
+        self._circuit_breakers_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS if default_headers is None else default_headers)
+
+        # pool_block=True faz as threads aguardarem uma conexão livre em vez de
+        # abrir conexões extras que seriam descartadas logo em seguida.
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+            max_retries=0,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_circuit_breaker(self, endpoint, logger=None):
+        """
+        Retorna o disjuntor do endpoint, criando-o no primeiro uso.
+        """
+        with self._circuit_breakers_lock:
+            breaker = self._circuit_breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name=endpoint,
+                    failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                    recovery_timeout=CIRCUIT_BREAKER_RECOVERY_SECONDS,
+                    logger=module_logger(logger, __name__),
+                )
+                self._circuit_breakers[endpoint] = breaker
+            return breaker
+
+    def _resolve_timeout(self, timeout, endpoint):
+        """
+        Tempo limite da próxima requisição: o informado ou o adaptativo do endpoint.
+        O corte pelo prazo da chave é feito no envio (_send_once), depois da espera no
+        limitador. Levanta DeadlineExceeded se o prazo já acabou.
+        """
+        timeout = timeout or self.latency_policy.timeout_for(endpoint)
+        metrics.observe("http_timeout_seconds", bound_timeout(timeout), endpoint=endpoint)
+        return timeout
+
+    def _send_once(self, url, data, headers, timeout, rate_limiter, endpoint, stream=False, deadline=None,
+                   observe_timeout=True):
+        # Corpo em arquivo temporário: cada envio (nova tentativa ou cópia) lê o arquivo com um handle próprio
+        with rate_limited(rate_limiter, deadline), \
+                (data.open() if isinstance(data, SpooledDocument) else contextlib.nullcontext(data)) as body:
+            # O prazo é passado explicitamente: as cópias rodam em outra thread, sem o prazo da chave
+            request_timeout = bound_timeout(timeout, deadline)
+            started = time.perf_counter()
+            with metrics.timer("http_request_seconds", endpoint=endpoint) as timer:
+                try:
+                    response = self.session.post(url, data=body, headers=headers, timeout=request_timeout, stream=stream)
+                except requests.exceptions.Timeout:
+                    # O tempo esperado entra na janela: o limite sobe se o serviço ficou mais lento.
+                    # Um limite cortado pelo prazo da chave não diz nada sobre o serviço.
+                    if observe_timeout and request_timeout >= timeout:
+                        self.latency_policy.observe(endpoint, time.perf_counter() - started)
+                    raise
+                timer.set(status=response.status_code)
+        # Respostas de erro do proxy (502, 503...) são rápidas e distorceriam os percentis
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            self.latency_policy.observe(endpoint, response.elapsed.total_seconds())
+        metrics.inc("http_responses_total", endpoint=endpoint, status=response.status_code)
+        return response
+
+    def _get_hedge_executor(self):
+        if self._hedge_executor is None:
+            with self._hedge_executor_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=self._hedge_workers, thread_name_prefix="http-copia")
+        return self._hedge_executor
+
+    def _send_hedged(self, url, data, headers, timeout, rate_limiter, endpoint, hedge_delay, stream=False,
+                     deadline=None):
+        """
+        Envia a requisição e, se ela não terminar em `hedge_delay` segundos, uma cópia.
+        Retorna a primeira resposta; a outra é descartada quando chegar.
+        """
+        executor = self._get_hedge_executor()
+        primary = executor.submit(self._send_once, url, data, headers, timeout, rate_limiter, endpoint, stream, deadline)
+        try:
+            return primary.result(timeout=hedge_delay)
+        except FutureTimeoutError:
+            pass
+        if not self.latency_policy.try_start_hedge(endpoint):
+            return primary.result()
+
+        metrics.inc("http_hedges_total", endpoint=endpoint)
+        # O limite da cópia é encurtado pelo atraso: seu timeout não entra na janela de latência
+        hedge = executor.submit(
+            self._send_once, url, data, headers, max(0.1, timeout - hedge_delay), rate_limiter, endpoint, stream,
+            deadline, False,
+        )
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    if future is hedge:
+                        metrics.inc("http_hedge_wins_total", endpoint=endpoint)
+                    for other in pending:
+                        other.add_done_callback(_close_discarded_response)
+                    return future.result()
+        raise error
+
+    def _send(self, url, data, headers, timeout, rate_limiter, endpoint=None, stream=False):
+        endpoint = endpoint or "outro"
+        deadline = current_deadline()
+        hedge_delay = self.latency_policy.hedge_delay(endpoint)
+        if hedge_delay is None or hedge_delay >= bound_timeout(timeout, deadline):
+            return self._send_once(url, data, headers, timeout, rate_limiter, endpoint, stream, deadline)
+        return self._send_hedged(url, data, headers, timeout, rate_limiter, endpoint, hedge_delay, stream, deadline)
+
+    def post(self, url, data=None, headers=None, timeout=None, rate_limiter=None, endpoint=None, logger=None,
+             stream=False):
+        """
+        Envia um POST pela sessão compartilhada.
+
+        Quando `endpoint` é informado, a requisição passa pelo disjuntor daquele
+        endpoint e falhas temporárias (conexão, timeout, 429/5xx) são repetidas
+        com backoff exponencial, respeitando Retry-After e a dica "try again in N seconds".
+        Uma nova tentativa que não caberia no prazo da chave não é feita, e as esperas no
+        disjuntor e no limitador terminam com DeadlineExceeded quando o prazo acaba.
+
+        Com stream=True, o corpo da resposta não é lido: quem chama deve consumi-lo
+        (ex: DocumentSpool.receive) ou fechar a resposta, devolvendo a conexão ao pool.
+
+        Args:
+            url (str): URL de destino.
+            data (bytes | SpooledDocument): Corpo da requisição; um SpooledDocument é enviado direto do arquivo.
+            headers (dict): Headers extras, mesclados aos headers padrão.
+            timeout (int): Tempo limite específico desta requisição (padrão: adaptativo por endpoint).
+            rate_limiter: Limitador opcional (context manager) aplicado à requisição.
+            endpoint (str): Nome do endpoint para novas tentativas e disjuntor (ex: "xml", "danfe").
+            logger: Logger usado para registrar as novas tentativas.
+            stream (bool): Não ler o corpo da resposta (transferência em fluxo).
+
+        Returns:
+            requests.Response: A resposta recebida (a última, se todas as tentativas falharem).
+        """
+        logger = module_logger(logger, __name__)
+        if endpoint is None:
+            return self._send(url, data, headers, self._resolve_timeout(timeout, "outro"), rate_limiter, stream=stream)
+
+        breaker = self.get_circuit_breaker(endpoint, logger)
+        policy = self.retry_policy
+
+        for attempt in range(1, policy.max_attempts + 1):
+            deadline = current_deadline()
+            with metrics.timer("circuit_breaker_wait_seconds", endpoint=endpoint):
+                acquired = breaker.acquire(timeout=None if deadline is None else max(0.0, deadline.remaining()))
+            if not acquired:
+                metrics.inc("key_deadline_exceeded_total", endpoint=endpoint)
+                raise DeadlineExceeded(f"Prazo de {deadline.seconds}s da chave esgotado aguardando o disjuntor do endpoint '{endpoint}'.")
+            try:
+                # Prazo da chave esgotado não é falha do endpoint: não conta no disjuntor
+                request_timeout = self._resolve_timeout(timeout, endpoint)
+            except BaseException:
+                breaker.release()
+                raise
+            try:
+                response = self._send(url, data, headers, request_timeout, rate_limiter, endpoint, stream)
+            except DeadlineExceeded:
+                # Prazo esgotado na espera pelo limitador ou antes do envio: não é falha do endpoint
+                breaker.release()
+                metrics.inc("key_deadline_exceeded_total", endpoint=endpoint)
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                breaker.record_failure()
+                metrics.inc("http_errors_total", endpoint=endpoint, error=type(e).__name__)
+                if attempt == policy.max_attempts:
+                    raise
+                delay = policy.compute_delay(attempt)
+                if not _fits_deadline(delay, endpoint, logger):
+                    raise
+                metrics.inc("http_retries_total", endpoint=endpoint, reason="rede")
+                logger.warning(f"Falha de rede no endpoint '{endpoint}' (tentativa {attempt}/{policy.max_attempts}): {e}. Nova tentativa em {delay:.1f}s.")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                breaker.record_success()
+                return response
+
+            retry_after = parse_retry_after(response)
+            breaker.record_failure(retry_after)
+            if attempt == policy.max_attempts:
+                return response
+            delay = policy.compute_delay(attempt, retry_after)
+            if not _fits_deadline(delay, endpoint, logger):
+                return response
+            metrics.inc("http_retries_total", endpoint=endpoint, reason=str(response.status_code))
+            logger.warning(f"Endpoint '{endpoint}' respondeu {response.status_code} (tentativa {attempt}/{policy.max_attempts}). Nova tentativa em {delay:.1f}s.")
+            # Resposta descartada: com stream=True a conexão só volta ao pool depois de fechada
+            response.close()
+            time.sleep(delay)
+
+    def close(self):
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=True)
+        self.session.close()
+
+
+def _fits_deadline(delay, endpoint, logger):
+    """
+    Se ainda cabe esperar `delay` segundos e tentar de novo dentro do prazo da chave.
+    """
+    deadline = current_deadline()
+    if deadline is None or delay < deadline.remaining():
+        return True
+    metrics.inc("key_deadline_exceeded_total", endpoint=endpoint)
+    logger.warning(f"Prazo da chave ({deadline.seconds}s) não comporta nova tentativa no endpoint '{endpoint}'.")
+    return False
+
+
+def _close_discarded_response(future):
+    # Resposta da requisição perdedora (original ou cópia): devolve a conexão ao pool
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """
+    Retorna o cliente HTTP compartilhado do processo, criando-o na primeira chamada.
+    """
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = MeuDanfeHttpClient()
+    return _shared_client
+
+
+def close_http_client():
+    """
+    Fecha as conexões do cliente compartilhado (chamado ao final do pipeline).
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is not None:
+            _shared_client.close()
+            _shared_client = None
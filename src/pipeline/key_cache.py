@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from src.config import (
+    NEGATIVE_CACHE_ENABLED,
+    NEGATIVE_CACHE_PATH,
+    NEGATIVE_CACHE_TTL_SECONDS,
+    NEGATIVE_CACHE_MAX_ENTRIES,
+)
+
+
+class NegativeKeyCache:
+    """
+    Chaves para as quais o serviço respondeu definitivamente que a nota não existe,
+    lembradas por `ttl_seconds` e persistidas em JSON entre execuções.
+
+    A quantidade de chaves é limitada a `max_entries`: ao passar do limite, as
+    consultadas há mais tempo são descartadas (LRU). Na gravação, o arquivo atual é
+    relido e mesclado, para que processos que compartilham o arquivo (workers) não
+    apaguem as chaves uns dos outros.
+
+    Args:
+        path (str): Arquivo JSON.
+        ttl_seconds (float): Validade de cada chave lembrada.
+        max_entries (int): Máximo de chaves lembradas.
+    """
+
+    def __init__(self, path, ttl_seconds, max_entries):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # chave -> [expira_em, motivo], da usada há mais tempo para a mais recente
+        self._entries = OrderedDict()
+        self._dirty = False
+        now = time.time()
+        for key, entry in self._read_file().items():
+            if entry[0] > now:
+                self._entries[key] = entry
+        self._evict()
+
+    def _read_file(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            # Arquivo corrompido (ex: gravação interrompida): o cache recomeça vazio
+            return {}
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._dirty = True
+
+    def get(self, key):
+        """
+        Motivo registrado para a chave, ou None se ela não está no cache (ou expirou).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                self._dirty = True
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def add(self, key, reason):
+        with self._lock:
+            self._entries[key] = [time.time() + self.ttl_seconds, reason]
+            self._entries.move_to_end(key)
+            self._evict()
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self):
+        """
+        Grava o cache (temporário + os.replace) se algo mudou desde a última gravação.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            merged = OrderedDict(
+                (key, entry) for key, entry in self._read_file().items()
+                if entry[0] > now and key not in self._entries
+            )
+            merged.update(self._entries)
+            while len(merged) > self.max_entries:
+                merged.popitem(last=False)
+            snapshot = json.dumps(merged, ensure_ascii=False)
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(snapshot)
+        os.replace(temp_path, self.path)
+
+
+class InFlightCoalescer:
+    """
+    Junta chamadas simultâneas para a mesma chave: a primeira executa a função e as
+    demais (chaves repetidas na entrada, em outras threads) esperam e recebem o mesmo
+    resultado, sem novas requisições.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # chave -> [Future, quantidade de threads aguardando]
+        self._in_flight = {}
+
+    def run(self, key, function, on_shared=None):
+        """
+        Retorna (resultado, coalescida), onde coalescida=True indica que o resultado
+        veio da chamada de outra thread.
+
+        on_shared(resultado, quantidade), se informado, é chamado pela thread que executou
+        a função antes de entregar o resultado às que aguardavam (ex: registrar os novos
+        detentores de um arquivo temporário).
+        """
+        with self._lock:
+            entry = self._in_flight.get(key)
+            leader = entry is None
+            if leader:
+                entry = self._in_flight[key] = [Future(), 0]
+            else:
+                entry[1] += 1
+        future = entry[0]
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = function()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        # A partir daqui nenhuma thread se junta à chamada: a contagem de espera é final
+        with self._lock:
+            del self._in_flight[key]
+            followers = entry[1]
+        try:
+            if followers and on_shared is not None:
+                on_shared(result, followers)
+        finally:
+            future.set_result(result)
+        return result, False
+
+
+_in_flight = InFlightCoalescer()
+_negative_cache = None
+_negative_cache_lock = threading.Lock()
+
+
+def get_in_flight_coalescer():
+    return _in_flight
+
+
+def get_negative_cache():
+    """
+    Retorna o cache de chaves não encontradas do processo (carregado do disco na
+    primeira chamada), ou None com NEGATIVE_CACHE_ENABLED = False.
+    """
+    global _negative_cache
+    if not NEGATIVE_CACHE_ENABLED:
+        return None
+    if _negative_cache is None:
+        with _negative_cache_lock:
+            if _negative_cache is None:
+                _negative_cache = NegativeKeyCache(NEGATIVE_CACHE_PATH, NEGATIVE_CACHE_TTL_SECONDS, NEGATIVE_CACHE_MAX_ENTRIES)
+    return _negative_cache
+
+
+def save_negative_cache():
+    """
+    Grava o cache de chaves não encontradas, se ele foi usado (sem fechá-lo).
+    """
+    with _negative_cache_lock:
+        cache = _negative_cache
+    if cache is not None:
+        cache.save()
+
+
+def close_negative_cache():
+    """
+    Grava e descarta o cache (chamado ao final do pipeline).
+    """
+    global _negative_cache
+    with _negative_cache_lock:
+        cache, _negative_cache = _negative_cache, None
+    if cache is not None:
+        cache.save()
@@ -0,0 +1,231 @@
+import contextlib
+import threading
+import time
+from collections import deque
+
+import requests
+
+from src.config import (
+    REQUEST_TIMEOUT_SECONDS,
+    ADAPTIVE_TIMEOUT_ENABLED,
+    ADAPTIVE_TIMEOUT_QUANTILE,
+    ADAPTIVE_TIMEOUT_MULTIPLIER,
+    ADAPTIVE_TIMEOUT_MIN_SECONDS,
+    LATENCY_WINDOW_SIZE,
+    LATENCY_MIN_SAMPLES,
+    HEDGE_ENDPOINTS,
+    HEDGE_QUANTILE,
+    HEDGE_MAX_RATIO,
+    KEY_DEADLINE_SECONDS,
+)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    O prazo total da chave (KEY_DEADLINE_SECONDS) acabou antes da requisição.
+    """
+
+
+class LatencyTracker:
+    """
+    Janela deslizante com as latências mais recentes de cada endpoint, compartilhada entre threads.
+
+    Args:
+        window_size (int): Quantidade de medições mantidas por endpoint.
+    """
+
+    def __init__(self, window_size=LATENCY_WINDOW_SIZE):
+        self.window_size = window_size
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, seconds):
+        with self._lock:
+            window = self._windows.get(endpoint)
+            if window is None:
+                window = self._windows[endpoint] = deque(maxlen=self.window_size)
+            window.append(seconds)
+
+    def count(self, endpoint):
+        with self._lock:
+            return len(self._windows.get(endpoint, ()))
+
+    def quantile(self, endpoint, q, min_samples=1):
+        """
+        Percentil `q` (0 a 1) das latências do endpoint, ou None com menos de `min_samples` medições.
+        """
+        with self._lock:
+            window = self._windows.get(endpoint)
+            if window is None or len(window) < max(1, min_samples):
+                return None
+            values = sorted(window)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class LatencyPolicy:
+    """
+    Deriva das latências observadas o tempo limite de cada endpoint e o momento de
+    enviar uma cópia (hedge) de uma requisição lenta.
+
+    O tempo limite é o percentil `timeout_quantile` multiplicado por `multiplier`,
+    entre `min_timeout` e `max_timeout`: com o serviço respondendo em 300 ms, uma
+    requisição travada é abandonada em poucos segundos em vez de ocupar o worker pelos
+    10 s fixos. Timeouts também entram na janela (com o tempo esperado), então o limite
+    sobe sozinho quando o serviço fica mais lento.
+
+    A cópia é enviada quando a requisição passa do percentil `hedge_quantile`, apenas
+    nos endpoints de `hedge_endpoints` e enquanto as cópias não passarem de
+    `hedge_max_ratio` das requisições do endpoint.
+    """
+
+    def __init__(self, tracker=None, enabled=ADAPTIVE_TIMEOUT_ENABLED, timeout_quantile=ADAPTIVE_TIMEOUT_QUANTILE,
+                 multiplier=ADAPTIVE_TIMEOUT_MULTIPLIER, min_timeout=ADAPTIVE_TIMEOUT_MIN_SECONDS,
+                 max_timeout=REQUEST_TIMEOUT_SECONDS, min_samples=LATENCY_MIN_SAMPLES,
+                 hedge_endpoints=HEDGE_ENDPOINTS, hedge_quantile=HEDGE_QUANTILE, hedge_max_ratio=HEDGE_MAX_RATIO):
+        self.tracker = tracker or LatencyTracker()
+        self.enabled = enabled
+        self.timeout_quantile = timeout_quantile
+        self.multiplier = multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.hedge_endpoints = frozenset(hedge_endpoints or ())
+        self.hedge_quantile = hedge_quantile
+        self.hedge_max_ratio = hedge_max_ratio
+        self._hedge_counts = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, seconds):
+        self.tracker.observe(endpoint, seconds)
+
+    def timeout_for(self, endpoint):
+        if not self.enabled:
+            return self.max_timeout
+        observed = self.tracker.quantile(endpoint, self.timeout_quantile, self.min_samples)
+        if observed is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, observed * self.multiplier))
+
+    def hedge_delay(self, endpoint):
+        """
+        Espera antes de enviar a cópia da requisição, ou None se o endpoint não usa cópias
+        (ou ainda não há medições suficientes). Conta a requisição no orçamento de cópias.
+        """
+        if endpoint not in self.hedge_endpoints:
+            return None
+        with self._lock:
+            counts = self._hedge_counts.setdefault(endpoint, [0, 0])
+            counts[0] += 1
+        return self.tracker.quantile(endpoint, self.hedge_quantile, self.min_samples)
+
+    def try_start_hedge(self, endpoint):
+        """
+        Reserva uma cópia no orçamento do endpoint. Retorna False se o limite de cópias foi atingido.
+        """
+        with self._lock:
+            counts = self._hedge_counts.setdefault(endpoint, [0, 0])
+            if counts[1] + 1 > counts[0] * self.hedge_max_ratio:
+                return False
+            counts[1] += 1
+            return True
+
+
+class Deadline:
+    """
+    Prazo total de uma chave, contado a partir da criação.
+    Entre pause() e resume() (ex: a chave aguardando na fila entre dois estágios), o tempo não corre.
+    """
+
+    __slots__ = ("seconds", "expires_at", "paused_remaining")
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.paused_remaining = None
+
+    def remaining(self):
+        if self.paused_remaining is not None:
+            return self.paused_remaining
+        return self.expires_at - time.monotonic()
+
+    def pause(self):
+        if self.paused_remaining is None:
+            self.paused_remaining = self.remaining()
+
+    def resume(self):
+        if self.paused_remaining is not None:
+            self.expires_at = time.monotonic() + self.paused_remaining
+            self.paused_remaining = None
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+
+_current = threading.local()
+
+
+def new_key_deadline():
+    """
+    Prazo de uma chave que começa a ser processada agora (KEY_DEADLINE_SECONDS), ou None se desativado.
+    """
+    return Deadline(KEY_DEADLINE_SECONDS) if KEY_DEADLINE_SECONDS else None
+
+
+def current_deadline():
+    """
+    Prazo da chave em processamento na thread atual (ver deadline_scope), ou None.
+    """
+    return getattr(_current, "deadline", None)
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline):
+    """
+    Torna `deadline` o prazo da thread atual durante o bloco. Com deadline=None, nada muda.
+    As requisições feitas no bloco têm o tempo limite e as novas tentativas cortadas pelo prazo.
+    """
+    if deadline is None:
+        yield None
+        return
+    previous = current_deadline()
+    _current.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _current.deadline = previous
+
+
+@contextlib.contextmanager
+def rate_limited(rate_limiter, deadline=None):
+    """
+    Ocupa uma vaga de `rate_limiter` (se houver) durante o bloco. A espera pela vaga conta no
+    prazo `deadline` (padrão: o da thread atual) e não passa dele: levanta DeadlineExceeded
+    se o prazo acabar antes de a requisição ser liberada.
+    """
+    if rate_limiter is None:
+        yield
+        return
+    deadline = deadline or current_deadline()
+    if deadline is None:
+        rate_limiter.acquire()
+    elif not rate_limiter.acquire(timeout=max(0.0, deadline.remaining())):
+        raise DeadlineExceeded(f"Prazo de {deadline.seconds}s da chave esgotado aguardando o limitador de requisições.")
+    try:
+        yield
+    finally:
+        rate_limiter.release()
+
+
+def bound_timeout(timeout, deadline=None):
+    """
+    Reduz `timeout` ao que resta de `deadline` (padrão: o prazo da thread). Levanta DeadlineExceeded
+    se o prazo acabou.
+    """
+    deadline = deadline or current_deadline()
+    if deadline is None:
+        return timeout
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"Prazo de {deadline.seconds}s da chave esgotado.")
+    return min(timeout, remaining)
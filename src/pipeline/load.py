@@ -1,55 +1,85 @@
 import os
-from src.config import OUTPUT_BASE_FOLDER
+from src.config import OUTPUT_BASE_FOLDER, OUTPUT_MODE, STORAGE_BACKEND, STORAGE_BUCKET, STORAGE_PREFIX
+from src.pipeline.archive import archive_paths, member_names, MEMBER_SEPARATOR
+from src.pipeline.storage import BACKEND_LOCAL, discard_documents, document_relative_paths, object_location
+from src.pipeline.writer import get_document_writer, OUTPUT_MODE_ARCHIVE
+from src.logger_config import module_logger
 
-def create_output_directories(base_path, filial_code, date_str, logger):
+def get_output_paths(filial_code, date_str, note_number, base_path=OUTPUT_BASE_FOLDER, output_mode=OUTPUT_MODE,
+                     storage_backend=STORAGE_BACKEND):
     """
-    Cria a estrutura de diretórios:
-    <base_path>/<filial_code>/<date_str>/XML/
-    <base_path>/<filial_code>/<date_str>/DANFE/
+    Retorna os caminhos finais (xml_filepath, pdf_filepath) de uma nota, sem criar nada em disco.
+    No modo "pacote", os caminhos apontam para o documento dentro do .tar (<pacote>.tar#XML/<nNF>.xml);
+    com armazenamento em bucket, são as URIs dos objetos (s3://..., gs://...).
     """
-    output_filial_folder = os.path.join(base_path, filial_code)
-    output_date_folder = os.path.join(output_filial_folder, date_str)
-    output_xml_folder = os.path.join(output_date_folder, "XML")
-    output_danfe_folder = os.path.join(output_date_folder, "DANFE")
-
-    os.makedirs(output_xml_folder, exist_ok=True)
-    os.makedirs(output_danfe_folder, exist_ok=True)
+    if output_mode == OUTPUT_MODE_ARCHIVE:
+        archive_path, _ = archive_paths(base_path, filial_code, date_str)
+        return tuple(archive_path + MEMBER_SEPARATOR + member for member in member_names(note_number))
+    if storage_backend != BACKEND_LOCAL:
+        return tuple(
+            object_location(storage_backend, STORAGE_BUCKET, STORAGE_PREFIX, relative_path)
+            for relative_path in document_relative_paths(filial_code, date_str, note_number)
+        )
 
-    logger.debug(f"Diretórios criados/verificados: {output_xml_folder}, {output_danfe_folder}")
+    output_date_folder = os.path.join(base_path, filial_code, date_str)
+    xml_filepath = os.path.join(output_date_folder, "XML", f"{note_number}.xml")
+    pdf_filepath = os.path.join(output_date_folder, "DANFE", f"{note_number}.pdf")
+    return xml_filepath, pdf_filepath
 
-    return output_xml_folder, output_danfe_folder
+def _validate_documents(note_number, xml_content, pdf_content, logger):
+    if not xml_content or not pdf_content or not note_number:
+        logger.error(f"Conteúdo ou número da nota inválido para salvar. Nota: {note_number}")
+        discard_documents(xml_content, pdf_content)
+        return False
+    return True
 
-def save_documents(filial_code, date_str, note_number, xml_content, pdf_content, logger):
+def save_documents(filial_code, date_str, note_number, xml_content, pdf_content, logger, access_key=None):
     """
-    Salva o XML e o PDF na estrutura de pastas correta.
+    Salva o XML e o PDF na estrutura de pastas correta, no armazenamento configurado em STORAGE_BACKEND
+    (ou no pacote diário da filial, com OUTPUT_MODE = "pacote").
+    A gravação é atômica (temporário + rename, ou acréscimo indexado) e acontece na thread atual.
     """
-    if not xml_content or not pdf_content or not note_number:
-        logger.error(f"Conteúdo ou número da nota inválido para salvar. Nota: {note_number}")
+    logger = module_logger(logger, __name__)
+    if not _validate_documents(note_number, xml_content, pdf_content, logger):
         return False
 
     try:
-        xml_folder, danfe_folder = create_output_directories(
-            OUTPUT_BASE_FOLDER, filial_code, date_str, logger
+        xml_filepath, pdf_filepath = get_document_writer().save(
+            filial_code, date_str, note_number, xml_content, pdf_content, access_key=access_key
         )
-
-        xml_filename = f"{note_number}.xml"
-        pdf_filename = f"{note_number}.pdf"
-
-        xml_filepath = os.path.join(xml_folder, xml_filename)
-        pdf_filepath = os.path.join(danfe_folder, pdf_filename)
-
-        # Salvar XML
-        with open(xml_filepath, 'wb') as f: # 'wb' para escrever em modo binário
-            f.write(xml_content)
         logger.info(f"XML salvo: {xml_filepath}")
-
-        # Salvar PDF
-        with open(pdf_filepath, 'wb') as f: # 'wb' para escrever em modo binário
-            f.write(pdf_content)
         logger.info(f"DANFE PDF salvo: {pdf_filepath}")
-
         return True
 
     except Exception as e:
         logger.error(f"Erro ao salvar documentos para nota {note_number} (Filial: {filial_code}): {e}", exc_info=True)
-        return False
\ No newline at end of file
+        return False
+
+def save_documents_async(filial_code, date_str, note_number, xml_content, pdf_content, logger, on_complete=None, access_key=None):
+    """
+    Agenda a gravação do XML e do PDF no gravador em segundo plano e retorna imediatamente.
+    Ao final da gravação, chama on_complete(sucesso) se informado.
+    Retorna o Future da gravação ou None se os documentos forem inválidos.
+    """
+    logger = module_logger(logger, __name__)
+    if not _validate_documents(note_number, xml_content, pdf_content, logger):
+        if on_complete:
+            on_complete(False)
+        return None
+
+    def done(future):
+        error = future.exception()
+        if error is None:
+            xml_filepath, pdf_filepath = future.result()
+            logger.info(f"XML salvo: {xml_filepath}")
+            logger.info(f"DANFE PDF salvo: {pdf_filepath}")
+        else:
+            logger.error(f"Erro ao salvar documentos para nota {note_number} (Filial: {filial_code}): {error}", exc_info=error)
+        if on_complete:
+            on_complete(error is None)
+
+    future = get_document_writer().submit(
+        filial_code, date_str, note_number, xml_content, pdf_content, access_key=access_key
+    )
+    future.add_done_callback(done)
+    return future
@@ -0,0 +1,283 @@
+import bisect
+import datetime
+import json
+import math
+import os
+import threading
+import time
+
+# Limites dos buckets do histograma: de 0,5 ms a ~10 min, crescendo 10% por bucket.
+# Com isso os percentis estimados ficam a no máximo ~5% do valor real.
+_BUCKET_GROWTH = 1.1
+_BUCKET_BOUNDS = tuple(0.0005 * _BUCKET_GROWTH ** i for i in range(int(math.log(1200000) / math.log(_BUCKET_GROWTH)) + 2))
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    Histograma de latências (em segundos) com buckets exponenciais fixos:
+    memória constante, independente da quantidade de observações.
+    """
+
+    __slots__ = ("count", "total", "minimum", "maximum", "_buckets", "_lock")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self._buckets = [0] * (len(_BUCKET_BOUNDS) + 1)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(_BUCKET_BOUNDS, value)
+        with self._lock:
+            self._buckets[index] += 1
+            self.count += 1
+            self.total += value
+            self.minimum = value if self.minimum is None else min(self.minimum, value)
+            self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def quantile(self, q):
+        """
+        Estima o percentil `q` (0 a 1) interpolando dentro do bucket correspondente.
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for index, bucket_count in enumerate(self._buckets):
+                if bucket_count and seen + bucket_count >= rank:
+                    lower = _BUCKET_BOUNDS[index - 1] if index > 0 else 0.0
+                    upper = _BUCKET_BOUNDS[index] if index < len(_BUCKET_BOUNDS) else self.maximum
+                    estimate = lower + (upper - lower) * ((rank - seen) / bucket_count)
+                    return min(max(estimate, self.minimum), self.maximum)
+                seen += bucket_count
+            return self.maximum
+
+    def summary(self):
+        summary = {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "min": self.minimum,
+            "max": self.maximum,
+            "mean": self.total / self.count if self.count else None,
+        }
+        for q in QUANTILES:
+            summary[f"p{int(q * 100)}"] = self.quantile(q)
+        return summary
+
+
+class Timer:
+    """
+    Mede a duração de um bloco e a registra no histograma ao sair.
+    Rótulos extras (ex: resultado) podem ser definidos dentro do bloco com set().
+    """
+
+    __slots__ = ("registry", "name", "labels", "start", "elapsed")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+        self.elapsed = None
+
+    def set(self, **labels):
+        self.labels.update(labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.labels.setdefault("outcome", "erro")
+        self.registry.observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class MetricsRegistry:
+    """
+    Contadores e histogramas do pipeline, identificados por nome + rótulos
+    (ex: http_responses_total{endpoint="xml",status="200"}). Seguro entre threads.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """
+        Uso:
+            with metrics.timer("stage_seconds", stage="xml") as timer:
+                ...
+                timer.set(outcome="ok")
+        """
+        return Timer(self, name, labels)
+
+    def counter_value(self, name, **labels):
+        """
+        Soma dos contadores `name` cujos rótulos contêm os `labels` informados.
+        """
+        wanted = set(_label_key(labels))
+        with self._lock:
+            return sum(
+                value for (counter_name, label_key), value in self._counters.items()
+                if counter_name == name and wanted.issubset(label_key)
+            )
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """
+        Retorna contadores e resumos dos histogramas em um dicionário serializável em JSON.
+        """
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = list(self._histograms.items())
+
+        snapshot = {"counters": {}, "histograms": {}}
+        for (name, label_key), value in sorted(counters):
+            snapshot["counters"].setdefault(name, []).append({"labels": dict(label_key), "value": value})
+        for (name, label_key), histogram in sorted(histograms, key=lambda item: item[0]):
+            snapshot["histograms"].setdefault(name, []).append({"labels": dict(label_key), **histogram.summary()})
+        return snapshot
+
+    def render_prometheus(self):
+        """
+        Exporta as métricas no formato texto do Prometheus (histogramas como "summary").
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        lines = []
+        declared = set()
+        for (name, label_key), value in counters:
+            if name not in declared:
+                lines.append(f"# TYPE {name} counter")
+                declared.add(name)
+            lines.append(f"{name}{_format_labels(label_key)} {value}")
+        for (name, label_key), histogram in histograms:
+            if name not in declared:
+                lines.append(f"# TYPE {name} summary")
+                declared.add(name)
+            for q in QUANTILES:
+                value = histogram.quantile(q)
+                lines.append(f"{name}{_format_labels(label_key, [('quantile', str(q))])} {value if value is not None else 'NaN'}")
+            lines.append(f"{name}_sum{_format_labels(label_key)} {histogram.total}")
+            lines.append(f"{name}_count{_format_labels(label_key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, folder, extra=None, suffix=None):
+        """
+        Grava o relatório da execução em JSON (relatorio_AAAA-MM-DD_HHMMSS.json) e retorna o caminho.
+        `suffix` diferencia relatórios de processos simultâneos (ex: relatorio_..._worker-1.json).
+        """
+        finished_at = time.time()
+        report = {
+            "started_at": datetime.datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "finished_at": datetime.datetime.fromtimestamp(finished_at).isoformat(timespec="seconds"),
+            "duration_seconds": round(finished_at - self.started_at, 3),
+        }
+        report.update(extra or {})
+        report.update(self.snapshot())
+
+        os.makedirs(folder, exist_ok=True)
+        filename = f"relatorio_{datetime.datetime.fromtimestamp(finished_at).strftime('%Y-%m-%d_%H%M%S')}"
+        filename += f"_{suffix}.json" if suffix else ".json"
+        path = os.path.join(folder, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return path
+
+
+# Registro único do processo, usado por todos os módulos do pipeline
+metrics = MetricsRegistry()
+
+
+def _build_request_handler(registry):
+    # http.server só é importado quando o endpoint é ligado (METRICS_HTTP_PORT), não a cada execução
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # As consultas do Prometheus não vão para o log do pipeline
+
+    return MetricsRequestHandler
+
+
+class MetricsServer:
+    """
+    Endpoint HTTP (GET /metrics) com as métricas no formato do Prometheus,
+    para acompanhar execuções longas. Roda em uma thread em segundo plano.
+    """
+
+    def __init__(self, port, host="0.0.0.0", registry=metrics):
+        from http.server import ThreadingHTTPServer
+
+        self._server = ThreadingHTTPServer((host, port), _build_request_handler(registry))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metricas-http", daemon=True)
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,176 @@
+import xml.etree.ElementTree as ET
+
+NFE_NAMESPACE = "{http://www.portalfiscal.inf.br/nfe}"
+
+# Grupos do XML que contêm os campos desejados: {grupo: ((tag do campo, nome do campo), ...)}
+FIELD_GROUPS = {
+    "ide": (("nNF", "note_number"), ("serie", "series"), ("dhEmi", "issue_datetime"), ("dEmi", "issue_datetime")),
+    "emit": (("CNPJ", "emitter_cnpj"), ("CPF", "emitter_cnpj")),
+    "ICMSTot": (("vNF", "total_value"),),
+    "infProt": (("cStat", "protocol_status"),),
+}
+
+# Os grupos são reconhecidos pela tag completa (com e sem namespace), sem manipular strings a cada elemento
+_GROUP_TAGS = {}
+for _group, _children in FIELD_GROUPS.items():
+    for _prefix in (NFE_NAMESPACE, ""):
+        _GROUP_TAGS[_prefix + _group] = tuple((_prefix + tag, field) for tag, field in _children)
+
+# Itens da nota: descartados assim que lidos, mantendo a memória constante em notas grandes
+_DISCARDED_TAGS = frozenset({NFE_NAMESPACE + "det", "det"})
+
+ALL_FIELDS = ("note_number", "series", "issue_datetime", "emitter_cnpj", "total_value", "protocol_status")
+
+# Campos que ficam no início do documento (grupos <ide> e <emit>)
+HEAD_FIELDS = frozenset({"note_number", "series", "issue_datetime", "emitter_cnpj"})
+
+# Tamanho dos blocos entregues ao parser incremental. O primeiro bloco é pequeno
+# porque o grupo <ide> (com o nNF) fica logo no início do documento.
+_FIRST_CHUNK_SIZE = 4 * 1024
+_FEED_CHUNK_SIZE = 64 * 1024
+
+
+class NFeMetadata:
+    """
+    Metadados principais de uma NF-e, lidos do XML sem montar a árvore inteira.
+    Campos não encontrados (ou não solicitados) ficam como None.
+    """
+
+    __slots__ = ALL_FIELDS
+
+    def __init__(self, **values):
+        for field in ALL_FIELDS:
+            setattr(self, field, values.get(field))
+
+    @property
+    def is_authorized(self):
+        """
+        True se o protocolo indica uso autorizado (cStat 100 ou 150).
+        """
+        return self.protocol_status in ("100", "150")
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in ALL_FIELDS}
+
+    def __repr__(self):
+        return "NFeMetadata(" + ", ".join(f"{field}={getattr(self, field)!r}" for field in ALL_FIELDS) + ")"
+
+
+class NFeMetadataParser:
+    """
+    Extrator incremental de metadados: recebe o XML em blocos (feed) e para de
+    processar assim que todos os campos solicitados foram lidos.
+
+    Args:
+        fields (tuple): Campos desejados (subconjunto de ALL_FIELDS).
+
+    Uso:
+        parser = NFeMetadataParser(fields=("note_number",))
+        for chunk in chunks:
+            if parser.feed(chunk):
+                break
+        metadata = parser.close()
+    """
+
+    def __init__(self, fields=ALL_FIELDS):
+        unknown = set(fields) - set(ALL_FIELDS)
+        if unknown:
+            raise ValueError(f"Campos de metadados desconhecidos: {sorted(unknown)}")
+        self._wanted = frozenset(fields)
+        self._values = {}
+        self._parser = ET.XMLPullParser(events=("end",))
+        self.done = False
+
+    @property
+    def fields(self):
+        """
+        Campos solicitados (frozenset), já validados contra ALL_FIELDS.
+        """
+        return self._wanted
+
+    def feed(self, data):
+        """
+        Processa mais um bloco do XML. Retorna True quando todos os campos já foram encontrados.
+        Lança xml.etree.ElementTree.ParseError se o XML estiver malformado.
+        """
+        if self.done:
+            return True
+        self._parser.feed(data)
+        self._consume_events()
+        return self.done
+
+    def _consume_events(self):
+        values = self._values
+        wanted = self._wanted
+        for _, element in self._parser.read_events():
+            tag = element.tag
+            children = _GROUP_TAGS.get(tag)
+            if children is None:
+                if tag in _DISCARDED_TAGS:
+                    element.clear()
+                continue
+
+            for child_tag, field in children:
+                if field in wanted and field not in values:
+                    text = element.findtext(child_tag)
+                    if text:
+                        values[field] = text.strip()
+            element.clear()
+            if wanted.issubset(values):
+                self.done = True
+                return
+
+    def close(self):
+        """
+        Finaliza a leitura e retorna os metadados encontrados.
+        """
+        if not self.done:
+            self._parser.close()
+            self._consume_events()
+        return NFeMetadata(**self._values)
+
+
+def _extract_from_tree(xml_content, wanted):
+    values = {}
+    for element in ET.fromstring(xml_content).iter():
+        children = _GROUP_TAGS.get(element.tag)
+        if children is None:
+            continue
+        for child_tag, field in children:
+            if field in wanted and field not in values:
+                text = element.findtext(child_tag)
+                if text:
+                    values[field] = text.strip()
+    return NFeMetadata(**values)
+
+
+def extract_nfe_metadata(xml_content, fields=ALL_FIELDS):
+    """
+    Extrai metadados do XML da NF-e já carregado em memória.
+
+    Se todos os campos pedidos ficam no início do documento (ex: o nNF), a
+    leitura é incremental e para assim que eles são encontrados. Campos do
+    final do documento (vNF, cStat do protocolo) exigem ler o XML inteiro;
+    nesse caso o parser em C monta a árvore de uma vez, que é mais rápido que
+    processar os eventos um a um.
+
+    Args:
+        xml_content (bytes): Conteúdo XML da nota.
+        fields (tuple): Campos desejados (padrão: todos).
+
+    Returns:
+        NFeMetadata: Registro com os campos encontrados.
+    """
+    parser = NFeMetadataParser(fields=fields)
+    if not HEAD_FIELDS.issuperset(fields):
+        return _extract_from_tree(xml_content, parser.fields)
+
+    view = memoryview(xml_content if isinstance(xml_content, bytes) else xml_content.encode("utf-8"))
+    offset = 0
+    chunk_size = _FIRST_CHUNK_SIZE
+    while offset < len(view):
+        if parser.feed(view[offset:offset + chunk_size]):
+            break
+        offset += chunk_size
+        chunk_size = _FEED_CHUNK_SIZE
+    return parser.close()
@@ -0,0 +1,165 @@
+import email.utils
+import random
+import re
+import threading
+import time
+
+from src.logger_config import module_logger
+
+# Status HTTP que indicam falha temporária do servidor (vale tentar de novo)
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Dica de espera presente na página de erro 502 do ws.meudanfe.com:
+# "Please try again in 30 seconds."
+_RETRY_HINT_PATTERN = re.compile(r"try again in (\d+)\s*seconds?", re.IGNORECASE)
+
+
+def parse_retry_after(response):
+    """
+    Retorna quantos segundos o servidor pediu para aguardar, a partir do header
+    Retry-After (segundos ou data HTTP) ou da dica "try again in N seconds" no corpo.
+    Retorna None se a resposta não indicar um tempo de espera.
+    """
+    if response is None:
+        return None
+
+    header = response.headers.get("Retry-After")
+    if header:
+        header = header.strip()
+        if header.isdigit():
+            return float(header)
+        try:
+            retry_at = email.utils.parsedate_to_datetime(header)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    try:
+        match = _RETRY_HINT_PATTERN.search(response.text[:2048])
+    except Exception:
+        match = None
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """
+    Política de novas tentativas com backoff exponencial e jitter.
+
+    Args:
+        max_attempts (int): Total de tentativas (incluindo a primeira).
+        base_delay (float): Espera base em segundos; dobra a cada tentativa.
+        max_delay (float): Espera máxima entre tentativas.
+        jitter (bool): Se True, sorteia a espera entre 0 e o valor do backoff ("full jitter"),
+            evitando que vários workers tentem de novo no mesmo instante.
+    """
+
+    def __init__(self, max_attempts, base_delay, max_delay, jitter=True):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def compute_delay(self, attempt, retry_after=None):
+        """
+        Calcula a espera antes da próxima tentativa (attempt começa em 1).
+        Se o servidor indicou um tempo (Retry-After), ele é respeitado como mínimo.
+        """
+        backoff = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        delay = random.uniform(0, backoff) if self.jitter else backoff
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Disjuntor por endpoint: após `failure_threshold` falhas seguidas, o endpoint é
+    considerado fora do ar e todas as threads aguardam (em vez de insistir) até o
+    fim do período de recuperação. Depois disso, uma única requisição de teste é
+    liberada (meio-aberto); se ela der certo, o circuito fecha novamente.
+
+    Args:
+        name (str): Nome do endpoint (para logs).
+        failure_threshold (int): Falhas consecutivas que abrem o circuito.
+        recovery_timeout (float): Tempo mínimo, em segundos, com o circuito aberto.
+        logger: Logger do pipeline.
+    """
+
+    CLOSED = "fechado"
+    OPEN = "aberto"
+    HALF_OPEN = "meio-aberto"
+
+    def __init__(self, name, failure_threshold, recovery_timeout, logger):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.logger = module_logger(logger, __name__)
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._probe_in_flight = False
+        self._condition = threading.Condition()
+
+    @property
+    def is_open(self):
+        return self.state != self.CLOSED
+
+    def acquire(self, timeout=None):
+        """
+        Bloqueia enquanto o circuito estiver aberto. Ao fim do período de recuperação,
+        libera apenas uma thread para a requisição de teste; as demais continuam aguardando.
+        Com `timeout` (segundos), retorna False se o circuito não liberar a requisição nesse
+        tempo; caso contrário retorna True.
+        """
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self.state == self.CLOSED:
+                    return True
+                now = time.monotonic()
+                remaining = self._open_until - now
+                if remaining <= 0 and not self._probe_in_flight:
+                    self.state = self.HALF_OPEN
+                    self._probe_in_flight = True
+                    self.logger.info(f"Circuito '{self.name}' meio-aberto: enviando requisição de teste.")
+                    return True
+                wait_seconds = remaining if remaining > 0 else None
+                if give_up_at is not None:
+                    if now >= give_up_at:
+                        return False
+                    wait_seconds = give_up_at - now if wait_seconds is None else min(wait_seconds, give_up_at - now)
+                self._condition.wait(timeout=wait_seconds)
+
+    def release(self):
+        """
+        Libera a requisição de teste sem registrar resultado (ex: erro inesperado no código local).
+        """
+        with self._condition:
+            self._probe_in_flight = False
+            self._condition.notify_all()
+
+    def record_success(self):
+        with self._condition:
+            if self.state != self.CLOSED:
+                self.logger.info(f"Circuito '{self.name}' fechado: endpoint respondeu normalmente.")
+            self.state = self.CLOSED
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+            self._condition.notify_all()
+
+    def record_failure(self, retry_after=None):
+        with self._condition:
+            self._consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                pause = max(self.recovery_timeout, retry_after or 0)
+                self._open_until = time.monotonic() + pause
+                if self.state != self.OPEN:
+                    self.logger.warning(
+                        f"Circuito '{self.name}' aberto após {self._consecutive_failures} falha(s) seguida(s). "
+                        f"Pausando requisições a este endpoint por {pause:.0f}s."
+                    )
+                self.state = self.OPEN
+                self._probe_in_flight = False
+                self._condition.notify_all()
@@ -0,0 +1,120 @@
+import datetime
+import os
+import sqlite3
+import threading
+
+# Estágios registrados para cada chave, na ordem em que acontecem
+STAGE_XML_FETCHED = "xml_fetched"
+STAGE_DANFE_GENERATED = "danfe_generated"
+STAGE_SAVED = "saved"
+STAGE_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS access_keys (
+    access_key   TEXT PRIMARY KEY,
+    filial_code  TEXT,
+    stage        TEXT NOT NULL,
+    note_number  TEXT,
+    xml_path     TEXT,
+    pdf_path     TEXT,
+    last_error   TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    updated_at   TEXT NOT NULL
+)
+"""
+
+
+class RunStateStore:
+    """
+    Registro persistente (SQLite) do andamento de cada chave de acesso.
+
+    Permite retomar um lote interrompido: chaves já salvas são puladas e
+    apenas as que faltam ou falharam são processadas de novo. As chaves
+    concluídas ficam também em memória, então a verificação é O(1).
+
+    Args:
+        db_path (str): Caminho do arquivo SQLite.
+    """
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._completed = {
+            row[0] for row in self._conn.execute(
+                "SELECT access_key FROM access_keys WHERE stage = ?", (STAGE_SAVED,)
+            )
+        }
+
+    def is_completed(self, key):
+        """
+        Retorna True se a chave já foi processada e salva em uma execução anterior.
+        """
+        return key in self._completed
+
+    @property
+    def completed_count(self):
+        return len(self._completed)
+
+    def record_stage(self, key, filial_code, stage, note_number=None, xml_path=None, pdf_path=None):
+        """
+        Registra que a chave chegou a um estágio. Campos None preservam o valor já gravado.
+        """
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO access_keys (access_key, filial_code, stage, note_number, xml_path, pdf_path, last_error, attempts, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, NULL, 0, ?)
+                ON CONFLICT(access_key) DO UPDATE SET
+                    filial_code = excluded.filial_code,
+                    stage = excluded.stage,
+                    note_number = COALESCE(excluded.note_number, note_number),
+                    xml_path = COALESCE(excluded.xml_path, xml_path),
+                    pdf_path = COALESCE(excluded.pdf_path, pdf_path),
+                    last_error = CASE WHEN excluded.stage = 'saved' THEN NULL ELSE last_error END,
+                    updated_at = excluded.updated_at
+                """,
+                (key, filial_code, stage, note_number, xml_path, pdf_path, now),
+            )
+            if stage == STAGE_SAVED:
+                self._completed.add(key)
+
+    def record_failure(self, key, filial_code, error):
+        """
+        Registra uma falha da chave, guardando a última mensagem de erro e o número de tentativas.
+        """
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO access_keys (access_key, filial_code, stage, last_error, attempts, updated_at)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT(access_key) DO UPDATE SET
+                    filial_code = excluded.filial_code,
+                    stage = excluded.stage,
+                    last_error = excluded.last_error,
+                    attempts = attempts + 1,
+                    updated_at = excluded.updated_at
+                """,
+                (key, filial_code, STAGE_FAILED, str(error), now),
+            )
+
+    def get(self, key):
+        """
+        Retorna o registro da chave como dicionário, ou None se ela nunca foi vista.
+        """
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM access_keys WHERE access_key = ?", (key,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,229 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from src.pipeline.metrics import metrics
+from src.config import (
+    FILIAL_SHARES,
+    FILIAL_PRIORITIES,
+    SCHEDULER_MAX_REQUEUES,
+    SCHEDULER_REQUEUE_DELAY_SECONDS,
+    SCHEDULER_REQUEUE_MAX_DELAY_SECONDS,
+)
+from src.logger_config import module_logger
+
+
+class _FilialLane:
+    """
+    Fila de uma filial no escalonador: chaves ainda não lidas (`source`) e chaves
+    reagendadas cuja espera já terminou (`retries`).
+    """
+
+    __slots__ = ("filial_code", "source", "share", "priority", "retries", "current", "exhausted",
+                 "in_flight", "delayed", "dispatched", "finished")
+
+    def __init__(self, filial_code, source, share, priority):
+        self.filial_code = filial_code
+        self.source = iter(source)
+        self.share = share
+        self.priority = priority
+        self.retries = deque()
+        # Crédito do round-robin ponderado
+        self.current = 0.0
+        self.exhausted = False
+        # Protegidos pelo lock do escalonador (alterados pelas threads dos workers)
+        self.in_flight = 0
+        self.delayed = 0
+        self.dispatched = 0
+        self.finished = False
+
+    @property
+    def ready(self):
+        return bool(self.retries) or not self.exhausted
+
+    def take(self):
+        """
+        Próxima chave da filial (reagendadas primeiro), ou None se não há nenhuma pronta.
+        """
+        if self.retries:
+            return self.retries.popleft()
+        if self.exhausted:
+            return None
+        try:
+            return next(self.source)
+        except StopIteration:
+            self.exhausted = True
+            return None
+
+
+class FairShareScheduler:
+    """
+    Escalonador entre a extração e a transformação: intercala as chaves das filiais
+    em vez de processar um arquivo inteiro antes do próximo.
+
+    É um iterador de tuplas (filial_code, key) consumido sob demanda pelo pipeline (a
+    próxima chave só é escolhida quando há um worker livre), então a fatia de cada
+    filial nas chaves despachadas é também a sua fatia do limite de requisições.
+
+    - Filiais de prioridade maior (`priorities`) são atendidas primeiro; as demais só
+      recebem chaves quando elas não têm nenhuma pronta.
+    - Entre filiais de mesma prioridade, round-robin ponderado suave por `shares`: com
+      {"FILIAL 01": 3}, a FILIAL 01 recebe 3 chaves para cada 1 das outras, intercaladas.
+      Uma filial sem chaves prontas não acumula crédito.
+    - Uma chave que falhou pode ser reagendada (requeue): ela volta para a fila da sua
+      filial depois de uma espera que dobra a cada vez, até `max_requeues` vezes.
+
+    As chaves são lidas dos arquivos com o lock do escalonador, o que só atrasa done() e
+    requeue() pelo tempo de ler uma linha.
+
+    Os workers devem chamar done(filial_code, key) quando terminam cada chave entregue
+    (com ou sem sucesso, inclusive depois de reagendá-la): a iteração só termina quando
+    as filiais não têm mais chaves, nenhuma aguarda a espera e nenhuma está em
+    andamento, pois uma chave em andamento ainda pode ser reagendada.
+
+    Args:
+        sources (dict): {filial_code: iterável de tuplas (filial_code, key)}, ex: iter_keys_by_filial().
+        shares (dict): Peso de cada filial (padrão 1).
+        priorities (dict): Prioridade de cada filial (padrão 0; maior é atendida primeiro).
+        max_requeues (int): Reagendamentos permitidos por chave.
+        requeue_delay (float): Espera, em segundos, antes do primeiro reagendamento.
+        requeue_max_delay (float): Espera máxima.
+        logger: Logger do pipeline.
+    """
+
+    def __init__(self, sources, shares=FILIAL_SHARES, priorities=FILIAL_PRIORITIES,
+                 max_requeues=SCHEDULER_MAX_REQUEUES, requeue_delay=SCHEDULER_REQUEUE_DELAY_SECONDS,
+                 requeue_max_delay=SCHEDULER_REQUEUE_MAX_DELAY_SECONDS, logger=None):
+        shares = shares or {}
+        priorities = priorities or {}
+        self.logger = module_logger(logger, __name__)
+        self.max_requeues = max_requeues
+        self.requeue_delay = requeue_delay
+        self.requeue_max_delay = requeue_max_delay
+        self.started_at = time.monotonic()
+
+        self._lanes = {}
+        for filial_code, source in sources.items():
+            share = shares.get(filial_code, 1)
+            if share <= 0:
+                raise ValueError(f"A fatia da filial '{filial_code}' deve ser maior que zero.")
+            self._lanes[filial_code] = _FilialLane(filial_code, source, share, priorities.get(filial_code, 0))
+        # Filiais agrupadas por prioridade, da maior para a menor
+        levels = {}
+        for lane in self._lanes.values():
+            levels.setdefault(lane.priority, []).append(lane)
+        self._levels = [levels[priority] for priority in sorted(levels, reverse=True)]
+
+        self._condition = threading.Condition()
+        # (liberar_em, sequência, filial_code, key) das chaves reagendadas ainda em espera
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._requeues = {}
+        self._in_flight = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # A escolha acontece com o lock: done() nas threads dos workers enxerga a chave já
+        # contada como em andamento e não dá a filial como concluída antes da hora
+        with self._condition:
+            while True:
+                self._release_due_retries()
+                lane, item = self._pick()
+                if item is not None:
+                    lane.in_flight += 1
+                    lane.dispatched += 1
+                    self._in_flight += 1
+                    return item
+                if not self._delayed and not self._in_flight:
+                    self._finish_idle_lanes()
+                    raise StopIteration
+                # Nada pronto: aguarda a espera de uma chave reagendada ou o fim de uma chave em andamento
+                timeout = max(0.0, self._delayed[0][0] - time.monotonic()) if self._delayed else None
+                self._condition.wait(timeout)
+
+    def _release_due_retries(self):
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, filial_code, key = heapq.heappop(self._delayed)
+            lane = self._lanes[filial_code]
+            lane.delayed -= 1
+            lane.retries.append((filial_code, key))
+
+    def _pick(self):
+        """
+        Retorna (fila da filial, (filial_code, key)) da próxima chave a despachar, ou (None, None) se nenhuma está pronta.
+        """
+        for lanes in self._levels:
+            while True:
+                ready = [lane for lane in lanes if lane.ready]
+                if not ready:
+                    break
+                # Round-robin ponderado suave: cada filial pronta ganha crédito igual à sua
+                # fatia e a de maior crédito é atendida, pagando o total da rodada
+                total = 0.0
+                for lane in ready:
+                    lane.current += lane.share
+                    total += lane.share
+                lane = max(ready, key=lambda candidate: candidate.current)
+                lane.current -= total
+                item = lane.take()
+                if item is not None:
+                    return lane, item
+                # A filial acabou de ficar sem chaves: sai da disputa sem levar o crédito
+                lane.current = 0.0
+                self._check_lane_finished(lane)
+        return None, None
+
+    def requeue(self, filial_code, key):
+        """
+        Reagenda uma chave que falhou. Retorna False se ela já usou todos os reagendamentos
+        (a falha é definitiva). O worker ainda deve chamar done() para a entrega atual.
+        """
+        with self._condition:
+            attempt = self._requeues.get(key, 0) + 1
+            if attempt > self.max_requeues:
+                return False
+            self._requeues[key] = attempt
+            delay = min(self.requeue_max_delay, self.requeue_delay * (2 ** (attempt - 1)))
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._sequence), filial_code, key))
+            self._lanes[filial_code].delayed += 1
+            self._condition.notify_all()
+        metrics.inc("key_requeues_total", filial=filial_code)
+        self.logger.warning(
+            f"Chave {key[:10]}... (Filial: {filial_code}) reagendada para daqui a {delay:.0f}s "
+            f"(reagendamento {attempt}/{self.max_requeues})."
+        )
+        return True
+
+    def done(self, filial_code, key):
+        """
+        Marca como terminada a entrega atual da chave (salva, com falha ou já reagendada).
+        """
+        with self._condition:
+            lane = self._lanes[filial_code]
+            lane.in_flight -= 1
+            self._in_flight -= 1
+            self._check_lane_finished(lane)
+            self._condition.notify_all()
+
+    def _check_lane_finished(self, lane):
+        # Chamado com o lock
+        if lane.finished or lane.ready or lane.in_flight or lane.delayed:
+            return
+        lane.finished = True
+        if not lane.dispatched:
+            return
+        elapsed = time.monotonic() - self.started_at
+        metrics.observe("filial_completion_seconds", elapsed, filial=lane.filial_code)
+        self.logger.info(
+            f"Filial '{lane.filial_code}' concluída: {lane.dispatched} entrega(s) em {elapsed:.1f}s "
+            f"(fatia {lane.share}, prioridade {lane.priority})."
+        )
+
+    def _finish_idle_lanes(self):
+        for lane in self._lanes.values():
+            self._check_lane_finished(lane)
@@ -0,0 +1,191 @@
+import queue
+import threading
+
+from src.logger_config import module_logger
+
+# Sinal de fim enviado pelas filas: cada worker encerra ao recebê-lo
+_STOP = object()
+
+
+class PipelineStage:
+    """
+    Estágio do pipeline: `workers` threads leem itens da fila de entrada, chamam
+    handler(item) e repassam o resultado (quando não for None) ao próximo estágio.
+
+    A fila de entrada é limitada a `queue_size` itens; quando ela enche, o estágio
+    anterior fica bloqueado até haver espaço (backpressure), o que mantém constante
+    a quantidade de XMLs/PDFs em memória.
+
+    Args:
+        name (str): Nome do estágio (para logs).
+        handler (function): Função chamada para cada item. Retorna o item do próximo
+            estágio ou None para encerrar o item aqui (ex: falha já registrada).
+        workers (int): Número de threads do estágio.
+        queue_size (int): Capacidade da fila de entrada.
+    """
+
+    def __init__(self, name, handler, workers, queue_size):
+        if workers < 1:
+            raise ValueError(f"O estágio '{name}' precisa de pelo menos 1 worker.")
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.input_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.next_stage = None
+        self.processed = 0
+        self.errors = 0
+        self.busy = 0
+        self.peak_depth = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self, on_error):
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._run_worker,
+                args=(on_error,),
+                name=f"estagio-{self.name}-{index + 1}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _run_worker(self, on_error):
+        while True:
+            item = self.input_queue.get()
+            if item is _STOP:
+                return
+
+            with self._lock:
+                self.busy += 1
+                self.peak_depth = max(self.peak_depth, self.input_queue.qsize() + 1)
+            result = None
+            try:
+                result = self.handler(item)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                on_error(self.name, item, e)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                    self.processed += 1
+
+            if result is not None and self.next_stage is not None:
+                self.next_stage.input_queue.put(result)
+
+    def stop(self):
+        """
+        Envia o sinal de fim a todos os workers e aguarda o término dos itens em andamento.
+        """
+        for _ in self._threads:
+            self.input_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def depth(self):
+        return self.input_queue.qsize()
+
+
+class StagedPipeline:
+    """
+    Pipeline produtor/consumidor: estágios independentes ligados por filas limitadas.
+
+    Cada estágio tem seu próprio número de workers, de modo que o download de uma
+    chave acontece ao mesmo tempo que a geração da DANFE e a gravação das anteriores.
+    Periodicamente, a profundidade de cada fila é registrada no log: a fila que
+    vive cheia indica o estágio gargalo.
+
+    Args:
+        logger: Logger do pipeline.
+        report_interval (float): Intervalo, em segundos, entre os relatórios das filas
+            (None ou 0 desativa o relatório periódico).
+
+    Uso:
+        pipeline = StagedPipeline(logger, report_interval=10)
+        pipeline.add_stage("xml", fetch, workers=8, queue_size=50)
+        pipeline.add_stage("salvar", save, workers=2, queue_size=50)
+        pipeline.run(items)
+    """
+
+    def __init__(self, logger=None, report_interval=None):
+        self.logger = module_logger(logger, __name__)
+        self.report_interval = report_interval
+        self.stages = []
+        self._finished = threading.Event()
+
+    def add_stage(self, name, handler, workers, queue_size):
+        stage = PipelineStage(name, handler, workers, queue_size)
+        if self.stages:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+        return stage
+
+    def queue_depths(self):
+        """
+        Retorna {nome do estágio: itens aguardando na fila de entrada}.
+        """
+        return {stage.name: stage.depth() for stage in self.stages}
+
+    def report_queue_depths(self):
+        self.logger.info("Filas do pipeline: " + " | ".join(
+            f"{stage.name}: {stage.depth()}/{stage.input_queue.maxsize} na fila, {stage.busy}/{stage.workers} ocupado(s)"
+            for stage in self.stages
+        ))
+
+    def _run_reporter(self):
+        while not self._finished.wait(self.report_interval):
+            self.report_queue_depths()
+
+    def _default_on_error(self, stage_name, item, error):
+        self.logger.error(f"Erro inesperado no estágio '{stage_name}': {error}", exc_info=error)
+
+    def run(self, items, on_error=None):
+        """
+        Alimenta o primeiro estágio com `items` (consumidos sob demanda) e aguarda
+        todos os estágios esvaziarem.
+
+        Args:
+            items (iterable): Itens de entrada do primeiro estágio.
+            on_error (function): Chamada como on_error(nome_do_estagio, item, exceção)
+                quando um handler lança exceção. O item é descartado e o estágio segue.
+
+        Returns:
+            int: Quantidade de itens entregues ao primeiro estágio.
+        """
+        if not self.stages:
+            raise ValueError("O pipeline não tem estágios.")
+
+        on_error = on_error or self._default_on_error
+        self._finished.clear()
+        for stage in self.stages:
+            stage.start(on_error)
+
+        reporter = None
+        if self.report_interval:
+            reporter = threading.Thread(target=self._run_reporter, name="estagios-relatorio", daemon=True)
+            reporter.start()
+
+        submitted = 0
+        first_queue = self.stages[0].input_queue
+        try:
+            for item in items:
+                # Bloqueia enquanto a fila do primeiro estágio estiver cheia
+                first_queue.put(item)
+                submitted += 1
+        finally:
+            # Encerra os estágios em ordem: um estágio só para depois que o anterior
+            # terminou e, portanto, não vai mais enfileirar itens nele.
+            for stage in self.stages:
+                stage.stop()
+            self._finished.set()
+            if reporter is not None:
+                reporter.join()
+
+        for stage in self.stages:
+            self.logger.info(
+                f"Estágio '{stage.name}': {stage.processed} item(ns) processado(s), {stage.errors} erro(s), "
+                f"fila máxima observada {stage.peak_depth}/{stage.input_queue.maxsize}."
+            )
+        return submitted
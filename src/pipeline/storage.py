@@ -0,0 +1,589 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import (
+    OUTPUT_BASE_FOLDER,
+    STORAGE_BACKEND,
+    STORAGE_BUCKET,
+    STORAGE_PREFIX,
+    STORAGE_ENDPOINT_URL,
+    STORAGE_REGION,
+    STORAGE_MAX_CONCURRENCY,
+    STORAGE_MULTIPART_THRESHOLD_BYTES,
+    STORAGE_MULTIPART_PART_SIZE_BYTES,
+    WRITER_FSYNC_MODE,
+    WRITER_FSYNC_BATCH_SIZE,
+)
+from src.logger_config import module_logger
+
+BACKEND_LOCAL = "local"
+BACKEND_S3 = "s3"
+BACKEND_GCS = "gcs"
+BACKEND_MEMORY = "memoria"
+
+# Sufixo dos arquivos temporários: o documento só recebe o nome final depois de gravado por completo
+PARTIAL_SUFFIX = ".parcial"
+
+# Temporários mais antigos que isso são sobras de uma execução interrompida
+# (os mais recentes podem pertencer a outro processo gravando na mesma pasta)
+STALE_PARTIAL_SECONDS = 600
+
+FSYNC_NONE = "nenhum"
+FSYNC_EACH = "cada"
+FSYNC_BATCH = "lote"
+
+_CONTENT_TYPES = {".xml": "application/xml", ".pdf": "application/pdf"}
+
+
+def document_relative_paths(filial_code, date_str, note_number):
+    """
+    Caminhos relativos (separados por "/") do XML e do PDF de uma nota:
+    <filial>/<data>/XML/<nNF>.xml e <filial>/<data>/DANFE/<nNF>.pdf.
+    """
+    return (
+        f"{filial_code}/{date_str}/XML/{note_number}.xml",
+        f"{filial_code}/{date_str}/DANFE/{note_number}.pdf",
+    )
+
+
+def object_location(backend, bucket, prefix, relative_path):
+    """
+    URI de um documento no armazenamento de objetos (ex: s3://bucket/prefixo/001/2025-06-12/XML/123.xml).
+    """
+    key = f"{prefix.strip('/')}/{relative_path}" if prefix else relative_path
+    scheme = "gs" if backend == BACKEND_GCS else backend
+    return f"{scheme}://{bucket}/{key}"
+
+
+def _fsync_path(path, directory=False):
+    flags = os.O_RDONLY | (getattr(os, "O_DIRECTORY", 0) if directory else 0)
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        return  # Ex: Windows não permite abrir diretórios
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SpooledDocument:
+    """
+    Documento (XML ou PDF) já gravado em um arquivo temporário durante o download
+    (STREAMING_TRANSFER_ENABLED), passado entre os estágios no lugar dos bytes.
+
+    Cada detentor do documento o entrega ao destino final com commit_to() ou o
+    descarta com discard(), uma vez. Quando o mesmo documento é compartilhado (chave
+    repetida resolvida por outra thread), retain() registra os detentores extras: os
+    primeiros recebem uma cópia e o último leva o próprio arquivo.
+
+    Args:
+        path (str): Arquivo temporário.
+        size (int): Tamanho do documento em bytes.
+    """
+
+    __slots__ = ("path", "size", "_holders", "_lock")
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._holders = 1
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __repr__(self):
+        return f"SpooledDocument({self.path!r}, {self.size})"
+
+    def open(self):
+        return open(self.path, "rb")
+
+    def read_bytes(self):
+        with self.open() as f:
+            return f.read()
+
+    def read_range(self, offset, size):
+        with self.open() as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def retain(self, count=1):
+        with self._lock:
+            self._holders += count
+
+    def commit_to(self, path, fsync=False):
+        """
+        Entrega o documento em `path`. O último detentor move o arquivo (rename, atômico);
+        os demais, ou quando o destino está em outro disco, gravam uma cópia via
+        temporário + os.replace.
+        """
+        if fsync:
+            _fsync_path(self.path)
+        with self._lock:
+            if self._holders <= 0:
+                raise RuntimeError(f"Documento temporário {self.path} já foi entregue ou descartado.")
+            last_holder = self._holders == 1
+            if last_holder:
+                self._holders = 0
+        if last_holder:
+            try:
+                os.replace(self.path, path)
+                return
+            except OSError:
+                pass  # Ex: destino em outro sistema de arquivos
+
+        directory, name = os.path.split(path)
+        temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}{PARTIAL_SUFFIX}")
+        try:
+            shutil.copyfile(self.path, temp_path)
+            if fsync:
+                _fsync_path(temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            _remove_quietly(temp_path)
+            raise
+        finally:
+            # A cópia é feita ainda como detentor: o arquivo só sai do lugar depois dela
+            if last_holder:
+                _remove_quietly(self.path)
+            else:
+                self.discard()
+
+    def discard(self):
+        """
+        Abre mão do documento; o arquivo é removido quando não resta nenhum detentor.
+        """
+        with self._lock:
+            if self._holders <= 0:
+                return
+            self._holders -= 1
+            last_holder = self._holders == 0
+        if last_holder:
+            _remove_quietly(self.path)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def document_bytes(content):
+    """
+    Conteúdo do documento em bytes, lendo o arquivo temporário se for um SpooledDocument.
+    """
+    return content.read_bytes() if isinstance(content, SpooledDocument) else content
+
+
+def discard_documents(*contents):
+    """
+    Descarta os documentos temporários entre `contents` (bytes e None são ignorados).
+    """
+    for content in contents:
+        if isinstance(content, SpooledDocument):
+            content.discard()
+
+
+class LocalStorage:
+    """
+    Armazenamento em disco local, sob `base_path`.
+
+    - Cada arquivo é gravado em um temporário na mesma pasta e renomeado com
+      os.replace, que é atômico: após uma queda, ou existe o arquivo completo ou
+      não existe nenhum (temporários antigos que sobraram são removidos no próximo uso da pasta).
+    - Cada pasta é criada uma única vez e fica em cache.
+    - Opcionalmente aplica fsync: em cada arquivo ("cada") ou em lotes de
+      `fsync_batch_size` documentos ("lote"), reduzindo o custo por nota.
+
+    Args:
+        base_path (str): Pasta raiz de saída.
+        fsync_mode (str): "nenhum", "cada" ou "lote".
+        fsync_batch_size (int): Documentos por lote no modo "lote".
+        logger: Logger do pipeline.
+    """
+
+    name = BACKEND_LOCAL
+
+    def __init__(self, base_path=OUTPUT_BASE_FOLDER, fsync_mode=WRITER_FSYNC_MODE,
+                 fsync_batch_size=WRITER_FSYNC_BATCH_SIZE, logger=None):
+        if fsync_mode not in (FSYNC_NONE, FSYNC_EACH, FSYNC_BATCH):
+            raise ValueError(f"Modo de fsync desconhecido: {fsync_mode!r}")
+        self.base_path = base_path
+        self.fsync_mode = fsync_mode
+        self.fsync_batch_size = max(1, fsync_batch_size)
+        self.logger = module_logger(logger, __name__)
+        self._directories = set()
+        self._directories_lock = threading.Lock()
+        self._unsynced_files = []
+        self._unsynced_lock = threading.Lock()
+
+    def location(self, relative_path):
+        return os.path.join(self.base_path, *relative_path.split("/"))
+
+    def ensure_directory(self, directory):
+        """
+        Cria a pasta apenas na primeira chamada; as seguintes são atendidas pelo cache.
+        """
+        if directory in self._directories:
+            return
+        with self._directories_lock:
+            if directory not in self._directories:
+                os.makedirs(directory, exist_ok=True)
+                self._remove_partial_files(directory)
+                self.logger.debug(f"Diretório criado/verificado: {directory}")
+                self._directories.add(directory)
+
+    def _remove_partial_files(self, directory):
+        stale_before = time.time() - STALE_PARTIAL_SECONDS
+        for entry in os.scandir(directory):
+            if entry.name.endswith(PARTIAL_SUFFIX):
+                try:
+                    if entry.stat().st_mtime > stale_before:
+                        continue
+                    os.remove(entry.path)
+                    self.logger.warning(f"Arquivo incompleto de uma execução anterior removido: {entry.path}")
+                except OSError:
+                    pass
+
+    def write_atomic(self, path, content):
+        """
+        Grava `content` em `path` por meio de um temporário + os.replace. Um SpooledDocument
+        já é o temporário: é apenas movido para `path`.
+        """
+        directory, name = os.path.split(path)
+        if isinstance(content, SpooledDocument):
+            content.commit_to(path, fsync=self.fsync_mode == FSYNC_EACH)
+        else:
+            temp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}{PARTIAL_SUFFIX}")
+            try:
+                with open(temp_path, "wb") as f:
+                    f.write(content)
+                    if self.fsync_mode == FSYNC_EACH:
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(temp_path, path)
+            except BaseException:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                raise
+
+        if self.fsync_mode == FSYNC_EACH:
+            _fsync_path(directory, directory=True)
+        elif self.fsync_mode == FSYNC_BATCH:
+            self.schedule_sync(path)
+
+    def put(self, relative_path, content):
+        """
+        Grava o documento e retorna o caminho final.
+        """
+        path = self.location(relative_path)
+        self.ensure_directory(os.path.dirname(path))
+        self.write_atomic(path, content)
+        return path
+
+    def schedule_sync(self, *paths):
+        """
+        Inclui os caminhos no próximo lote de fsync (modo "lote").
+        """
+        with self._unsynced_lock:
+            self._unsynced_files.extend(paths)
+            # Cada nota acrescenta dois caminhos (XML e PDF, ou pacote e índice)
+            batch_full = len(self._unsynced_files) >= self.fsync_batch_size * 2
+        if batch_full:
+            self.sync()
+
+    def sync(self):
+        """
+        Aplica fsync nos arquivos gravados desde o último lote e nas suas pastas.
+        """
+        with self._unsynced_lock:
+            files, self._unsynced_files = self._unsynced_files, []
+        if not files:
+            return
+        files = set(files)
+        for path in files:
+            _fsync_path(path)
+        for directory in {os.path.dirname(path) for path in files}:
+            _fsync_path(directory, directory=True)
+        self.logger.debug(f"fsync aplicado a {len(files)} arquivo(s).")
+
+    def close(self):
+        self.sync()
+
+
+class InMemoryObjectClient:
+    """
+    Cliente de armazenamento de objetos em memória, com a mesma interface dos
+    adaptadores S3/GCS. Usado em benchmarks e para testar o pipeline sem nuvem.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.put_count = 0
+        self.part_count = 0
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, bucket, key, data, content_type=None):
+        with self._lock:
+            self.objects[(bucket, key)] = bytes(data)
+            self.put_count += 1
+
+    def create_multipart_upload(self, bucket, key, content_type=None):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {}
+        return upload_id
+
+    def upload_part(self, bucket, key, upload_id, part_number, data):
+        with self._lock:
+            self._uploads[upload_id][part_number] = bytes(data)
+            self.part_count += 1
+        return f"{upload_id}-{part_number}"
+
+    def complete_multipart_upload(self, bucket, key, upload_id, parts):
+        with self._lock:
+            uploaded = self._uploads.pop(upload_id)
+            self.objects[(bucket, key)] = b"".join(uploaded[part_number] for part_number, _ in sorted(parts))
+
+    def abort_multipart_upload(self, bucket, key, upload_id):
+        with self._lock:
+            self._uploads.pop(upload_id, None)
+
+    def get_object(self, bucket, key):
+        with self._lock:
+            return self.objects[(bucket, key)]
+
+
+class S3ObjectClient:
+    """
+    Adaptador para S3 e serviços compatíveis (MinIO, GCS via API XML com chaves HMAC),
+    usando boto3. As conexões ficam em um pool de `max_pool_connections` conexões keep-alive.
+    Credenciais seguem a cadeia padrão do boto3 (variáveis de ambiente, ~/.aws, perfil da instância).
+    """
+
+    def __init__(self, endpoint_url=None, region=None, max_pool_connections=STORAGE_MAX_CONCURRENCY):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError("O armazenamento 's3' requer o pacote boto3 (pip install boto3).") from e
+
+        self._client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(max_pool_connections=max_pool_connections, retries={"max_attempts": 5, "mode": "standard"}),
+        )
+
+    def put_object(self, bucket, key, data, content_type=None):
+        extra = {"ContentType": content_type} if content_type else {}
+        self._client.put_object(Bucket=bucket, Key=key, Body=data, **extra)
+
+    def create_multipart_upload(self, bucket, key, content_type=None):
+        extra = {"ContentType": content_type} if content_type else {}
+        return self._client.create_multipart_upload(Bucket=bucket, Key=key, **extra)["UploadId"]
+
+    def upload_part(self, bucket, key, upload_id, part_number, data):
+        response = self._client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=bytes(data)
+        )
+        return response["ETag"]
+
+    def complete_multipart_upload(self, bucket, key, upload_id, parts):
+        self._client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": number, "ETag": etag} for number, etag in sorted(parts)]},
+        )
+
+    def abort_multipart_upload(self, bucket, key, upload_id):
+        self._client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+
+    def get_object(self, bucket, key):
+        return self._client.get_object(Bucket=bucket, Key=key)["Body"].read()
+
+
+class GcsObjectClient:
+    """
+    Adaptador para o Google Cloud Storage (google-cloud-storage).
+
+    O GCS não tem upload multipart no estilo S3: as partes são enviadas em paralelo
+    como objetos temporários e unidas no objeto final com "compose" (até 32 por vez),
+    sendo apagadas em seguida.
+    """
+
+    _MAX_COMPOSE_SOURCES = 32
+
+    def __init__(self, max_pool_connections=STORAGE_MAX_CONCURRENCY):
+        try:
+            import google.auth
+            from google.auth.transport.requests import AuthorizedSession
+            from google.cloud import storage
+            from requests.adapters import HTTPAdapter
+        except ImportError as e:
+            raise RuntimeError("O armazenamento 'gcs' requer o pacote google-cloud-storage (pip install google-cloud-storage).") from e
+
+        # Transporte montado aqui (em vez do criado pelo cliente), com o pool ampliado
+        # para os uploads em paralelo. Credenciais seguem o Application Default Credentials.
+        credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+        self._session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=max_pool_connections, pool_maxsize=max_pool_connections)
+        self._session.mount("https://", adapter)
+        self._client = storage.Client(project=project, credentials=credentials, _http=self._session)
+        self._buckets = {}
+
+    def _blob(self, bucket, key):
+        if bucket not in self._buckets:
+            self._buckets[bucket] = self._client.bucket(bucket)
+        return self._buckets[bucket].blob(key)
+
+    @staticmethod
+    def _part_key(key, upload_id, part_number):
+        return f"{key}.partes/{upload_id}/{part_number:05d}"
+
+    def put_object(self, bucket, key, data, content_type=None):
+        self._blob(bucket, key).upload_from_string(bytes(data), content_type=content_type)
+
+    def create_multipart_upload(self, bucket, key, content_type=None):
+        return uuid.uuid4().hex
+
+    def upload_part(self, bucket, key, upload_id, part_number, data):
+        part_key = self._part_key(key, upload_id, part_number)
+        self._blob(bucket, part_key).upload_from_string(bytes(data))
+        return part_key
+
+    def complete_multipart_upload(self, bucket, key, upload_id, parts):
+        sources = [self._blob(bucket, part_key) for _, part_key in sorted(parts)]
+        destination = self._blob(bucket, key)
+        batch = sources[:self._MAX_COMPOSE_SOURCES]
+        destination.compose(batch)
+        for start in range(self._MAX_COMPOSE_SOURCES, len(sources), self._MAX_COMPOSE_SOURCES - 1):
+            destination.compose([destination] + sources[start:start + self._MAX_COMPOSE_SOURCES - 1])
+        for source in sources:
+            source.delete()
+
+    def abort_multipart_upload(self, bucket, key, upload_id):
+        prefix = f"{key}.partes/{upload_id}/"
+        for blob in self._client.list_blobs(bucket, prefix=prefix):
+            blob.delete()
+
+    def get_object(self, bucket, key):
+        return self._blob(bucket, key).download_as_bytes()
+
+
+class ObjectStorage:
+    """
+    Armazenamento em bucket (S3, GCS ou compatível), sem passar pelo disco local.
+
+    Documentos pequenos vão em um único PUT; a partir de `multipart_threshold`
+    bytes, o documento é dividido em partes de `part_size` bytes enviadas em
+    paralelo. O upload só se torna visível no bucket quando todas as partes
+    chegam (complete), então não existem objetos pela metade.
+
+    Args:
+        client: Adaptador (S3ObjectClient, GcsObjectClient ou InMemoryObjectClient).
+        bucket (str): Nome do bucket.
+        prefix (str): Prefixo das chaves dos objetos.
+        backend (str): Nome do backend (para montar as URIs: "s3", "gcs", "memoria").
+        max_concurrency (int): Partes enviadas ao mesmo tempo.
+        multipart_threshold (int): Tamanho a partir do qual o upload é multipart.
+        part_size (int): Tamanho de cada parte (mínimo de 5 MB no S3, exceto a última).
+        logger: Logger do pipeline.
+    """
+
+    def __init__(self, client, bucket, prefix="", backend=BACKEND_MEMORY, max_concurrency=STORAGE_MAX_CONCURRENCY,
+                 multipart_threshold=STORAGE_MULTIPART_THRESHOLD_BYTES, part_size=STORAGE_MULTIPART_PART_SIZE_BYTES,
+                 logger=None):
+        if not bucket:
+            raise ValueError("Informe o bucket do armazenamento de objetos (STORAGE_BUCKET).")
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.name = backend
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.logger = module_logger(logger, __name__)
+        self._part_executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="upload-parte")
+
+    def object_key(self, relative_path):
+        return f"{self.prefix}/{relative_path}" if self.prefix else relative_path
+
+    def location(self, relative_path):
+        return object_location(self.name, self.bucket, self.prefix, relative_path)
+
+    def put(self, relative_path, content):
+        """
+        Envia o documento ao bucket e retorna a URI do objeto.
+        """
+        key = self.object_key(relative_path)
+        content_type = _CONTENT_TYPES.get(os.path.splitext(relative_path)[1])
+        if len(content) < self.multipart_threshold:
+            self.client.put_object(self.bucket, key, document_bytes(content), content_type=content_type)
+        else:
+            self._put_multipart(key, content, content_type)
+        return self.location(relative_path)
+
+    def _put_multipart(self, key, content, content_type):
+        # Documento em arquivo temporário: cada parte é lida do disco na thread que a envia,
+        # então só as partes em envio ficam em memória
+        if isinstance(content, SpooledDocument):
+            read_part = content.read_range
+        else:
+            view = memoryview(content)
+            read_part = lambda offset, size: view[offset:offset + size]
+        upload_id = self.client.create_multipart_upload(self.bucket, key, content_type=content_type)
+        try:
+            futures = [
+                (part_number, self._part_executor.submit(
+                    self._upload_part, key, upload_id, part_number, read_part, offset
+                ))
+                for part_number, offset in enumerate(range(0, len(content), self.part_size), start=1)
+            ]
+            parts = [(part_number, future.result()) for part_number, future in futures]
+            self.client.complete_multipart_upload(self.bucket, key, upload_id, parts)
+        except BaseException:
+            try:
+                self.client.abort_multipart_upload(self.bucket, key, upload_id)
+            except Exception as e:
+                self.logger.warning(f"Não foi possível cancelar o upload multipart de {key}: {e}")
+            raise
+        self.logger.debug(f"Upload multipart de {key} concluído em {len(parts)} parte(s).")
+
+    def _upload_part(self, key, upload_id, part_number, read_part, offset):
+        return self.client.upload_part(self.bucket, key, upload_id, part_number, read_part(offset, self.part_size))
+
+    def close(self):
+        self._part_executor.shutdown(wait=True)
+
+
+def create_storage(backend=STORAGE_BACKEND, logger=None):
+    """
+    Cria o armazenamento configurado em STORAGE_BACKEND ("local", "s3", "gcs" ou "memoria").
+    """
+    if backend == BACKEND_LOCAL:
+        return LocalStorage(logger=logger)
+    if backend == BACKEND_S3:
+        client = S3ObjectClient(endpoint_url=STORAGE_ENDPOINT_URL, region=STORAGE_REGION)
+    elif backend == BACKEND_GCS:
+        client = GcsObjectClient()
+    elif backend == BACKEND_MEMORY:
+        client = InMemoryObjectClient()
+    else:
+        raise ValueError(f"Armazenamento desconhecido: {backend!r}")
+    bucket = STORAGE_BUCKET or ("notas" if backend == BACKEND_MEMORY else None)
+    return ObjectStorage(client, bucket, prefix=STORAGE_PREFIX, backend=backend, logger=logger)
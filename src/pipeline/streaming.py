@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+from src.config import STREAMING_CHUNK_SIZE_BYTES, STREAMING_SPOOL_FOLDER
+from src.pipeline.metrics import metrics
+from src.pipeline.nfe_metadata import NFeMetadataParser
+from src.pipeline.storage import PARTIAL_SUFFIX, STALE_PARTIAL_SECONDS, SpooledDocument
+from src.logger_config import module_logger
+
+
+class DocumentSpool:
+    """
+    Recebe o corpo de respostas HTTP (requisições feitas com stream=True) direto em
+    arquivos temporários, em blocos de `chunk_size` bytes: a memória usada por um
+    download é a de um bloco, qualquer que seja o tamanho do documento.
+
+    A pasta deve ficar no mesmo disco da saída, para que a gravação final seja um rename.
+    Temporários antigos (de uma execução interrompida) são removidos no primeiro uso.
+
+    Args:
+        folder (str): Pasta dos arquivos temporários.
+        chunk_size (int): Tamanho dos blocos lidos da conexão.
+        logger: Logger do pipeline.
+    """
+
+    def __init__(self, folder=STREAMING_SPOOL_FOLDER, chunk_size=STREAMING_CHUNK_SIZE_BYTES, logger=None):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.logger = module_logger(logger, __name__)
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def _ensure_folder(self):
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            os.makedirs(self.folder, exist_ok=True)
+            stale_before = time.time() - STALE_PARTIAL_SECONDS
+            for entry in os.scandir(self.folder):
+                try:
+                    if entry.name.endswith(PARTIAL_SUFFIX) and entry.stat().st_mtime <= stale_before:
+                        os.remove(entry.path)
+                        self.logger.warning(f"Arquivo temporário de uma execução anterior removido: {entry.path}")
+                except OSError:
+                    pass
+            self._ready = True
+
+    def receive(self, response, suffix, on_chunk=None):
+        """
+        Grava o corpo da resposta em um arquivo temporário e fecha a resposta.
+        on_chunk(bloco), se informado, é chamado para cada bloco recebido.
+        Retorna o SpooledDocument, ou None se o corpo veio vazio.
+        """
+        self._ensure_folder()
+        path = os.path.join(self.folder, f"{uuid.uuid4().hex}{suffix}{PARTIAL_SUFFIX}")
+        size = 0
+        try:
+            with open(path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+                    if on_chunk is not None:
+                        on_chunk(chunk)
+        except BaseException:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            raise
+        finally:
+            response.close()
+
+        if not size:
+            os.remove(path)
+            return None
+        metrics.observe("streamed_document_bytes", size, kind=suffix.lstrip("."))
+        return SpooledDocument(path, size)
+
+
+def receive_nfe_xml(response, spool=None):
+    """
+    Recebe o XML da NF-e em um arquivo temporário e lê o número da nota (nNF) dos
+    blocos à medida que chegam, sem reler o documento depois.
+    Retorna (SpooledDocument ou None, note_number ou None se o nNF não foi encontrado).
+    """
+    parser = NFeMetadataParser(fields=("note_number",))
+    malformed = []
+
+    def feed(chunk):
+        if parser.done or malformed:
+            return
+        try:
+            parser.feed(chunk)
+        except ET.ParseError as e:
+            # XML malformado: o documento é gravado mesmo assim e o nNF fica sem valor
+            malformed.append(e)
+
+    document = (spool or get_document_spool()).receive(response, ".xml", on_chunk=feed)
+    if document is None:
+        return None, None
+    return document, parser.close().note_number if parser.done else None
+
+
+def receive_document(response, suffix, spool=None):
+    """
+    Recebe o corpo da resposta (ex: o PDF da DANFE) em um arquivo temporário.
+    Retorna o SpooledDocument, ou None se o corpo veio vazio.
+    """
+    return (spool or get_document_spool()).receive(response, suffix)
+
+
+_shared_spool = None
+_shared_spool_lock = threading.Lock()
+
+
+def get_document_spool():
+    """
+    Retorna a pasta de transferência compartilhada do processo, criando-a na primeira chamada.
+    """
+    global _shared_spool
+    if _shared_spool is None:
+        with _shared_spool_lock:
+            if _shared_spool is None:
+                _shared_spool = DocumentSpool()
+    return _shared_spool
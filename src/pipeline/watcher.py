@@ -0,0 +1,291 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from src.pipeline.access_key import validate_access_key
+from src.pipeline.extract import parse_filial_from_filename
+from src.logger_config import module_logger
+
+# Eventos do inotify (linux/inotify.h) que indicam arquivo novo, alterado ou removido
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+_EVENT_HEADER = struct.Struct("iIII")
+
+# Tempo para agrupar a rajada de eventos de uma mesma gravação antes de ler o arquivo
+_EVENT_COALESCE_SECONDS = 0.05
+
+WATCH_BACKEND_AUTO = "auto"
+WATCH_BACKEND_INOTIFY = "inotify"
+WATCH_BACKEND_POLLING = "polling"
+
+
+def is_key_file(filename):
+    return filename.endswith(".txt") and parse_filial_from_filename(filename) is not None
+
+
+class InotifyWatcher:
+    """
+    Observa a pasta de entrada com o inotify do Linux (via ctypes, sem dependências):
+    o processo dorme até um arquivo ser criado, alterado, renomeado ou removido.
+    """
+
+    name = WATCH_BACKEND_INOTIFY
+
+    def __init__(self, folder):
+        self.folder = folder
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify indisponível nesta plataforma.")
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falhou")
+        watch = libc.inotify_add_watch(self._fd, os.fsencode(folder), _WATCH_MASK)
+        if watch < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch falhou para '{folder}'")
+
+    def _read_events(self):
+        names = set()
+        rescan = False
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(buffer):
+                _, mask, _, name_length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset:offset + name_length].rstrip(b"\0")
+                offset += name_length
+                if mask & (IN_Q_OVERFLOW | IN_DELETE_SELF | IN_MOVE_SELF):
+                    rescan = True
+                elif name:
+                    names.add(os.fsdecode(name))
+        return names, rescan
+
+    def wait(self, timeout):
+        """
+        Espera até `timeout` segundos por eventos. Retorna (nomes alterados, rescan), onde
+        rescan=True indica que eventos foram perdidos e a pasta inteira deve ser relida.
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set(), False
+        time.sleep(_EVENT_COALESCE_SECONDS)
+        return self._read_events()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class PollingWatcher:
+    """
+    Alternativa ao inotify (outros sistemas, pastas de rede): compara a cada intervalo
+    inode, tamanho e data de modificação dos arquivos da pasta.
+    """
+
+    name = WATCH_BACKEND_POLLING
+
+    def __init__(self, folder, interval):
+        self.folder = folder
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        snapshot[entry.name] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        return snapshot
+
+    def wait(self, timeout):
+        time.sleep(min(self.interval, timeout))
+        snapshot = self._scan()
+        previous, self._snapshot = self._snapshot, snapshot
+        changed = {name for name, signature in snapshot.items() if previous.get(name) != signature}
+        changed.update(name for name in previous if name not in snapshot)
+        return changed, False
+
+    def close(self):
+        pass
+
+
+def create_watcher(folder, backend, poll_interval, logger):
+    """
+    Cria o observador da pasta: inotify quando disponível ("auto" ou "inotify"), senão polling.
+    """
+    logger = module_logger(logger, __name__)
+    if backend not in (WATCH_BACKEND_AUTO, WATCH_BACKEND_INOTIFY, WATCH_BACKEND_POLLING):
+        raise ValueError(f"Observador de pasta desconhecido: {backend!r}")
+    if backend != WATCH_BACKEND_POLLING and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folder)
+        except OSError as e:
+            if backend == WATCH_BACKEND_INOTIFY:
+                raise
+            logger.warning(f"inotify indisponível ({e}); usando verificação periódica a cada {poll_interval}s.")
+    return PollingWatcher(folder, poll_interval)
+
+
+class FileOffsetTracker:
+    """
+    Posição de leitura de cada arquivo de chaves, persistida em JSON entre execuções.
+
+    Para cada arquivo guarda o inode/dispositivo e o byte até onde as chaves já foram
+    concluídas. Se o arquivo for substituído (inode diferente) ou truncado, a leitura
+    recomeça do início; as chaves repetidas são descartadas pelo registro de retomada.
+
+    A posição gravada só avança quando todas as chaves lidas antes dela terminaram
+    (salvas ou com falha registrada): se o processo cair, as chaves em andamento são
+    lidas de novo na próxima execução, nunca perdidas.
+
+    Args:
+        state_path (str): Arquivo JSON com as posições.
+    """
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self._lock = threading.Lock()
+        self._files = {}
+        # Por arquivo: lista de [posição final do trecho lido, chaves ainda em andamento]
+        self._chunks = {}
+        self._dirty = False
+        if os.path.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as f:
+                self._files = json.load(f)
+
+    def _read_position(self, filename, stat):
+        """
+        Posição a partir da qual o arquivo deve ser lido (0 se ele mudou de identidade ou encolheu).
+        """
+        entry = self._files.get(filename)
+        chunks = self._chunks.get(filename)
+        if entry is None or entry["inode"] != stat.st_ino or entry["device"] != stat.st_dev:
+            return 0, True
+        position = chunks[-1][0] if chunks else entry["offset"]
+        if stat.st_size < position:
+            return 0, True
+        return position, False
+
+    def read_new_lines(self, folder, filename, logger):
+        """
+        Lê as linhas acrescentadas ao arquivo desde a última leitura.
+        Retorna (lista de chaves válidas, identificador do trecho) ou ([], None) se nada mudou.
+        Uma última linha sem quebra só é consumida se já for uma chave completa e válida.
+        """
+        logger = module_logger(logger, __name__)
+        path = os.path.join(folder, filename)
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                with self._lock:
+                    position, restarted = self._read_position(filename, stat)
+                    if restarted:
+                        if filename in self._files:
+                            logger.info(f"Arquivo '{filename}' foi substituído ou truncado; relendo desde o início.")
+                        self._files[filename] = {"inode": stat.st_ino, "device": stat.st_dev, "offset": 0}
+                        self._chunks[filename] = []
+                        self._dirty = True
+                if stat.st_size <= position:
+                    return [], None
+                f.seek(position)
+                data = f.read(stat.st_size - position)
+        except FileNotFoundError:
+            self.forget(filename)
+            return [], None
+
+        end = data.rfind(b"\n") + 1
+        tail = data[end:].strip()
+        if tail and validate_access_key(tail.decode("utf-8", errors="replace")) is None:
+            end = len(data)
+        if not end:
+            return [], None
+
+        keys = []
+        for line in data[:end].decode("utf-8", errors="replace").splitlines():
+            clean_line = line.strip()
+            if not clean_line:
+                continue
+            rejection_reason = validate_access_key(clean_line)
+            if rejection_reason is None:
+                keys.append(clean_line)
+            else:
+                logger.warning(f"Linha ignorada no arquivo '{filename}': '{clean_line}' ({rejection_reason}).")
+
+        chunk = [position + end, len(keys)]
+        with self._lock:
+            self._chunks.setdefault(filename, []).append(chunk)
+            self._advance(filename)
+        return keys, (filename, chunk)
+
+    def key_done(self, chunk_id):
+        """
+        Informa que uma chave do trecho terminou (salva ou com falha).
+        """
+        filename, chunk = chunk_id
+        with self._lock:
+            chunk[1] -= 1
+            self._advance(filename)
+
+    def _advance(self, filename):
+        chunks = self._chunks.get(filename)
+        entry = self._files.get(filename)
+        if chunks is None or entry is None:
+            return
+        while chunks and chunks[0][1] <= 0:
+            entry["offset"] = chunks.pop(0)[0]
+            self._dirty = True
+
+    def forget(self, filename):
+        with self._lock:
+            if self._files.pop(filename, None) is not None:
+                self._dirty = True
+            self._chunks.pop(filename, None)
+
+    def known_files(self):
+        with self._lock:
+            return list(self._files)
+
+    def pending_keys(self):
+        with self._lock:
+            return sum(chunk[1] for chunks in self._chunks.values() for chunk in chunks)
+
+    def save(self):
+        """
+        Grava as posições (temporário + os.replace) se algo mudou desde a última gravação.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = json.dumps(self._files, ensure_ascii=False, indent=2)
+            self._dirty = False
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(snapshot)
+        os.replace(temp_path, self.state_path)
@@ -0,0 +1,177 @@
+import contextlib
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.pipeline.downloads import clear_download_dir
+from src.logger_config import module_logger
+
+
+class PooledDriver:
+    """
+    Um WebDriver do pool, seu diretório de downloads exclusivo e quantas chaves ele já atendeu.
+    """
+
+    __slots__ = ("driver", "download_dir", "uses")
+
+    def __init__(self, driver, download_dir):
+        self.driver = driver
+        self.download_dir = download_dir
+        self.uses = 0
+
+
+class WebDriverPool:
+    """
+    Pool de navegadores headless já iniciados, reaproveitados entre chaves.
+
+    Em vez de abrir e fechar um Chrome a cada chave que cai no fallback, os
+    drivers são emprestados (checkout) e devolvidos (checkin). Na devolução o
+    driver passa por uma verificação de saúde e é reciclado (fechado e
+    substituído) depois de `max_uses` chaves, limitando vazamentos de memória
+    do navegador.
+
+    Cada navegador recebe um diretório de downloads próprio dentro de
+    `download_root`, esvaziado a cada empréstimo, para que fallbacks
+    simultâneos nunca misturem arquivos.
+
+    Args:
+        size (int): Número máximo de navegadores abertos ao mesmo tempo.
+        driver_factory (function): Função driver_factory(download_dir) que cria um novo WebDriver (ou None em caso de erro).
+        max_uses (int): Quantidade de chaves atendidas antes de reciclar o driver.
+        logger: Logger do pipeline.
+        download_root (str): Pasta onde os diretórios de download de cada sessão são criados.
+    """
+
+    def __init__(self, size, driver_factory, max_uses, logger, download_root):
+        if size < 1:
+            raise ValueError("O pool de WebDrivers precisa de pelo menos 1 navegador.")
+        self.size = size
+        self.max_uses = max_uses
+        self.logger = module_logger(logger, __name__)
+        self._driver_factory = driver_factory
+        self.download_root = download_root
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._all = set()
+        self._closed = False
+
+    def warm_up(self):
+        """
+        Inicia todos os navegadores do pool em paralelo, antes da primeira chave precisar deles.
+        """
+        missing = self.size - len(self._all)
+        if missing <= 0:
+            return
+        with ThreadPoolExecutor(max_workers=missing) as executor:
+            for pooled in executor.map(lambda _: self._create(), range(missing)):
+                if pooled is not None:
+                    self._idle.put(pooled)
+        self.logger.info(f"Pool de WebDrivers aquecido com {len(self._all)} navegador(es).")
+
+    def _create(self):
+        os.makedirs(self.download_root, exist_ok=True)
+        download_dir = tempfile.mkdtemp(prefix="sessao_", dir=self.download_root)
+        driver = self._driver_factory(download_dir)
+        if driver is None:
+            shutil.rmtree(download_dir, ignore_errors=True)
+            return None
+        pooled = PooledDriver(driver, download_dir)
+        with self._lock:
+            self._all.add(pooled)
+        return pooled
+
+    def _destroy(self, pooled):
+        with self._lock:
+            self._all.discard(pooled)
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            self.logger.debug(f"Erro ao encerrar WebDriver do pool: {e}")
+        shutil.rmtree(pooled.download_dir, ignore_errors=True)
+
+    @staticmethod
+    def is_healthy(pooled):
+        """
+        Verifica se o navegador ainda responde a comandos simples.
+        """
+        try:
+            return bool(pooled.driver.window_handles)
+        except Exception:
+            return False
+
+    def checkout(self, timeout=None):
+        """
+        Empresta um navegador do pool, criando um novo se não houver ocioso.
+
+        Returns:
+            PooledDriver or None: O driver emprestado, ou None se não foi possível obter um.
+        """
+        if self._closed:
+            return None
+        if not self._slots.acquire(timeout=timeout):
+            self.logger.error("Tempo esgotado aguardando um WebDriver livre no pool.")
+            return None
+
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                pooled = self._create()
+                if pooled is None:
+                    self._slots.release()
+                return pooled
+
+            if self.is_healthy(pooled):
+                clear_download_dir(pooled.download_dir)
+                return pooled
+            self.logger.warning("WebDriver ocioso não respondeu à verificação de saúde. Substituindo.")
+            self._destroy(pooled)
+
+    def checkin(self, pooled, healthy=True):
+        """
+        Devolve um navegador ao pool. Drivers com falha ou no limite de usos são reciclados.
+        """
+        try:
+            pooled.uses += 1
+            if self._closed or not healthy or pooled.uses >= self.max_uses or not self.is_healthy(pooled):
+                self._destroy(pooled)
+            else:
+                self._idle.put(pooled)
+        finally:
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def driver(self, timeout=None):
+        """
+        Context manager que empresta um PooledDriver e o devolve ao final.
+        Se ocorrer uma exceção, o driver é descartado em vez de devolvido.
+
+        Uso:
+            with pool.driver() as pooled:
+                pooled.driver.get(url)
+        """
+        pooled = self.checkout(timeout=timeout)
+        if pooled is None:
+            yield None
+            return
+        healthy = False
+        try:
+            yield pooled
+            healthy = True
+        finally:
+            self.checkin(pooled, healthy=healthy)
+
+    def close(self):
+        """
+        Encerra todos os navegadores do pool.
+        """
+        self._closed = True
+        with self._lock:
+            all_drivers = list(self._all)
+        for pooled in all_drivers:
+            self._destroy(pooled)
+        self.logger.info("Pool de WebDrivers encerrado.")
@@ -0,0 +1,296 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from src.logger_config import module_logger
+
+# Situação de cada chave na fila
+STATUS_PENDING = "pending"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# Critérios de partição das chaves entre os workers
+SHARD_BY_HASH = "hash"
+SHARD_BY_FILIAL = "filial"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    access_key     TEXT PRIMARY KEY,
+    filial_code    TEXT NOT NULL,
+    shard          INTEGER NOT NULL,
+    status         TEXT NOT NULL,
+    worker_id      TEXT,
+    lease_expires  REAL,
+    attempts       INTEGER NOT NULL DEFAULT 0,
+    last_error     TEXT,
+    updated_at     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS work_items_claim ON work_items (status, shard);
+CREATE INDEX IF NOT EXISTS work_items_worker ON work_items (worker_id, status);
+"""
+
+# Chaves gravadas por transação ao enfileirar
+_ENQUEUE_CHUNK = 1000
+
+
+def shard_for(filial_code, key, shard_count, shard_by=SHARD_BY_HASH):
+    """
+    Partição (0 a shard_count - 1) de uma chave. Usa CRC32, estável entre processos e
+    hosts (ao contrário de hash(), que muda a cada execução do Python).
+    """
+    if shard_by not in (SHARD_BY_HASH, SHARD_BY_FILIAL):
+        raise ValueError(f"Critério de partição desconhecido: {shard_by!r}")
+    value = key if shard_by == SHARD_BY_HASH else filial_code
+    return zlib.crc32(value.encode("utf-8")) % max(1, shard_count)
+
+
+class WorkQueue:
+    """
+    Fila de chaves compartilhada entre processos (e hosts com o mesmo arquivo), em SQLite.
+
+    Cada worker reserva um lote de chaves por um prazo (lease). Enquanto trabalha, renova
+    o prazo com renew(); ao terminar cada chave, chama complete() ou fail(). Se o worker
+    cair, o prazo expira e as chaves voltam a ser reservadas por outro worker, até
+    `max_attempts` reservas, depois das quais a chave é dada como falha.
+
+    As chaves são divididas em partições (por hash da chave ou por filial): cada worker
+    reserva primeiro das suas partições e, quando elas se esgotam, das demais, para que
+    nenhum worker fique parado enquanto há trabalho.
+
+    Args:
+        db_path (str): Caminho do arquivo SQLite.
+        lease_seconds (float): Prazo de cada reserva.
+        max_attempts (int): Reservas de uma chave antes de ela ser marcada como falha.
+    """
+
+    def __init__(self, db_path, lease_seconds=120, max_attempts=3):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # timeout: espera a trava do arquivo em vez de falhar quando outro processo está gravando
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _transaction(self, statements):
+        """
+        Executa statements(conn) dentro de BEGIN IMMEDIATE (trava de escrita desde o início,
+        para que dois processos não reservem a mesma chave).
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, filial_keys, shard_count, shard_by=SHARD_BY_HASH):
+        """
+        Acrescenta as tuplas (filial_code, key) à fila. Chaves já presentes são mantidas,
+        exceto as que falharam, que voltam a ficar pendentes. Retorna quantas chaves
+        foram enfileiradas (novas ou reabertas).
+        """
+        sql = """
+            INSERT INTO work_items (access_key, filial_code, shard, status, attempts, updated_at)
+            VALUES (?, ?, ?, 'pending', 0, ?)
+            ON CONFLICT(access_key) DO UPDATE SET
+                status = 'pending', attempts = 0, worker_id = NULL, lease_expires = NULL, updated_at = excluded.updated_at
+            WHERE work_items.status = 'failed'
+        """
+
+        def insert(rows):
+            def statements(conn):
+                before = conn.total_changes
+                conn.executemany(sql, rows)
+                return conn.total_changes - before
+            return self._transaction(statements)
+
+        enqueued = 0
+        rows = []
+        now = time.time()
+        for filial_code, key in filial_keys:
+            rows.append((key, filial_code, shard_for(filial_code, key, shard_count, shard_by), now))
+            if len(rows) >= _ENQUEUE_CHUNK:
+                enqueued += insert(rows)
+                rows = []
+        if rows:
+            enqueued += insert(rows)
+        return enqueued
+
+    def claim(self, worker_id, limit, shards=None, exclusive=False):
+        """
+        Reserva até `limit` chaves para o worker e retorna a lista de (filial_code, key).
+
+        Chaves pendentes ou com reserva expirada são elegíveis; as das partições `shards`
+        vêm primeiro. Com exclusive=True, apenas essas partições são consultadas.
+        """
+        def statements(conn):
+            now = time.time()
+            # Reservas expiradas que já esgotaram as tentativas viram falha definitiva
+            conn.execute(
+                """
+                UPDATE work_items SET status = 'failed', worker_id = NULL, lease_expires = NULL, updated_at = ?,
+                    last_error = 'Prazo de reserva expirado (worker interrompido) em todas as tentativas.'
+                WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+                """,
+                (now, now, self.max_attempts),
+            )
+
+            eligible = "(status = 'pending' OR (status = 'leased' AND lease_expires < ?))"
+            claimed = []
+            queries = []
+            if shards:
+                shard_filter = f"shard IN ({','.join('?' * len(shards))})"
+                queries.append((f"{eligible} AND {shard_filter}", [now, *shards]))
+                if not exclusive:
+                    queries.append((f"{eligible} AND NOT {shard_filter}", [now, *shards]))
+            else:
+                queries.append((eligible, [now]))
+
+            for where, params in queries:
+                if len(claimed) >= limit:
+                    break
+                claimed.extend(conn.execute(
+                    f"SELECT filial_code, access_key FROM work_items WHERE {where} ORDER BY rowid LIMIT ?",
+                    (*params, limit - len(claimed)),
+                ).fetchall())
+
+            conn.executemany(
+                """
+                UPDATE work_items SET status = 'leased', worker_id = ?, lease_expires = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE access_key = ?
+                """,
+                [(worker_id, now + self.lease_seconds, now, key) for _, key in claimed],
+            )
+            return claimed
+
+        return self._transaction(statements)
+
+    def renew(self, worker_id):
+        """
+        Estende o prazo de todas as chaves reservadas pelo worker. Retorna quantas foram renovadas.
+        """
+        def statements(conn):
+            now = time.time()
+            cursor = conn.execute(
+                "UPDATE work_items SET lease_expires = ?, updated_at = ? WHERE worker_id = ? AND status = 'leased'",
+                (now + self.lease_seconds, now, worker_id),
+            )
+            return cursor.rowcount
+        return self._transaction(statements)
+
+    def complete(self, worker_id, key):
+        """
+        Marca a chave como concluída. Retorna False se ela não estava mais reservada pelo
+        worker (o prazo expirou e outro worker a assumiu).
+        """
+        return self._finish(worker_id, key, STATUS_DONE, None)
+
+    def fail(self, worker_id, key, error):
+        """
+        Marca a chave como falha (voltará a ser tentada ao ser enfileirada de novo).
+        """
+        return self._finish(worker_id, key, STATUS_FAILED, str(error))
+
+    def _finish(self, worker_id, key, status, error):
+        def statements(conn):
+            cursor = conn.execute(
+                """
+                UPDATE work_items SET status = ?, last_error = ?, worker_id = NULL, lease_expires = NULL, updated_at = ?
+                WHERE access_key = ? AND worker_id = ? AND status = 'leased'
+                """,
+                (status, error, time.time(), key, worker_id),
+            )
+            return cursor.rowcount == 1
+        return self._transaction(statements)
+
+    def release(self, worker_id):
+        """
+        Devolve à fila as chaves reservadas e não concluídas pelo worker (encerramento
+        normal), sem contar a reserva como tentativa. Retorna quantas foram devolvidas.
+        """
+        def statements(conn):
+            cursor = conn.execute(
+                """
+                UPDATE work_items SET status = 'pending', worker_id = NULL, lease_expires = NULL,
+                    attempts = MAX(attempts - 1, 0), updated_at = ?
+                WHERE worker_id = ? AND status = 'leased'
+                """,
+                (time.time(), worker_id),
+            )
+            return cursor.rowcount
+        return self._transaction(statements)
+
+    def open_count(self, exclude_worker=None):
+        """
+        Chaves ainda não resolvidas (pendentes ou reservadas), ignorando as reservadas por `exclude_worker`.
+        """
+        with self._lock:
+            return self._conn.execute(
+                """
+                SELECT COUNT(*) FROM work_items
+                WHERE status = 'pending' OR (status = 'leased' AND worker_id IS NOT ?)
+                """,
+                (exclude_worker,),
+            ).fetchone()[0]
+
+    def counts(self):
+        """
+        Quantidade de chaves por situação, ex: {"pending": 10, "leased": 4, "done": 86}.
+        """
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM work_items GROUP BY status").fetchall())
+
+    def failures(self, limit=20):
+        """
+        Últimas chaves que falharam: lista de (filial_code, key, last_error).
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT filial_code, access_key, last_error FROM work_items WHERE status = 'failed' "
+                "ORDER BY updated_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LeaseHeartbeat:
+    """
+    Thread que renova periodicamente as reservas de um worker enquanto ele está vivo.
+    """
+
+    def __init__(self, work_queue, worker_id, interval, logger):
+        self.work_queue = work_queue
+        self.worker_id = worker_id
+        self.interval = interval
+        self.logger = module_logger(logger, __name__)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="fila-renovacao", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.work_queue.renew(self.worker_id)
+            except sqlite3.Error as e:
+                self.logger.warning(f"Não foi possível renovar as reservas do worker {self.worker_id}: {e}")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,149 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import (
+    OUTPUT_MODE,
+    STORAGE_BACKEND,
+    STORAGE_MAX_CONCURRENCY,
+    WRITER_MAX_WORKERS,
+    WRITER_MAX_PENDING,
+)
+from src.pipeline.archive import ArchiveStore, MEMBER_SEPARATOR
+from src.pipeline.metrics import metrics
+from src.pipeline.storage import (
+    BACKEND_LOCAL,
+    FSYNC_EACH,
+    FSYNC_BATCH,
+    LocalStorage,
+    create_storage,
+    discard_documents,
+    document_relative_paths,
+)
+from src.logger_config import module_logger
+
+# Modos de saída: arquivos soltos em pastas ou pacotes .tar diários por filial
+OUTPUT_MODE_FILES = "arquivos"
+OUTPUT_MODE_ARCHIVE = "pacote"
+
+
+class DocumentWriter:
+    """
+    Gravação dos documentos (XML e PDF) fora das threads de download.
+
+    Os documentos são entregues ao armazenamento configurado (src/pipeline/storage.py):
+    disco local, com gravação atômica e cache de pastas, ou bucket S3/GCS. No modo
+    "pacote", as notas são acrescentadas ao .tar diário da filial (ver
+    src/pipeline/archive.py) em vez de virarem dois arquivos soltos.
+
+    Args:
+        storage: LocalStorage ou ObjectStorage.
+        max_workers (int): Threads de gravação em segundo plano.
+        max_pending (int): Documentos aguardando gravação antes de submit() bloquear
+            (limita a memória ocupada por XMLs/PDFs na fila).
+        output_mode (str): "arquivos" (pastas XML/DANFE) ou "pacote" (.tar por filial/dia).
+        logger: Logger do pipeline.
+    """
+
+    def __init__(self, storage=None, max_workers=WRITER_MAX_WORKERS, max_pending=WRITER_MAX_PENDING,
+                 output_mode=OUTPUT_MODE, logger=None):
+        if output_mode not in (OUTPUT_MODE_FILES, OUTPUT_MODE_ARCHIVE):
+            raise ValueError(f"Modo de saída desconhecido: {output_mode!r}")
+        self.logger = module_logger(logger, __name__)
+        self.storage = storage or LocalStorage(logger=self.logger)
+        self.output_mode = output_mode
+        self._archives = None
+        if output_mode == OUTPUT_MODE_ARCHIVE:
+            # O pacote cresce por acréscimo no mesmo arquivo, o que só é possível em disco local
+            if not isinstance(self.storage, LocalStorage):
+                raise ValueError("O modo de saída 'pacote' requer o armazenamento 'local'.")
+            self._archives = ArchiveStore(self.storage.base_path, logger=self.logger)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gravacao")
+        self._pending = threading.BoundedSemaphore(max(1, max_pending))
+
+    def save(self, filial_code, date_str, note_number, xml_content, pdf_content, access_key=None):
+        """
+        Grava o XML e o PDF de uma nota na thread atual.
+        Retorna (xml_location, pdf_location): caminhos locais, URIs do bucket ou, no modo
+        "pacote", <pacote>.tar#XML/<nNF>.xml. Lança exceção em caso de falha.
+        Os documentos podem ser bytes ou SpooledDocument (transferência em fluxo); os
+        arquivos temporários que não viraram o documento final são removidos ao final.
+        """
+        try:
+            with metrics.timer("stage_seconds", stage="salvar", storage=self.storage.name, mode=self.output_mode) as timer:
+                locations = self._save(filial_code, date_str, note_number, xml_content, pdf_content, access_key)
+                timer.set(outcome="ok")
+        finally:
+            discard_documents(xml_content, pdf_content)
+        return locations
+
+    def _save(self, filial_code, date_str, note_number, xml_content, pdf_content, access_key):
+        if self._archives is not None:
+            archive = self._archives.get(filial_code, date_str)
+            fsync_mode = self.storage.fsync_mode
+            xml_member, pdf_member = archive.append(
+                note_number, xml_content, pdf_content, access_key=access_key, fsync=fsync_mode == FSYNC_EACH
+            )
+            if fsync_mode == FSYNC_BATCH:
+                self.storage.schedule_sync(archive.archive_path, archive.index_path)
+            return (
+                archive.archive_path + MEMBER_SEPARATOR + xml_member,
+                archive.archive_path + MEMBER_SEPARATOR + pdf_member,
+            )
+
+        xml_path, pdf_path = document_relative_paths(filial_code, date_str, note_number)
+        return self.storage.put(xml_path, xml_content), self.storage.put(pdf_path, pdf_content)
+
+    def submit(self, filial_code, date_str, note_number, xml_content, pdf_content, access_key=None):
+        """
+        Agenda a gravação da nota em segundo plano e retorna um Future com
+        (xml_location, pdf_location). Bloqueia se já houver `max_pending` notas na fila.
+        """
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(
+                self.save, filial_code, date_str, note_number, xml_content, pdf_content, access_key
+            )
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def close(self):
+        """
+        Aguarda as gravações pendentes e fecha o armazenamento (fsync do último lote, uploads em andamento).
+        """
+        self._executor.shutdown(wait=True)
+        if self._archives is not None:
+            self._archives.close()
+        self.storage.close()
+
+
+_shared_writer = None
+_shared_writer_lock = threading.Lock()
+
+
+def get_document_writer():
+    """
+    Retorna o gravador compartilhado do processo, criando-o na primeira chamada.
+    """
+    global _shared_writer
+    if _shared_writer is None:
+        with _shared_writer_lock:
+            if _shared_writer is None:
+                storage = create_storage(STORAGE_BACKEND)
+                # Uploads para o bucket esperam a rede: mais threads mantêm o pool de conexões ocupado
+                max_workers = WRITER_MAX_WORKERS if STORAGE_BACKEND == BACKEND_LOCAL else STORAGE_MAX_CONCURRENCY
+                _shared_writer = DocumentWriter(storage=storage, max_workers=max_workers)
+    return _shared_writer
+
+
+def close_document_writer():
+    """
+    Conclui as gravações pendentes do gravador compartilhado (chamado ao final do pipeline).
+    """
+    global _shared_writer
+    with _shared_writer_lock:
+        if _shared_writer is not None:
+            _shared_writer.close()
+            _shared_writer = None
@@ -0,0 +1,292 @@
+"""
+Execução distribuída do pipeline: várias instâncias (processos ou hosts) consomem a
+mesma fila de chaves (src/pipeline/work_queue.py), cada uma com seu próprio GIL,
+pool de conexões e pool de threads.
+
+Uso:
+    python -m src.worker enfileirar                         # lê CHAVES NOTAS/ e alimenta a fila
+    python -m src.worker executar --processos 4             # enfileira e inicia 4 workers locais
+    python -m src.worker trabalhar --particoes 0,2          # um worker (ex: em outro host)
+    python -m src.worker situacao                           # chaves por situação e últimas falhas
+
+Em vários hosts, todos precisam enxergar o mesmo WORK_QUEUE_DB_PATH (e as mesmas pastas
+de saída e de estado) e cada um deve receber uma fração do limite de requisições
+(--req-por-segundo), já que o limite vale por processo.
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from src.logger_config import setup_logger, shutdown_logging
+from src.main import iter_pending_keys, process_and_save_key, write_run_report
+from src.pipeline.extract import iter_filial_keys
+from src.pipeline.fetchers import close_fetchers
+from src.pipeline.writer import close_document_writer
+from src.pipeline.danfe_renderer import close_danfe_render_pool
+from src.pipeline.key_cache import close_negative_cache
+from src.pipeline.run_state import RunStateStore
+from src.pipeline.http_client import close_http_client
+from src.pipeline.concurrency import TokenBucketRateLimiter, run_in_thread_pool
+from src.pipeline.metrics import metrics
+from src.pipeline.work_queue import WorkQueue, LeaseHeartbeat
+from src.config import (
+    INPUT_FOLDER,
+    MAX_WORKERS,
+    RATE_LIMIT_REQUESTS_PER_SECOND,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_MAX_IN_FLIGHT,
+    RESUME_ENABLED,
+    RUN_STATE_DB_PATH,
+    METRICS_REPORT_ENABLED,
+    WORK_QUEUE_DB_PATH,
+    WORK_QUEUE_LEASE_SECONDS,
+    WORK_QUEUE_CLAIM_BATCH,
+    WORK_QUEUE_MAX_ATTEMPTS,
+    WORK_QUEUE_POLL_SECONDS,
+    WORK_QUEUE_SHARD_BY,
+    WORK_QUEUE_SHARD_COUNT,
+    WORKER_PROCESSES,
+)
+
+def open_work_queue():
+    return WorkQueue(WORK_QUEUE_DB_PATH, lease_seconds=WORK_QUEUE_LEASE_SECONDS, max_attempts=WORK_QUEUE_MAX_ATTEMPTS)
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def shards_for_worker(index, worker_count, shard_count=WORK_QUEUE_SHARD_COUNT):
+    """
+    Partições atendidas primeiro pelo worker `index` de `worker_count` (index, index + N, ...).
+    """
+    return [shard for shard in range(shard_count) if shard % worker_count == index % worker_count]
+
+def enqueue_keys(logger):
+    """
+    Estágio de Extração da execução distribuída: lê as chaves da pasta de entrada e as
+    coloca na fila, pulando as já salvas (retomada). Retorna quantas foram enfileiradas.
+    """
+    logger.info(f"Enfileirando chaves da pasta '{INPUT_FOLDER}' em '{WORK_QUEUE_DB_PATH}'.")
+    extraction_stats = {"found": 0, "skipped": 0}
+    run_state = RunStateStore(RUN_STATE_DB_PATH) if RESUME_ENABLED else None
+    work_queue = open_work_queue()
+    try:
+        pending_keys_data = iter_pending_keys(iter_filial_keys(logger), run_state, extraction_stats)
+        enqueued = work_queue.enqueue(pending_keys_data, WORK_QUEUE_SHARD_COUNT, WORK_QUEUE_SHARD_BY)
+        logger.info(
+            f"{extraction_stats['found']} chave(s) encontrada(s), {extraction_stats['skipped']} já salva(s), "
+            f"{enqueued} enfileirada(s) em {WORK_QUEUE_SHARD_COUNT} partição(ões) por '{WORK_QUEUE_SHARD_BY}'."
+        )
+        return enqueued
+    finally:
+        work_queue.close()
+        if run_state is not None:
+            run_state.close()
+
+def iter_claimed_keys(work_queue, worker_id, shards, exclusive, logger, stop_event):
+    """
+    Gera as tuplas (filial_code, key) reservadas pelo worker, um lote de cada vez.
+
+    Com a fila vazia, mas chaves ainda reservadas por outros workers, espera e consulta
+    de novo: se algum deles cair, suas chaves voltam a ficar disponíveis quando o prazo
+    da reserva expira. Termina quando não há mais nada pendente fora deste worker.
+    """
+    while not stop_event.is_set():
+        batch = work_queue.claim(worker_id, WORK_QUEUE_CLAIM_BATCH, shards=shards, exclusive=exclusive)
+        if batch:
+            metrics.inc("work_queue_claims_total")
+            yield from batch
+            continue
+        open_elsewhere = work_queue.open_count(exclude_worker=worker_id)
+        if not open_elsewhere:
+            return
+        logger.debug(f"Fila sem chaves disponíveis; {open_elsewhere} ainda com outros workers. Aguardando.")
+        stop_event.wait(WORK_QUEUE_POLL_SECONDS)
+
+def run_worker(worker_id=None, shards=None, exclusive=False, requests_per_second=RATE_LIMIT_REQUESTS_PER_SECOND):
+    """
+    Consome a fila compartilhada até ela se esgotar, processando as chaves como o modo
+    "concorrente" (pool de threads + gravação em segundo plano). Retorna (sucessos, falhas).
+    """
+    worker_id = worker_id or default_worker_id()
+    logger = setup_logger()
+    logger.info(f"Worker {worker_id} iniciado (partições: {shards if shards else 'todas'}, {requests_per_second} req/s).")
+    metrics.reset()
+    work_queue = open_work_queue()
+    run_state = RunStateStore(RUN_STATE_DB_PATH) if RESUME_ENABLED else None
+    heartbeat = LeaseHeartbeat(work_queue, worker_id, max(1, WORK_QUEUE_LEASE_SECONDS / 3), logger).start()
+    stop_event = threading.Event()
+    rate_limiter = TokenBucketRateLimiter(
+        requests_per_second=requests_per_second,
+        max_in_flight=RATE_LIMIT_MAX_IN_FLIGHT,
+        burst=RATE_LIMIT_BURST,
+    )
+    counts = {"success": 0, "failure": 0}
+    counts_lock = threading.Lock()
+
+    def count(success):
+        with counts_lock:
+            counts["success" if success else "failure"] += 1
+
+    def worker(filial_key):
+        filial_code, key = filial_key
+
+        def on_saved(success):
+            if success:
+                work_queue.complete(worker_id, key)
+            else:
+                work_queue.fail(worker_id, key, "Falha ao salvar documentos.")
+            count(success)
+
+        try:
+            fetched = process_and_save_key(filial_code, key, logger, rate_limiter=rate_limiter, run_state=run_state, on_saved=on_saved)
+        except Exception as e:
+            work_queue.fail(worker_id, key, e)
+            raise
+        if not fetched:
+            # Marcada aqui (e não no laço abaixo) para a chave não continuar reservada enquanto a fila é consultada
+            work_queue.fail(worker_id, key, "Falha ao obter XML/DANFE.")
+        return fetched
+
+    try:
+        claimed = iter_claimed_keys(work_queue, worker_id, shards, exclusive, logger, stop_event)
+        for (filial_code, key), fetched, error in run_in_thread_pool(claimed, worker, MAX_WORKERS):
+            if error is not None:
+                logger.error(f"Erro inesperado ao processar a chave {key[:10]}... (Filial: {filial_code}): {error}", exc_info=error)
+                metrics.inc("keys_total", filial=filial_code, outcome="erro_inesperado")
+                if run_state is not None:
+                    run_state.record_failure(key, filial_code, error)
+            if not fetched:
+                count(False)
+        # Conclui as gravações pendentes (os callbacks marcam as chaves na fila)
+        close_document_writer()
+        logger.info(f"Worker {worker_id}: {counts['success']} nota(s) salva(s), {counts['failure']} falha(s).")
+    except KeyboardInterrupt:
+        logger.warning(f"Worker {worker_id} interrompido; as chaves não concluídas voltam para a fila.")
+        stop_event.set()
+    except Exception as e:
+        logger.critical(f"Erro crítico no worker {worker_id}: {e}", exc_info=True)
+    finally:
+        close_http_client()
+        close_fetchers()
+        close_danfe_render_pool()
+        close_document_writer()
+        close_negative_cache()
+        heartbeat.stop()
+        released = work_queue.release(worker_id)
+        if released:
+            logger.info(f"{released} chave(s) reservada(s) e não processada(s) devolvida(s) à fila.")
+        work_queue.close()
+        if run_state is not None:
+            run_state.close()
+        if METRICS_REPORT_ENABLED:
+            try:
+                processed = counts["success"] + counts["failure"]
+                write_run_report(
+                    logger, {"found": processed, "skipped": 0}, counts["success"], counts["failure"],
+                    extra={"execution_mode": "distribuido", "worker_id": worker_id, "shards": shards},
+                    suffix=worker_id,
+                )
+            except OSError as e:
+                logger.error(f"Não foi possível gravar o relatório do worker: {e}")
+        shutdown_logging()
+    return counts["success"], counts["failure"]
+
+def _worker_process(worker_id, shards, requests_per_second):
+    run_worker(worker_id, shards=shards, requests_per_second=requests_per_second)
+
+def run_local_workers(processes=WORKER_PROCESSES):
+    """
+    Enfileira as chaves e inicia `processes` workers neste host, dividindo entre eles as
+    partições e o limite de requisições. Retorna as contagens finais da fila.
+    """
+    logger = setup_logger()
+    logger.info(f"Iniciando execução distribuída em {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} com {processes} processo(s).")
+    enqueue_keys(logger)
+    shutdown_logging()
+
+    started = time.perf_counter()
+    # "spawn": cada worker começa com um interpretador limpo (sem threads herdadas do pai)
+    context = multiprocessing.get_context("spawn")
+    requests_per_second = RATE_LIMIT_REQUESTS_PER_SECOND / processes
+    host = socket.gethostname()
+    workers = [
+        context.Process(
+            target=_worker_process,
+            args=(f"{host}-w{index}", shards_for_worker(index, processes), requests_per_second),
+            name=f"worker-{index}",
+        )
+        for index in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+    logger = setup_logger()
+    work_queue = open_work_queue()
+    try:
+        counts = work_queue.counts()
+    finally:
+        work_queue.close()
+    elapsed = time.perf_counter() - started
+    finished = counts.get("done", 0) + counts.get("failed", 0)
+    logger.info(
+        f"Execução distribuída finalizada em {elapsed:.1f}s: {counts.get('done', 0)} concluída(s), "
+        f"{counts.get('failed', 0)} falha(s), {finished / elapsed if elapsed else 0:.1f} chaves/s."
+    )
+    shutdown_logging()
+    return counts
+
+def print_queue_status():
+    work_queue = open_work_queue()
+    try:
+        counts = work_queue.counts()
+        print(f"Fila: {WORK_QUEUE_DB_PATH}")
+        for status in ("pending", "leased", "done", "failed"):
+            print(f"  {status:<8} {counts.get(status, 0)}")
+        failures = work_queue.failures()
+        if failures:
+            print("Últimas falhas:")
+            for filial_code, key, error in failures:
+                print(f"  {filial_code} {key}: {error}")
+    finally:
+        work_queue.close()
+
+def parse_shards(value):
+    return [int(shard) for shard in value.split(",") if shard.strip()] if value else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("enfileirar", help="Lê as chaves da pasta de entrada e alimenta a fila.")
+
+    run_parser = commands.add_parser("executar", help="Enfileira as chaves e inicia workers neste host.")
+    run_parser.add_argument("--processos", type=int, default=WORKER_PROCESSES, help="Quantidade de processos worker.")
+
+    work_parser = commands.add_parser("trabalhar", help="Inicia um worker que consome a fila até ela se esgotar.")
+    work_parser.add_argument("--id", help="Identificador do worker (padrão: host-pid).")
+    work_parser.add_argument("--particoes", type=parse_shards, help="Partições atendidas primeiro (ex: 0,2).")
+    work_parser.add_argument("--exclusivo", action="store_true", help="Atende apenas as partições informadas.")
+    work_parser.add_argument("--req-por-segundo", type=float, default=RATE_LIMIT_REQUESTS_PER_SECOND,
+                             help="Limite de requisições deste worker.")
+
+    commands.add_parser("situacao", help="Mostra as chaves por situação e as últimas falhas.")
+
+    args = parser.parse_args()
+    if args.command == "enfileirar":
+        enqueue_keys(setup_logger())
+        shutdown_logging()
+    elif args.command == "executar":
+        run_local_workers(args.processos)
+    elif args.command == "trabalhar":
+        run_worker(args.id, shards=args.particoes, exclusive=args.exclusivo, requests_per_second=args.req_por_segundo)
+    else:
+        print_queue_status()
+
+if __name__ == "__main__":
+    main()